@@ -0,0 +1,99 @@
+""" Compares the cycle handling methods of RouteSelector (--cycle-method) on a route graph.
+Reports the time to set cycle constraints, the number of cycle constraints (for lazy, those added 
+while solving), the solve time, the objective and the number of lazy re-solve rounds.
+
+Example:
+    python scripts/benchmark_cycles.py --graph examples/garibsingh/trees_w_info.json --target-csv examples/garibsingh/targets.csv --reward-weight 20
+    python scripts/benchmark_cycles.py --ladder 12
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import time
+import tempfile
+import pandas as pd
+
+from sparrow.route_graph import RouteGraph
+from sparrow.route_selector import RouteSelector
+
+
+def ladder_graph(n_rungs: int):
+    """
+    Builds a graph of n_rungs layers of two intermediates, where every intermediate can be 
+    converted into either intermediate of the neighboring layers and back. The number of 
+    simple cycles grows exponentially with n_rungs. Returns the graph and a target dict.
+    """
+    graph = RouteGraph()
+    layers = [(f'C{"C"*i}O', f'C{"C"*i}N') for i in range(n_rungs)]
+    for prev_layer, layer in zip(layers[:-1], layers[1:]):
+        for u in prev_layer:
+            for v in layer:
+                graph.add_reaction_node(f'{u}>>{v}')
+                graph.add_reaction_node(f'{v}>>{u}')
+
+    graph.compound_nodes[layers[0][0]].update(buyable=True, cost_per_g=1)
+    for node in graph.reaction_nodes_only():
+        node.update(score=0.5)
+
+    return graph, {layers[-1][1]: 10}
+
+
+def benchmark(graph_fn, target_dict, methods, weights):
+    rows = []
+    for method in methods:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            selector = RouteSelector(
+                route_graph=graph_fn(),
+                target_dict=target_dict,
+                weights=weights,
+                output_dir=tmp_dir,
+                cycle_method=method,
+            )
+            selector.define_variables()
+            selector.set_objective()
+            selector.set_rxn_constraints()
+            selector.set_mol_constraints()
+            n_before = selector.model.n_rows
+
+            start = time.time()
+            selector.set_cycle_constraints()
+            build_time = time.time() - start
+
+            start = time.time()
+            selector.optimize()
+            solve_time = time.time() - start
+            # lazy constraints are only added while solving 
+            n_cycle = selector.model.n_rows - n_before
+
+            rows.append({
+                'Method': method,
+                'Cycle constraints': n_cycle,
+                'Cycle build time (s)': build_time,
+                'Solve time (s)': solve_time,
+                'Objective': selector.objective_value(),
+                'Rounds': selector.solver_info.get('cycle_rounds', 0),
+            })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--graph', type=str, default=None, help='route graph json or binary file')
+    parser.add_argument('--target-csv', type=str, default=None, help='csv with SMILES and Reward columns')
+    parser.add_argument('--ladder', type=int, default=None, help='benchmark a synthetic ladder graph with this many rungs instead')
+    parser.add_argument('--methods', type=str, nargs='+', default=['simple', 'ordering', 'lazy'])
+    parser.add_argument('--reward-weight', type=float, default=1)
+    parser.add_argument('--start-cost-weight', type=float, default=1)
+    parser.add_argument('--reaction-weight', type=float, default=1)
+    args = parser.parse_args()
+
+    weights = [args.reward_weight, args.start_cost_weight, args.reaction_weight, 0]
+    if args.ladder is not None:
+        graph_fn = lambda: ladder_graph(args.ladder)[0]
+        target_dict = ladder_graph(args.ladder)[1]
+    else:
+        df = pd.read_csv(args.target_csv)
+        target_dict = dict(zip(df['SMILES'], df['Reward']))
+        graph_fn = lambda: RouteGraph(node_filename=Path(args.graph))
+
+    print(benchmark(graph_fn, target_dict, args.methods, weights).to_string(index=False))
@@ -0,0 +1,76 @@
+""" Builds the LookupCoster index of an inventory and times building, opening and batch lookups.
+Without --inventory, a random inventory of --n-rows made-up compounds (with several offers per
+compound) is written to a temporary csv first.
+
+Example:
+    python scripts/benchmark_inventory.py --n-rows 1000000 --n-jobs 8
+    python scripts/benchmark_inventory.py --inventory inventory.parquet --n-queries 5000
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import tempfile
+import random
+import time
+import pandas as pd
+
+from sparrow.coster import LookupCoster
+from sparrow.utils.inventory_index import iter_inventory
+
+
+def random_smiles(rng: random.Random) -> str:
+    """ Random acyclic molecule, optionally on a benzene ring, as a (non-canonical) smiles """
+    atoms = []
+    for _ in range(rng.randint(3, 16)):
+        atom = rng.choice(['C', 'C', 'C', 'N', 'O'])
+        if atom == 'C' and rng.random() < 0.3:
+            atom += rng.choice(['(C)', '(O)', '(=O)', '(N)', '(F)', '(Cl)'])
+        atoms.append(atom)
+    prefix = 'c1ccccc1' if rng.random() < 0.3 else ''
+    return prefix + ''.join(atoms)
+
+
+def write_inventory(filename: Path, n_rows: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    smis = [random_smiles(rng) for _ in range(n_rows)]
+    pd.DataFrame({
+        'SMILES': smis,
+        'Price': [round(rng.uniform(5, 500), 2) for _ in range(n_rows)],
+        'Pack_mg': [rng.choice([100, 250, 1000, 5000]) for _ in range(n_rows)],
+    }).to_csv(filename, index=False)
+    return
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--inventory', type=str, default=None, help='csv, tsv or parquet inventory (default: a random one)')
+    parser.add_argument('--n-rows', type=int, default=1000000, help='rows of the random inventory')
+    parser.add_argument('--n-queries', type=int, default=2000, help='compounds per batch lookup, half of them from the inventory')
+    parser.add_argument('--n-jobs', type=int, default=1, help='processes used to canonicalize the inventory')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        inventory = args.inventory
+        if inventory is None:
+            inventory = Path(tmp_dir)/'inventory.csv'
+            start = time.time()
+            write_inventory(inventory, args.n_rows)
+            print(f'Wrote random inventory of {args.n_rows} rows in {time.time() - start:0.1f} s')
+        index_file = Path(tmp_dir)/'inventory.index.sqlite'
+
+        start = time.time()
+        LookupCoster(inventory, index_file=index_file, n_jobs=args.n_jobs)
+        build_time = time.time() - start
+
+        start = time.time()
+        coster = LookupCoster(inventory, index_file=index_file)
+        open_time = time.time() - start
+
+        known = next(iter_inventory(inventory, args.n_queries//2))['SMILES'].tolist()
+        rng = random.Random(1)
+        queries = known + [random_smiles(rng) + 'CCCCCCCCCCCCCCCCC' for _ in range(args.n_queries - len(known))]
+        start = time.time()
+        results = coster.buyable_and_costs(queries)
+        query_time = time.time() - start
+
+    print(f'Build: {build_time:0.1f} s, open: {1000*open_time:0.1f} ms, '
+          f'lookup of {len(queries)} compounds: {1000*query_time:0.1f} ms ({sum(b for b, _ in results.values())} buyable)')
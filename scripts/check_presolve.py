@@ -0,0 +1,83 @@
+""" Checks that RouteSelector.presolve does not change the optimum. Every example with a bundled
+route graph is solved with and without presolve for several weights, and the number of fixed
+variables, the objectives and the solve times are reported. Exits with status 1 if any optimum differs.
+
+Example:
+    python scripts/check_presolve.py
+    python scripts/check_presolve.py --graph examples/garibsingh/trees_w_info.json --target-csv examples/garibsingh/targets.csv --weights 20,1,1,0
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+import time
+import tempfile
+import pandas as pd
+
+from sparrow.route_graph import RouteGraph
+from sparrow.route_selector import RouteSelector
+
+EXAMPLES = [
+    ('examples/garibsingh/trees_w_info.json', 'examples/garibsingh/targets.csv'),
+    ('examples/amd/trees_w_info.json', 'examples/amd/targets.csv'),
+    ('examples/button_alectinib/trees_w_info.json', 'examples/button_alectinib/alectinib_rewards.csv'),
+]
+
+WEIGHTS = [[1, 1, 1, 0], [5, 1, 1, 0], [20, 1, 1, 0], [100, 1, 1, 0], [20, 1, 1, 2]]
+
+
+def check(graph_file, target_csv, weights, cycle_method):
+    df = pd.read_csv(target_csv)
+    target_dict = dict(zip(df['SMILES'], df['Reward']))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        selector = RouteSelector(
+            route_graph=RouteGraph(node_filename=Path(graph_file)),
+            target_dict=target_dict,
+            weights=list(weights[0]),
+            output_dir=tmp_dir,
+            cycle_method=cycle_method,
+        )
+        selector.prune_dead_ends()
+        selector.build_model()
+        for lams in weights:
+            selector.weights = list(lams)
+            selector.set_objective()
+            row = {'Graph': graph_file, 'Weights': ','.join(f'{lam:g}' for lam in lams)}
+            for presolve in [False, True]:
+                start = time.time()
+                selector.optimize(presolve=presolve)
+                row[f'Objective ({"presolve" if presolve else "full"})'] = selector.objective_value()
+                row[f'Solve time ({"presolve" if presolve else "full"}) (s)'] = time.time() - start
+                if presolve:
+                    row.update({f'Fixed {name}': count for name, count in selector.solver_info['presolve'].items()})
+
+            row['Same optimum'] = abs(row['Objective (presolve)'] - row['Objective (full)']) <= 1e-6*max(1, abs(row['Objective (full)']))
+            rows.append(row)
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--graph', type=str, default=None, help='route graph json or binary file (default: all bundled examples)')
+    parser.add_argument('--target-csv', type=str, default=None, help='csv with SMILES and Reward columns')
+    parser.add_argument('--weights', type=str, nargs='+', default=None,
+                        help='comma-separated reward, starting material cost, reaction and diversity weights, e.g. 20,1,1,0')
+    parser.add_argument('--cycle-method', type=str, default='simple', choices=['simple', 'ordering', 'lazy'])
+    args = parser.parse_args()
+
+    weights = WEIGHTS if args.weights is None else [[float(lam) for lam in w.split(',')] for w in args.weights]
+    examples = EXAMPLES if args.graph is None else [(args.graph, args.target_csv)]
+
+    rows = []
+    for graph_file, target_csv in examples:
+        if not Path(graph_file).exists():
+            print(f'Skipping {graph_file}, the route graph is not bundled')
+            continue
+        rows.extend(check(graph_file, target_csv, weights, args.cycle_method))
+
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False))
+    if not df['Same optimum'].all():
+        print('Presolve changed the optimum')
+        sys.exit(1)
@@ -0,0 +1,148 @@
+""" Local stub of the ChemSpace API, to test costers without an API key or quota.
+
+The stub serves GET /auth/token and POST /v3/search/exact like ChemSpace: access tokens
+expire after --token-lifetime seconds (401 afterwards), and more than --quota searches in any
+--window seconds are answered with 429 and a Retry-After header. --error-rate answers that
+fraction of searches with 503. Whether a compound is buyable, and its price, are derived
+from a hash of the smiles, so results can be checked.
+
+Run as a script, it starts the stub, prices --n-compounds made-up compounds with
+AsyncChemSpaceCoster, checks the results, and reports the time and the server and coster counters.
+
+Example:
+    python scripts/chemspace_stub.py --n-compounds 200 --quota 35 --window 5 --token-lifetime 4
+"""
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque
+import threading
+import random
+import json
+import time
+import re
+import zlib
+
+from sparrow.coster import AsyncChemSpaceCoster
+
+
+def stub_cost(smiles: str):
+    """ Cost in USD/g the stub reports for smiles, or None if it is not buyable """
+    h = zlib.crc32(smiles.encode('utf-8'))
+    if h % 3 == 0:
+        return None
+    return float(h % 1000 + 1)
+
+
+def make_handler(quota, window, token_lifetime, latency, error_rate):
+    lock = threading.Lock()
+    searches = deque()
+    tokens = {}
+    stats = {'token requests': 0, 'searches': 0, '200': 0, '401': 0, '429': 0, '503': 0}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            return
+
+        def reply(self, code, content=None, headers=None):
+            body = json.dumps(content if content is not None else {}).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if not self.path.endswith('auth/token'):
+                return self.reply(404)
+            with lock:
+                stats['token requests'] += 1
+                token = f'token-{stats["token requests"]}'
+                tokens[token] = time.time()
+            self.reply(200, {'access_token': token, 'expires_in': token_lifetime})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+            if not self.path.startswith('/v3/search/exact'):
+                return self.reply(404)
+
+            token = self.headers.get('Authorization', '').replace('Bearer ', '')
+            now = time.time()
+            with lock:
+                stats['searches'] += 1
+                if token not in tokens or now - tokens[token] > token_lifetime:
+                    stats['401'] += 1
+                    return self.reply(401, {'message': 'token expired'})
+
+                while searches and now - searches[0] > window:
+                    searches.popleft()
+                if len(searches) >= quota:
+                    stats['429'] += 1
+                    retry_after = max(window - (now - searches[0]), 0)
+                    return self.reply(429, {'message': 'too many requests'}, {'Retry-After': f'{retry_after:0.2f}'})
+                searches.append(now)
+
+                if random.random() < error_rate:
+                    stats['503'] += 1
+                    return self.reply(503, {'message': 'unavailable'})
+                stats['200'] += 1
+
+            time.sleep(latency)
+            smiles = re.search(r'name="SMILES"\r\n\r\n(.*?)\r\n--', body, re.S).group(1)
+            cost = stub_cost(smiles)
+            items = [] if cost is None else [{
+                'offers': [{'shipsWithin': 5, 'purity': 95, 'prices': [{'priceUsd': cost, 'packMg': 1000}]}]
+            }]
+            self.reply(200, {'count': len(items), 'items': items})
+
+    return StubHandler, stats
+
+
+def start_stub(port=0, quota=35, window=60, token_lifetime=3600, latency=0.2, error_rate=0):
+    """ Starts the stub in a background thread, returns the server and its counters """
+    handler, stats = make_handler(quota, window, token_lifetime, latency, error_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n-compounds', type=int, default=200)
+    parser.add_argument('--quota', type=int, default=35, help='searches allowed in any window')
+    parser.add_argument('--window', type=float, default=5, help='quota window in seconds')
+    parser.add_argument('--token-lifetime', type=float, default=4, help='seconds until an access token expires')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds the stub takes to answer a search')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of searches answered with 503')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--coster-quota', type=int, default=None,
+                        help='quota the coster assumes (default: --quota), set it higher to test 429 handling')
+    args = parser.parse_args()
+
+    server, server_stats = start_stub(
+        quota=args.quota, window=args.window, token_lifetime=args.token_lifetime,
+        latency=args.latency, error_rate=args.error_rate,
+    )
+    coster = AsyncChemSpaceCoster(
+        api_key='stub',
+        base_url=f'http://127.0.0.1:{server.server_address[1]}/',
+        max_concurrent=args.concurrency,
+        searches_per_window=args.quota if args.coster_quota is None else args.coster_quota,
+        window=args.window,
+        token_refresh_margin=args.token_lifetime/4,
+    )
+    coster.token_expiration_time = args.token_lifetime
+
+    smis = ['C'*(i % 20 + 1) + 'O'*(i // 20) for i in range(args.n_compounds)]
+    start = time.time()
+    results = coster.buyable_and_costs(smis)
+    elapsed = time.time() - start
+    server.shutdown()
+
+    wrong = [smi for smi, (buyable, cost) in results.items() if cost != stub_cost(smi) or buyable != (cost is not None)]
+    n_windows = elapsed / args.window
+    print(f'Priced {len(results)} of {len(smis)} compounds in {elapsed:0.1f} s ({len(results)/n_windows:0.1f} per window, quota {args.quota})')
+    print(f'Server: {server_stats}')
+    print(f'Coster: {coster.stats}')
+    print(f'Wrong results: {len(wrong)}')
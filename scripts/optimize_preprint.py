@@ -14,33 +14,25 @@ def opt_garib(vary_l1=True, vary_l2=True, vary_l3=True):
     reward_lam = [2, 5, 8, 12.5, 15, 20, 30, 50, 60, 70, 80]
 
     if vary_l1: 
-        for i, lam in enumerate(reward_lam):
-            out_folder = out_dir / f'lam_{lam}_1_1'
-            cmd = f'sparrow --config {conf_path} --output-dir {out_folder} --reward-weight {lam} --start-cost-weight 1 --reaction-weight 1'
-            
-            cmds.append(cmd)
+        # one process per sweep, results are saved to out_dir/lam_{lam}_1_1
+        cmd = f'sparrow --config {conf_path} --output-dir {out_dir} --sweep reward_weight={",".join(map(str, reward_lam))} --start-cost-weight 1 --reaction-weight 1'
+        cmds.append(cmd)
 
 
     # vary lambda_2 
     out_dir = Path(f'results/garibsingh_cost_vary')
     lam_cost = [0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.7, 1.3, 2]
     if vary_l2: 
-        for i, lam in enumerate(lam_cost):
-            out_folder = out_dir / f'lam_20_{lam}_1'
-            cmd = f'sparrow --config {conf_path} --output-dir {out_folder} --reward-weight 20 --start-cost-weight {lam} --reaction-weight 1'
-            
-            cmds.append(cmd)
+        cmd = f'sparrow --config {conf_path} --output-dir {out_dir} --reward-weight 20 --sweep start_cost_weight={",".join(map(str, lam_cost))} --reaction-weight 1'
+        cmds.append(cmd)
 
 
     # vary lambda_3 
     out_dir = Path(f'results/garibsingh_rxn_vary')
     rxn_lam = [0, 0.1, 0.25, 0.35, 0.5, 1, 1.5, 1.7, 2, 3, 4, 5]
     if vary_l3: 
-        for i, lam in enumerate(rxn_lam):
-            out_folder = out_dir / f'lam_20_1_{lam}'
-            cmd = f'sparrow --config {conf_path} --output-dir {out_folder} --reward-weight 20 --start-cost-weight 1 --reaction-weight {lam}'
-            
-            cmds.append(cmd)
+        cmd = f'sparrow --config {conf_path} --output-dir {out_dir} --reward-weight 20 --start-cost-weight 1 --sweep reaction_weight={",".join(map(str, rxn_lam))}'
+        cmds.append(cmd)
 
     return cmds
 
@@ -1,5 +1,6 @@
 from configargparse import ArgumentParser
 from pathlib import Path
+from sparrow.utils.price_cache import DEFAULT_PRICE_CACHE
 
 def get_args(args: str = None):
     parser = ArgumentParser()
@@ -15,7 +16,7 @@ def get_args(args: str = None):
     
     # path to graph object if just rerunning optimization 
     parser.add_argument('--graph', type=str, action='store', default=None, 
-                        help='path to route graph json file. If provided, no route planning is performed')
+                        help='path to route graph json file (or binary graph file written by RouteGraph.to_binary). If provided, no route planning is performed')
 
     parser = add_tree_build_args(parser)
     parser = add_condition_rec_args(parser)
@@ -43,6 +44,12 @@ def add_tree_build_args(parser):
                         help='maximum branch factor for ASKCOS MCTS tree search')
     parser.add_argument('--tree-host', default=None, action='store', type=str, 
                     help='host address for tree builder, if using ASKCOS API path finder')
+    
+    # combining trees 
+    parser.add_argument('--n-jobs', default=1, action='store', type=int, 
+                        help='number of processes used to combine retrosynthesis tree files and to solve independent subproblems (see --decompose)')
+    parser.add_argument('--files-per-job', default=100, action='store', type=int, 
+                        help='maximum number of tree files combined by one process before partial trees are merged')
     return parser
 
 def add_condition_rec_args(parser):    
@@ -63,7 +70,7 @@ def add_condition_rec_args(parser):
 
 def add_coster_args(parser): 
     parser.add_argument('--coster', default=None, action='store', type=str,
-                        choices=['naive', 'chemspace'], 
+                        choices=['naive', 'chemspace', 'lookup'], 
                         help='type of compound coster to use')
     
     # Naive Coster - no arguments 
@@ -71,10 +78,31 @@ def add_coster_args(parser):
     # Chemspace coster
     parser.add_argument('--key-path', action='store', type=str, default=str(Path.cwd()),
                         help='path that includes the file keys.py with chemspace api key')    
+    parser.add_argument('--coster-concurrency', action='store', type=int, default=8,
+                        help='maximum number of chemspace searches in flight at once')
+    parser.add_argument('--searches-per-minute', action='store', type=int, default=35,
+                        help='chemspace search quota per minute')
+    
+    parser.add_argument('--price-cache', action='store', type=str, default=str(DEFAULT_PRICE_CACHE),
+                        help='sqlite file in which compound buyability and prices are cached across runs')
+    parser.add_argument('--price-cache-ttl', action='store', type=float, default=30,
+                        help='days after which cached prices are searched again (0 to keep them forever)')
+    parser.add_argument('--no-price-cache', action='store_true', default=False,
+                        help='always search for buyability and prices and do not cache them')
+    
+    # targeted costing 
+    parser.add_argument('--targeted-costing', action='store_true', default=False,
+                        help='price compounds in order of how likely they are to be starting materials (ASKCOS price, leaf of the trees, number of targets reached)')
+    parser.add_argument('--costing-max-requests', action='store', type=int, default=None,
+                        help='maximum number of compounds searched by the coster (implies --targeted-costing); compounds not searched are not buyable')
+    parser.add_argument('--costing-time-limit', action='store', type=float, default=None,
+                        help='seconds after which no more compounds are searched by the coster (implies --targeted-costing); compounds not searched are not buyable')
     
     # lookup coster 
     parser.add_argument('--coster-lookup', action='store', type=str, default=None,
-                        help='path of lookup file for lookup cost and buyability (not implemented yet)')
+                        help='inventory (csv, tsv or parquet with SMILES and cost_per_g or price and pack_mg columns) or inventory index for lookup cost and buyability')
+    parser.add_argument('--lookup-index', action='store', type=str, default=None,
+                        help='where the index of the --coster-lookup inventory is built and reused (default: next to the inventory)')
     
     return parser
 
@@ -109,10 +137,44 @@ def add_optimization_args(parser):
                         help='weighting factor for diversity, encourages more clusters to be represented')
     parser.add_argument('--cluster-cutoff', action='store', type=float, default=0.7,
                         help='cutoff for Butina clustering algorithm (lower cutoff -> more small clusters)')
-    parser.add_argument('--solver', action='store', type=str, choices=['pulp, gurobi'],
-                        default='pulp', help='solver to use for linear optimization')
+    parser.add_argument('--solver', action='store', type=str, choices=['pulp', 'gurobi', 'highs'],
+                        default='pulp', help='solver to use for linear optimization (pulp uses CBC, gurobi requires a license)')
+    parser.add_argument('--mode', action='store', type=str, default='exact', choices=['exact', 'heuristic'],
+                        help='solve the optimization problem exactly, or quickly find a good selection by rounding the solution of its LP relaxation (heuristic)')
+    parser.add_argument('--threads', action='store', type=int, default=None,
+                        help='number of threads for the solver (solver default if not provided)')
+    parser.add_argument('--time-limit', action='store', type=float, default=None,
+                        help='time limit in seconds for the solver, the best solution found so far is used if it is reached')
+    parser.add_argument('--gap-rel', action='store', type=float, default=1e-7,
+                        help='relative optimality gap at which the solver stops')
+    parser.add_argument('--gap-abs', action='store', type=float, default=None,
+                        help='absolute optimality gap at which the solver stops (1e-9 for CBC and the solver default otherwise if not provided)')
+    parser.add_argument('--decompose', action='store_true', default=False,
+                        help='split the problem into independent subproblems (e.g. targets that share no intermediates or starting materials) and solve them in --n-jobs processes; ignored with a diversity objective')
+    parser.add_argument('--sweep', action='store', type=str, default=None,
+                        help='solve for several values of one weight, e.g. reward_weight=2,5,8, reusing one model; each point is saved to its own folder in the output directory')
+    parser.add_argument('--pareto', action='store', type=str, default=None, choices=['cost', 'penalty'],
+                        help='enumerate the trade-off between reward and starting material cost (cost) or reaction penalty (penalty) with the epsilon-constraint method')
+    parser.add_argument('--pareto-points', action='store', type=int, default=10,
+                        help='number of points of the Pareto front (bounds on the traded-off objective)')
+    parser.add_argument('--model-cache', action='store', type=str, default=None,
+                        help='directory in which built models are cached under a hash of the graph, targets and formulation (default: chkpts in the output directory)')
+    parser.add_argument('--no-model-cache', action='store_true', default=False,
+                        help='always build the model and do not save it')
+    parser.add_argument('--write-mps', action='store_true', default=False,
+                        help='write the optimization problem to model.mps in the output directory, e.g. for an external solver')
+    parser.add_argument('--solution', action='store', type=str, default=None,
+                        help='read the solution from a file written by an external solver (json or text with variable names and values) instead of solving')
+    parser.add_argument('--mip-start', action='store', type=str, default=None,
+                        help='path to a solution_list_format.json file of a previous run whose reactions are used as a starting solution')
     parser.add_argument('--acyclic', action='store_true', default=False, 
                         help='if the reaction network graph is known to be acyclic')
+    parser.add_argument('--no-prune', action='store_true', default=False,
+                        help='do not remove reactions and compounds that cannot be part of a feasible route to a target before optimization')
+    parser.add_argument('--no-presolve', action='store_true', default=False,
+                        help='do not fix reactions and starting materials whose cost or penalty exceeds the reward they can lead to before solving')
+    parser.add_argument('--cycle-method', action='store', type=str, default='simple', choices=['simple', 'ordering', 'lazy'],
+                        help='how cycles are excluded: one constraint per simple cycle (simple), order variables on cyclic strongly connected components (ordering), or constraints only for cycles in the selected routes, added by re-solving (lazy)')
 
     return parser
 
@@ -4,14 +4,19 @@ import json
 import sys 
 import numpy as np 
 from tqdm import tqdm 
+from typing import List
 
 from sparrow.path_finder import AskcosAPIPlanner, LookupPlanner
 from sparrow.route_graph import RouteGraph
 from sparrow.route_selector import RouteSelector
 from sparrow.condition_recommender import AskcosRecommender, AskcosAPIRecommender
 from sparrow.scorer import AskcosScorer, AskcosAPIScorer
-from sparrow.coster import ChemSpaceCoster, NaiveCoster
+from sparrow.coster import AsyncChemSpaceCoster, NaiveCoster, LookupCoster
+from sparrow.costing_planner import CostingPlanner, ppg_hints_from_tree_files
+from sparrow.utils.price_cache import PriceCache
+from sparrow.utils.http_client import get_client
 from sparrow.cli.args import get_args
+from sparrow.utils.profile_utils import Profiler
 
 
 
@@ -23,17 +28,163 @@ def get_target_dict(filepath: Path):
     }
     return target_dict, list(df['SMILES'])
 
+WEIGHT_NAMES = ['reward_weight', 'start_cost_weight', 'reaction_weight', 'diversity_weight']
+
+def build_model(selector, params): 
+
+    if not params['no_prune']: 
+        selector.prune_dead_ends()
+
+    if params['no_model_cache']: 
+        cache_dir = None 
+    elif params['model_cache'] is not None: 
+        cache_dir = Path(params['model_cache'])
+    else: 
+        cache_dir = Path(params['output_dir'])/'chkpts'
+    
+    selector.build_model(set_cycle_constraints=not params['acyclic'], cache_dir=cache_dir)
+
+    if params['write_mps']: 
+        p = Path(params['output_dir'])/'model.mps'
+        print(f'Saving optimization problem to {p}')
+        selector.model.write_mps(p)
+
+    return selector 
+
+def solver_kwargs(params): 
+    return {
+        'solver': {'pulp': None, 'gurobi': 'GUROBI', 'highs': 'HIGHS'}[params['solver']], # 'GUROBI' needs a license
+        'threads': params['threads'], 
+        'time_limit': params['time_limit'], 
+        'gap_rel': params['gap_rel'], 
+        'gap_abs': params['gap_abs'], 
+        'decompose': params['decompose'], 
+        'n_jobs': params['n_jobs'], 
+        'presolve': not params['no_presolve'], 
+    }
+
+def solve(selector, params, warm_start=None): 
+
+    if params['mode'] == 'heuristic': 
+        selector.optimize_heuristic(**solver_kwargs(params))
+    else: 
+        selector.optimize(warm_start=warm_start, **solver_kwargs(params)) 
+
+    return selector 
+
+def mip_start(selector, params): 
+    if params['mip_start'] is None: 
+        return None 
+    
+    with open(params['mip_start'], 'r') as f: 
+        rxn_smiles = [rxn['smiles'] for rxn in json.load(f)['Reactions']]
+    return selector.solution_from_selection(rxn_smiles)
+
 def optimize(selector, params):
 
-    selector.define_variables()
-    selector.set_objective()
-    selector.set_constraints(set_cycle_constraints=not params['acyclic'])
+    selector = build_model(selector, params)
+    if params['solution'] is not None: 
+        print(f'Reading solution from {params["solution"]}')
+        selector.set_solution(selector.model.read_solution(params['solution']))
+        return selector 
     
-    solver = {'pulp': None, 'gurobi': 'GUROBI'}[params['solver']]
-    selector.optimize(solver=solver) # solver='GUROBI' for GUROBI (license needed)
+    selector = solve(selector, params, warm_start=mip_start(selector, params))
 
     return selector 
 
+def parse_sweep(sweep: str): 
+    """ Parses e.g. 'reward_weight=2,5,8' into ('reward_weight', [2.0, 5.0, 8.0]) """
+    name, values = sweep.split('=')
+    name = name.strip().replace('-', '_')
+    if name not in WEIGHT_NAMES: 
+        raise ValueError(f'Cannot sweep {name}, choose one of {WEIGHT_NAMES}')
+    
+    return name, [float(value) for value in values.split(',')]
+
+def sweep_dir(output_dir: Path, weights: List[float]) -> Path: 
+    """ Output folder of one sweep point, named like the folders of scripts/optimize_preprint.py (e.g. lam_20_1_1) """
+    lams = weights if weights[3] != 0 else weights[:3]
+    return output_dir / ('lam_' + '_'.join(f'{lam:g}' for lam in lams))
+
+def run_sweep(selector, params, sweep: str): 
+    """ 
+    Solves the problem for every value of one weight. The graph, variables and constraints are 
+    built once, only the objective is changed for every point, and every solve is warm-started 
+    from the solution of the previous point. Each point is saved to its own folder in output_dir. 
+    """
+    name, values = parse_sweep(sweep)
+    output_dir = Path(params['output_dir'])
+    selector = build_model(selector, params)
+    
+    warm_start = mip_start(selector, params)
+    summaries = []
+    for value in values: 
+        print(f'Sweep point {name}={value}')
+        selector.weights[WEIGHT_NAMES.index(name)] = value 
+        selector.set_objective()
+        selector = solve(selector, params, warm_start=warm_start)
+        warm_start = selector.solution 
+
+        point_dir = sweep_dir(output_dir, selector.weights)
+        point_dir.mkdir(exist_ok=True, parents=True)
+        with selector.profiler.stage('extraction'): 
+            summary = extract_vars(selector, point_dir, extract_routes=not params['no_routes'])
+        with open(point_dir/'summary.json', 'w') as f:
+            json.dump(summary, f, indent='\t')
+        summaries.append(summary)
+    
+    return summaries 
+
+def run_pareto(selector, params): 
+    """ 
+    Enumerates the trade-off between reward and the objective in params['pareto'] ('cost' or 'penalty') 
+    with RouteSelector.pareto_front. Every distinct solution is saved to its own folder (pareto_0, 
+    pareto_1, ...) in output_dir, and the frontier is saved to output_dir/pareto.csv. 
+    """
+    if params['mode'] == 'heuristic': 
+        raise NotImplementedError('The Pareto front can only be enumerated with --mode exact')
+
+    output_dir = Path(params['output_dir'])
+    selector = build_model(selector, params)
+    points = selector.pareto_front(
+        objective=params['pareto'], 
+        n_points=params['pareto_points'], 
+        warm_start=mip_start(selector, params), 
+        **solver_kwargs(params),
+    )
+
+    rows = []
+    summary = None 
+    for point in points: 
+        if point['solved']: 
+            point_dir = output_dir / f'pareto_{sum(p["solved"] for p in rows)}'
+            point_dir.mkdir(exist_ok=True, parents=True)
+            selector.solution = point['solution']
+            with selector.profiler.stage('extraction'): 
+                summary = extract_vars(selector, point_dir, extract_routes=not params['no_routes'])
+            summary['Epsilon'] = point['epsilon']
+            with open(point_dir/'summary.json', 'w') as f:
+                json.dump(summary, f, indent='\t')
+        
+        rows.append({
+            'epsilon': point['epsilon'], 
+            'reward': point['reward'], 
+            'cost': point['cost'], 
+            'penalty': point['penalty'], 
+            'Number targets': summary['Number targets'], 
+            'Number starting materials': summary['Number starting materials'], 
+            'Number reaction steps': summary['Number reaction steps'], 
+            'solved': point['solved'], 
+            'status': point['status'], 
+            'folder': point_dir.name, 
+        })
+
+    p = output_dir / 'pareto.csv'
+    print(f'Saving Pareto front with {len(rows)} points ({sum(row["solved"] for row in rows)} solves) to {p}')
+    pd.DataFrame(rows).to_csv(p, index=False)
+
+    return rows 
+
 def export_selected_nodes(selector: RouteSelector, rxn_list, starting_list, target_list, output_dir): 
     storage = {'Starting Materials': [], 'Reactions': [], 'Targets': []}
     graph = selector.graph
@@ -73,11 +224,7 @@ def export_selected_nodes(selector: RouteSelector, rxn_list, starting_list, targ
 
 def extract_vars(selector: RouteSelector, output_dir, extract_routes=True): 
 
-    nonzero_vars = [
-            var for var in selector.problem.variables() if var.varValue > 0.01
-        ]
-    rxn_ids = [var.name.split('_')[1] for var in nonzero_vars if var.name.startswith('rxn')]
-    mol_ids = [var.name.split('_')[1] for var in nonzero_vars if var.name.startswith('mol')]
+    rxn_ids, mol_ids = selector.selected_ids()
     dummy_ids = [rxn for rxn in rxn_ids if selector.graph.node_from_id(rxn).dummy]
     non_dummy_ids = [rxn for rxn in rxn_ids if selector.graph.node_from_id(rxn).dummy == 0]
 
@@ -89,7 +236,7 @@ def extract_vars(selector: RouteSelector, output_dir, extract_routes=True):
     avg_rxn_score = np.mean([selector.graph.node_from_id(rxn).score for rxn in non_dummy_ids]) if len(non_dummy_ids) > 0 else None
 
     summary = {
-        'Weights': selector.weights,
+        'Weights': list(selector.weights),
         'Number targets': len(selected_targets), 
         'Fraction targets': len(selected_targets)/len(selector.targets),
         'Total reward': sum([selector.target_dict[tar] for tar in selected_targets]),
@@ -113,9 +260,13 @@ def extract_vars(selector: RouteSelector, output_dir, extract_routes=True):
 
     return summary 
 
+def parent_ids(selector: RouteSelector, node_id: str) -> List[str]: 
+    topology = selector.graph.topology()
+    return [topology.ids[ind] for ind in topology.parents(topology.index_from_id(node_id))]
+
 def find_rxn_parents(store_dict, rxn_id, selected_mols, selected_rxns, selector: RouteSelector):
     graph = selector.graph 
-    par_ids = [n.id for n in graph.node_from_id(rxn_id).parents.values()]
+    par_ids = parent_ids(selector, rxn_id)
     selected_pars = set(par_ids) & set(selected_mols)
     for par in selected_pars: 
         store_dict['Compounds'].append(graph.smiles_from_id(par))
@@ -124,7 +275,7 @@ def find_rxn_parents(store_dict, rxn_id, selected_mols, selected_rxns, selector:
 
 def find_mol_parents(store_dict, mol_id, selected_mols, selected_rxns, selector: RouteSelector): 
     graph = selector.graph 
-    par_ids = [n.id for n in graph.node_from_id(mol_id).parents.values()]
+    par_ids = parent_ids(selector, mol_id)
     selected_pars = set(par_ids) & set(selected_rxns)
     for par in selected_pars: 
         node = graph.node_from_id(par)
@@ -150,6 +301,8 @@ def get_path_storage(params, targets):
         planner = LookupPlanner(
             json_dir=Path(params['tree_lookup_dir']),
             output_dir=Path(params['output_dir']),
+            n_jobs=params['n_jobs'],
+            files_per_job=params['files_per_job'],
         )
     elif params['path_finder'] == 'api': 
         planner = AskcosAPIPlanner( 
@@ -158,6 +311,8 @@ def get_path_storage(params, targets):
             time_per_target=params['time_per_target'], 
             max_ppg=params['max_ppg'],
             max_branching=params['max_branching'],
+            n_jobs=params['n_jobs'],
+            files_per_job=params['files_per_job'],
         )
 
     return planner.get_save_trees(targets)
@@ -193,21 +348,58 @@ def build_coster(params):
     if rec == 'chemspace': 
         sys.path.append(params['key_path'])
         from keys import chemspace_api_key
-        return ChemSpaceCoster(api_key=chemspace_api_key)
+        coster = AsyncChemSpaceCoster(
+            api_key=chemspace_api_key, 
+            max_concurrent=params['coster_concurrency'], 
+            searches_per_window=params['searches_per_minute'], 
+            window=60, 
+        )
     elif rec == 'naive': 
-        return NaiveCoster()
+        coster = NaiveCoster()
+    elif rec == 'lookup': 
+        if params['coster_lookup'] is None: 
+            raise ValueError('--coster lookup requires an inventory file (--coster-lookup)')
+        coster = LookupCoster(
+            lookup_file=params['coster_lookup'], 
+            index_file=params['lookup_index'], 
+            n_jobs=params['n_jobs'], 
+        )
     elif rec is None: 
         return None  
-    elif rec == 'lookup': 
-        raise NotImplementedError
     else:
-        raise NotImplementedError(f'Scorer {rec} not implemented')
+        raise NotImplementedError(f'Coster {rec} not implemented')
+    
+    if not params['no_price_cache']: 
+        coster.set_cache(PriceCache(params['price_cache'], ttl_days=params['price_cache_ttl']))
+    
+    return coster 
      
-def build_selector(params, target_dict, storage_path):
-    if storage_path is None: 
-        graph = RouteGraph(node_filename=params['graph'])
-    else: 
-        graph = RouteGraph(node_filename=storage_path)
+def build_costing_planner(params, target_dict): 
+    if not (params['targeted_costing'] or params['costing_max_requests'] is not None or params['costing_time_limit'] is not None): 
+        return None 
+    
+    # prices ASKCOS reported in the trees of this run, if they are available 
+    tree_files = []
+    if params['graph'] is None and params['path_finder'] == 'api': 
+        tree_files = sorted((Path(params['output_dir'])/'askcos_trees').glob('tree*.json'))
+    elif params['graph'] is None and params['path_finder'] == 'lookup': 
+        tree_files = sorted(Path(params['tree_lookup_dir']).glob('*.json'))
+    
+    return CostingPlanner(
+        targets=target_dict.keys(), 
+        ppg_hints=ppg_hints_from_tree_files(tree_files), 
+        max_ppg=params['max_ppg'], 
+        max_requests=params['costing_max_requests'], 
+        time_limit=params['costing_time_limit'], 
+    )
+
+def build_selector(params, target_dict, storage_path, profiler=None):
+    profiler = Profiler() if profiler is None else profiler 
+    with profiler.stage('graph load'): 
+        if storage_path is None: 
+            graph = RouteGraph(node_filename=params['graph'])
+        else: 
+            graph = RouteGraph(node_filename=storage_path)
 
     weights = [params['reward_weight'], params['start_cost_weight'], params['reaction_weight'], params['diversity_weight']]
 
@@ -218,8 +410,11 @@ def build_selector(params, target_dict, storage_path):
         output_dir=Path(params['output_dir']),
         rxn_scorer=build_scorer(params),
         coster=build_coster(params),
+        costing_planner=build_costing_planner(params, target_dict),
         weights=weights,
-        constrain_all_targets=params['constrain_all']
+        constrain_all_targets=params['constrain_all'],
+        cycle_method=params['cycle_method'],
+        profiler=profiler, 
     )
 
     if storage_path is not None: 
@@ -251,11 +446,30 @@ def run():
     
     save_args(params)
 
+    # wall time and peak memory of every stage, solver telemetry and API call counters, saved to profile.json 
+    profiler = Profiler()
+    try: 
+        run_stages(params, output_dir, profiler)
+    finally: 
+        profiler.record_http(get_client().summary())
+        profiler.save(output_dir/'profile.json')
+
+def run_stages(params, output_dir, profiler): 
     target_dict, targets = get_target_dict(params['target_csv']) 
-    storage_path = get_path_storage(params, targets)
-    selector = build_selector(params, target_dict, storage_path)
+    with profiler.stage('retrosynthesis'): 
+        storage_path = get_path_storage(params, targets)
+    selector = build_selector(params, target_dict, storage_path, profiler=profiler)
+    if params['sweep'] is not None: 
+        run_sweep(selector, params, params['sweep'])
+        return 
+    
+    if params['pareto'] is not None: 
+        run_pareto(selector, params)
+        return 
+    
     selector = optimize(selector, params)
-    summary = extract_vars(selector, output_dir, extract_routes=not params['no_routes'] )
+    with profiler.stage('extraction'): 
+        summary = extract_vars(selector, output_dir, extract_routes=not params['no_routes'] )
     
     with open(output_dir/'summary.json', 'w') as f:
         json.dump(summary, f, indent='\t')
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 from typing import List, Union, Dict 
 from pathlib import Path  
 import json 
+import requests
 from sparrow.utils.api_utils import post_and_get
 
 def clean_context(context):
@@ -129,8 +130,9 @@ class AskcosAPIRecommender(Recommender):
                 params=params,
                 sleep_time=0.1,
             )
-        except ConnectionError:
+        except (ConnectionError, requests.RequestException):
             print ("Connection Error from " + self.host)
+            result = {}
         
         if 'output' in result: 
             contexts = [
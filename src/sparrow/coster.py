@@ -2,12 +2,21 @@ import requests
 from urllib.parse import urljoin
 import time
 import pprint
-from typing import List, Tuple, Dict, Union
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Union, Callable, Optional
 from pathlib import Path 
 from abc import ABC, abstractmethod, abstractproperty
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from tqdm import tqdm
 import warnings 
+import json 
+
+from sparrow.utils.price_cache import PriceCache
+from sparrow.utils.http_client import get_client, CHEMSPACE_TIMEOUT
+from sparrow.utils.inventory_index import InventoryIndex, INDEX_SUFFIXES
+from sparrow.utils.smiles_utils import canonicalize_all
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -18,12 +27,12 @@ class Coster(ABC):
     """ 
     Determines whether a molecule represented as a SMILES is 
     buyable. If it is, determines its cost 
-    TODO: implement LookupCoster so user can input csv of inventory with cost=0
-    or maybe allow ChemSpaceCoster to be updated with inventory list and 
-    change those buyables to cost = 0
     """
+    cache_batch_size = 50 
+
     def __init__(self):
         self.status_log = None 
+        self.cache = None 
 
     @abstractmethod
     def __call__(smis: List[str]) -> Tuple[Dict, List]: 
@@ -32,17 +41,81 @@ class Coster(ABC):
     
     @abstractmethod
     def get_buyable_and_cost(smiles: str) -> Tuple[bool, float]:
-        """ For a single smiles strings, outputs if the smiles is buyable and what its cost is"""
+        """ For a single smiles strings, outputs if the smiles is buyable and what its cost is, 
+        or None if this could not be determined (e.g. the search failed) """
     
     def build_status_log(self, pos=1): 
         self.status_log = tqdm(total=0, position=pos, bar_format='{desc}')
 
+    def cache_key(self) -> str: 
+        """ Identifies the coster and any settings that change its results in the price cache """
+        return type(self).__name__
+
+    def set_cache(self, cache: PriceCache) -> None: 
+        """ Looks up compounds in cache before searching them, and stores new results in it """
+        self.cache = cache 
+        return 
+
+    def buyable_and_costs(self, smis: List[str], callback: Callable = None) -> Dict[str, Tuple[bool, float]]: 
+        """ 
+        Returns a dictionary that maps each smiles to (buyable, cost). If callback is given, it is 
+        called as callback(smiles, buyable, cost) as soon as each result is available. If the coster 
+        has a price cache, all smiles are looked up in it first and only the rest are searched; 
+        their results are stored in the cache in batches as they arrive. 
+        """
+        if self.cache is None: 
+            return self.search_many(smis, callback=callback)
+        
+        source = self.cache_key()
+        results = self.cache.lookup(smis, source)
+        if callback is not None: 
+            for smiles, (buyable, cost) in results.items(): 
+                callback(smiles, buyable, cost)
+
+        pending = {}
+        def store(smiles, buyable, cost): 
+            pending[smiles] = (buyable, cost)
+            if len(pending) >= self.cache_batch_size: 
+                self.cache.insert(pending, source)
+                pending.clear()
+            if callback is not None: 
+                callback(smiles, buyable, cost)
+
+        to_search = [smiles for smiles in dict.fromkeys(smis) if smiles not in results]
+        try: 
+            results.update(self.search_many(to_search, callback=store))
+        finally: 
+            # keeps the results of an interrupted search 
+            self.cache.insert(pending, source)
+
+        return results 
+
+    def search_many(self, smis: List[str], callback: Callable = None) -> Dict[str, Tuple[bool, float]]: 
+        """ 
+        Searches for each smiles, see buyable_and_costs. Costers that can search concurrently 
+        override this, the default searches one smiles at a time. Smiles whose search failed are 
+        not in the returned dictionary, so that they are not taken for unbuyable compounds. 
+        """
+        results = {}
+        for smiles in smis: 
+            if self.status_log is not None: 
+                self.status_log.set_description_str(f'Searching for {smiles}')
+            result = self.get_buyable_and_cost(smiles)
+            if result is None: 
+                continue 
+            results[smiles] = result 
+            if callback is not None: 
+                callback(smiles, *results[smiles])
+        
+        return results 
+
 class NaiveCoster(Coster): 
     """ Determines if a molecule is buyable based on the number of certain elements. 
     Sets all costs to 1
     """
     def __init__(self) -> None:
         warnings.warn('Using a naive method to assign buyability and cost with no guarantee of accuracy.')
+        super().__init__()
         return 
     
     def buyable(self, smiles: str) -> bool: 
@@ -91,6 +164,7 @@ class ChemSpaceCoster(Coster):
         self.api_key = api_key
         self.base_url = base_url
         self.api_version = api_version
+        self.client = get_client()
 
         self.token_expiration_time = 3600
         self.get_token()
@@ -119,6 +193,14 @@ class ChemSpaceCoster(Coster):
 
         return 
     
+    def cache_key(self) -> str: 
+        return json.dumps({
+            'coster': 'chemspace', 
+            'base_url': self.base_url, 
+            'categories': sorted(self.categories_map), 
+            'filters': self.filters, 
+        }, sort_keys=True)
+
     def check_time_and_token(self): 
         if (time.time() - self.search_ref_time) > 59: 
             self.search_ref_time = time.time()
@@ -145,7 +227,7 @@ class ChemSpaceCoster(Coster):
         }
 
         url = urljoin(urljoin(self.base_url, self.api_version), 'auth/token')
-        r = requests.get(url, headers=headers, verify=False)
+        r = self.client.get(url, headers=headers, timeout=CHEMSPACE_TIMEOUT)
         response = r.json()
 
         if 'access_token' in response:
@@ -185,17 +267,27 @@ class ChemSpaceCoster(Coster):
 
         url = urljoin(self.base_url, '{}/search/{}'.format(self.api_version, 'exact'))
 
-        response = requests.post(url, headers=headers, params=params, files=files,  verify=False)
+        # the client resends the search if it was refused or ChemSpace asks for it (429 or 503 with Retry-After) 
+        response = self.client.post(url, headers=headers, params=params, files=files, timeout=CHEMSPACE_TIMEOUT)
+        if response.status_code == 401: # token expired early 
+            self.get_token()
+            headers['Authorization'] = 'Bearer {}'.format(self.token)
+            response = self.client.post(url, headers=headers, params=params, files=files, timeout=CHEMSPACE_TIMEOUT)
         processed_response = self.process_response(response)
         
         return processed_response
 
     def cost_from_response(self, response):
-        if response['status_code'] == 429 or response['status_code'] == 401: 
-            self.get_token()
-            return None 
+        """ Returns the cost of a processed search response, None if the compound is not buyable, 
+        or False if the search failed (e.g. 429 or 401), which says nothing about buyability """
+        if response['status_code'] != 200 or response['content'] is None: 
+            return False 
         
-        offers = [offer for item in response['content']['items'] for offer in item['offers']]
+        return self.cost_from_content(response['content'])
+
+    def cost_from_content(self, content): 
+        """ Returns the lowest price (USD/g) of the offers in a search result that pass the filters, or None """
+        offers = [offer for item in content['items'] for offer in item['offers']]
         
         if len(offers) == 0: 
             return None 
@@ -238,11 +330,13 @@ class ChemSpaceCoster(Coster):
 
         return {'content': content, 'status_code': response.status_code, 'reason': response.reason}
     
-    def get_buyable_and_cost(self, smiles: str) -> Tuple[bool, float]:
+    def get_buyable_and_cost(self, smiles: str) -> Optional[Tuple[bool, float]]:
         
         response = self.single_search(smiles)
         cost = self.cost_from_response(response)
-        if cost is None: 
+        if cost is False: 
+            return None 
+        elif cost is None: 
             return False, None
         else: 
             return True, cost
@@ -255,22 +349,290 @@ class ChemSpaceCoster(Coster):
         for smiles in smis: 
             response = self.single_search(smiles)
             cost = self.cost_from_response(response)
+            if cost is False: 
+                continue 
             costs[smiles] = cost
             if cost is not None: 
                 buyables.add(smiles)
 
         
         return costs, buyables 
+
+
+class TokenBucket: 
+    """ 
+    Token bucket rate limiter for asyncio: holds at most capacity tokens and gains rate tokens per 
+    second. acquire() waits until a token is available and takes it. In any time window of length 
+    T, at most capacity + rate*T tokens are handed out. 
+    """
+    def __init__(self, capacity: float, rate: float) -> None: 
+        self.capacity = capacity 
+        self.rate = rate 
+        self.tokens = capacity 
+        self.updated = time.monotonic()
+        self.lock = None 
+
+        return 
+
+    def refill(self) -> None: 
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+        self.updated = now 
+        return 
+
+    async def acquire(self) -> None: 
+        if self.lock is None: 
+            self.lock = asyncio.Lock()
+        
+        # waiting inside the lock keeps tokens first come, first served 
+        async with self.lock: 
+            self.refill()
+            while self.tokens < 1: 
+                await asyncio.sleep((1 - self.tokens)/self.rate)
+                self.refill()
+            self.tokens -= 1
+        
+        return 
+
+    def drain(self, seconds: float = 0) -> None: 
+        """ Empties the bucket (e.g. after the server reported that the quota is used up), so 
+        that the next token is available after max(seconds, 1/rate) """
+        self.refill()
+        self.tokens = min(self.tokens, 1 - max(seconds*self.rate, 1))
+        return 
+
+
+class AsyncChemSpaceCoster(ChemSpaceCoster): 
+    """ 
+    ChemSpaceCoster that keeps up to max_concurrent searches in flight. The search quota 
+    (searches_per_window per window seconds) is enforced with a token bucket instead of sleeping 
+    until the window resets: the bucket holds burst tokens and refills at (searches_per_window - burst) 
+    / window per second, so no window of that length sees more than searches_per_window searches. 
+    The access token is refreshed in the background shortly before it expires, and at most once for 
+    any number of concurrent 401 responses, so other searches keep running. Searches that get a 429 
+    (the bucket is then drained for the Retry-After time), a 5xx or a connection error are retried up 
+    to max_retries times with jittered exponential backoff. Compounds whose search still fails are 
+    left out of the results instead of being marked as not buyable. 
+    Requests are sent through the shared HTTP client by threads (requests is blocking), scheduled 
+    by an asyncio event loop. 
+    """
+    def __init__(self, 
+                 api_key, 
+                 base_url='https://api.chem-space.com/', 
+                 api_version='v3', 
+                 max_concurrent: int = 8, 
+                 searches_per_window: int = 35, 
+                 window: float = 60, 
+                 burst: int = None, 
+                 max_retries: int = 5, 
+                 token_refresh_margin: float = 300, 
+                 ) -> None:
+
+        super().__init__(api_key=api_key, base_url=base_url, api_version=api_version)
+
+        self.max_concurrent = max_concurrent 
+        self.burst = min(max_concurrent, searches_per_window - 1) if burst is None else burst 
+        self.searches_per_window = searches_per_window 
+        self.window = window 
+        self.max_retries = max_retries 
+        self.token_refresh_margin = token_refresh_margin 
+
+        self.stats = {'searches': 0, 'retries': 0, '429': 0, 'token refreshes': 0, 'failed': 0}
+
+        return 
+
+    def search_many(self, smis: List[str], callback: Callable = None) -> Dict[str, Tuple[bool, float]]: 
+        """ Searches all smiles concurrently, see Coster.buyable_and_costs. Smiles whose search 
+        failed (after retries) are not in the returned dictionary. """
+        try: 
+            asyncio.get_running_loop()
+        except RuntimeError: 
+            return asyncio.run(self.search_all(smis, callback))
+        
+        # e.g. in a notebook, where an event loop is already running in this thread 
+        with ThreadPoolExecutor(max_workers=1) as pool: 
+            return pool.submit(asyncio.run, self.search_all(smis, callback)).result()
+
+    def get_buyable_and_cost(self, smiles: str) -> Optional[Tuple[bool, float]]:
+        return self.buyable_and_costs([smiles]).get(smiles, None)
+
+    def __call__(self, smis: List[str]): 
+        results = self.buyable_and_costs(smis)
+        costs = {smiles: cost for smiles, (_, cost) in results.items()}
+        buyables = set(smiles for smiles, (buyable, _) in results.items() if buyable)
+        return costs, buyables 
+
+    async def search_all(self, smis: List[str], callback: Callable = None) -> Dict[str, Tuple[bool, float]]: 
+        bucket = TokenBucket(
+            capacity=self.burst, 
+            rate=max(self.searches_per_window - self.burst, 1)/self.window, 
+        )
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._refresh_task = None 
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor: 
+            async def search(smiles): 
+                async with semaphore: 
+                    cost = await self.search_async(smiles, bucket, executor)
+                
+                if cost is False: 
+                    self.stats['failed'] += 1
+                    return 
+                
+                results[smiles] = (cost is not None, cost)
+                if callback is not None: 
+                    callback(smiles, cost is not None, cost)
+                if self.status_log is not None: 
+                    self.status_log.set_description_str(f'Searched {len(results)} of {len(smis)} compounds ({self.stats["429"]} rate limited)')
+
+            await asyncio.gather(*[search(smiles) for smiles in smis])
+            if self._refresh_task is not None: 
+                await self._refresh_task 
+
+        return results 
+
+    async def search_async(self, smiles: str, bucket: TokenBucket, executor) -> Optional[float]: 
+        """ Returns the cost of smiles, None if it is not buyable, or False if the search failed """
+        loop = asyncio.get_running_loop()
+        n_errors = 0 
+        for attempt in range(self.max_retries + 1): 
+            if attempt > 0: 
+                self.stats['retries'] += 1
+            if n_errors > 0: 
+                await asyncio.sleep(min(2**n_errors, 60)*random.uniform(0.5, 1.5))
+
+            # the bucket may wait, so the token is only checked after it 
+            await bucket.acquire()
+            token = await self.valid_token(executor)
+            self.stats['searches'] += 1
+            try: 
+                response = await loop.run_in_executor(executor, self.post_search, smiles, token)
+            except requests.RequestException: 
+                n_errors += 1
+                continue 
+
+            if response.status_code == 200: 
+                return self.cost_from_content(response.json())
+            elif response.status_code == 401: 
+                # retried at once with the new token 
+                await self.refresh_token(executor, token)
+            elif response.status_code == 429: 
+                # retried once the bucket, drained for the Retry-After time, has a token again 
+                self.stats['429'] += 1
+                bucket.drain(float(response.headers.get('Retry-After', 0) or 0))
+            elif response.status_code < 500: 
+                print(f'Search for {smiles} failed with status code {response.status_code} ({response.reason})')
+                return False 
+            else: 
+                n_errors += 1
+        
+        return False 
+
+    def post_search(self, smiles: str, token: str, max_results_count=100, categories='CSSB, CSSS') -> requests.Response: 
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': 'Bearer {}'.format(token),
+        }
+        params = (
+            ('count', max_results_count),
+            ('categories', categories),
+        )
+        files = {
+            'SMILES': (None, smiles),
+        }
+        url = urljoin(self.base_url, '{}/search/{}'.format(self.api_version, 'exact'))
+        # retries are left to search_async, which shares the token bucket between searches 
+        return self.client.post(url, headers=headers, params=params, files=files, timeout=CHEMSPACE_TIMEOUT, max_retries=0)
+
+    async def valid_token(self, executor) -> str: 
+        """ Returns the access token, starting a background refresh if it expires soon and waiting 
+        for the refresh only if it has already expired """
+        age = time.time() - self.token_ref_time 
+        if age > self.token_expiration_time - self.token_refresh_margin: 
+            task = self.start_refresh(executor, self.token)
+            if age > self.token_expiration_time: 
+                await task 
+        return self.token 
+
+    async def refresh_token(self, executor, rejected_token: str) -> None: 
+        """ Refreshes the access token after it was rejected, unless another search already did """
+        await self.start_refresh(executor, rejected_token)
+        return 
+
+    def start_refresh(self, executor, old_token: str): 
+        """ Returns the running refresh task, or starts one if old_token is still the current token """
+        if self._refresh_task is None or (self._refresh_task.done() and self.token == old_token): 
+            loop = asyncio.get_running_loop()
+            self.stats['token refreshes'] += 1
+            self._refresh_task = asyncio.ensure_future(loop.run_in_executor(executor, self.get_token))
+        return self._refresh_task 
     
     
 class LookupCoster(Coster): 
     """ 
-    Determines if a molecule is buyable and what its cost is 
-    by looking up the smiles in a csv file 
-    TODO: implement this 
+    Determines if a molecule is buyable and what its cost is by looking up its canonical smiles 
+    in an inventory (csv, tsv or parquet file with a SMILES column and cost_per_g, or price and 
+    pack_mg/pack_g columns; see inventory_index.costs_from_chunk). Compounds that are not in the 
+    inventory are not buyable. The inventory is indexed once (in n_jobs processes) into an SQLite 
+    file next to it, or at index_file, which later runs open directly. The index is rebuilt if the 
+    inventory has changed since. lookup_file may also be a previously built index. 
     """
     def __init__(self, 
                  lookup_file: Union[str, Path], 
+                 index_file: Union[str, Path] = None, 
+                 n_jobs: int = 1, 
+                 default_cost: float = 0, 
                  ):
+        
+        super().__init__()
+        lookup_file = Path(lookup_file)
+        if lookup_file.suffix in INDEX_SUFFIXES: 
+            self.index = InventoryIndex(lookup_file)
+        else: 
+            index_file = Path(str(lookup_file) + '.index.sqlite') if index_file is None else Path(index_file)
+            self.index = InventoryIndex(index_file) if index_file.exists() else None 
+            if self.index is None: 
+                print(f'Indexing inventory {lookup_file}, this is only done once')
+            elif not self.index.is_current(lookup_file): 
+                print(f'Inventory {lookup_file} has changed since it was indexed, indexing it again')
+                self.index.close()
+                self.index = None 
+            
+            if self.index is None: 
+                self.index = InventoryIndex.build(lookup_file, index_file, n_jobs=n_jobs, default_cost=default_cost)
+        
+        print(f'Using inventory index {self.index.filename} with {len(self.index)} compounds')
+        return 
+
+    def cache_key(self) -> str: 
+        return json.dumps({
+            'coster': 'lookup', 
+            'inventory': self.index.meta['inventory'], 
+            'stamp': self.index.meta['stamp'], 
+        }, sort_keys=True)
+
+    def search_many(self, smis: List[str], callback: Callable = None) -> Dict[str, Tuple[bool, float]]: 
+        """ Looks up all smiles with one query per 500 compounds, see Coster.buyable_and_costs """
+        if self.status_log is not None: 
+            self.status_log.set_description_str(f'Looking up {len(smis)} compounds in {self.index.filename}')
+
+        keys = dict(zip(smis, canonicalize_all(smis)))
+        found = self.index.lookup(key for key in keys.values() if key is not None)
+        results = {}
+        for smiles, key in keys.items(): 
+            cost = found.get(key, None)
+            results[smiles] = (cost is not None, cost)
+            if callback is not None: 
+                callback(smiles, *results[smiles])
+        
+        return results 
 
-        return 
\ No newline at end of file
+    def get_buyable_and_cost(self, smiles: str) -> Tuple[bool, float]:
+        return self.search_many([smiles])[smiles]
+
+    def __call__(self, smis: List[str]): 
+        results = self.buyable_and_costs(smis)
+        costs = {smiles: cost for smiles, (_, cost) in results.items()}
+        buyables = set(smiles for smiles, (buyable, _) in results.items() if buyable)
+        return costs, buyables 
@@ -0,0 +1,181 @@
+""" Decides which compounds of a route graph are priced by a coster, and in which order """
+from typing import Dict, Iterable, List, Tuple, Union, Callable
+from pathlib import Path
+from scipy.sparse.csgraph import breadth_first_order
+import numpy as np
+import pandas as pd
+import json
+import time
+
+from sparrow.coster import Coster
+
+
+def ppg_hints_from_tree_files(filenames: Iterable[Union[str, Path]]) -> Dict[str, float]:
+    """
+    Collects the price per gram that ASKCOS reported for each compound in saved tree files
+    ({target: result}, as written by AskcosAPIPlanner). A price of 0 means that ASKCOS does not
+    know the compound as buyable. Compounds that appear with several prices keep the lowest nonzero one.
+    """
+    hints = {}
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            entry = json.load(f)
+        for result in entry.values():
+            stack = list(result.get('output', [])) if isinstance(result, dict) else []
+            while stack:
+                node = stack.pop()
+                stack.extend(node.get('children', []))
+                if '>>' in node.get('smiles', '>>') or 'ppg' not in node:
+                    continue
+                ppg = float(node['ppg'] or 0)
+                old = hints.get(node['smiles'], 0)
+                hints[node['smiles']] = min(ppg, old) if ppg > 0 and old > 0 else max(ppg, old)
+
+    return hints
+
+
+class CostingPlanner:
+    """
+    Prices the compounds of a route graph in order of how likely they are to be starting materials,
+    optionally within a budget of coster requests (max_requests) or seconds (time_limit). Compounds
+    are ranked by, in this order:
+        1. the ASKCOS price hint: compounds ASKCOS prices at most max_ppg come first, then compounds
+           without a hint, then compounds ASKCOS does not sell (ppg 0) or sells above max_ppg
+        2. whether the compound is a leaf, i.e. no reaction in the graph makes it
+        3. the number of targets that can be reached through the compound
+    Compounds are priced in batches of batch_size. Results from the price cache do not count as
+    requests. The budgets are checked between batches, so the last batch may exceed the time limit.
+    Compounds that were not priced when a budget ran out are set to not buyable and listed in skipped.
+    The rank, signals and outcome of every compound are saved by save.
+    """
+    def __init__(self,
+                 targets: Iterable[str] = (),
+                 ppg_hints: Dict[str, float] = None,
+                 max_ppg: float = None,
+                 max_requests: int = None,
+                 time_limit: float = None,
+                 batch_size: int = 50,
+                 ) -> None:
+        self.targets = list(targets)
+        self.ppg_hints = ppg_hints if ppg_hints is not None else {}
+        self.max_ppg = max_ppg
+        self.max_requests = max_requests
+        self.time_limit = time_limit
+        self.batch_size = batch_size
+
+        self.plan = {}
+        self.skipped = []
+        self.n_requests = 0
+
+        return
+
+    def hint_class(self, smiles: str) -> int:
+        """ 2 if ASKCOS prices smiles at most max_ppg, 1 if there is no hint, 0 otherwise """
+        ppg = self.ppg_hints.get(smiles, None)
+        if ppg is None:
+            return 1
+        if ppg > 0 and (self.max_ppg is None or ppg <= self.max_ppg):
+            return 2
+        return 0
+
+    def signals(self, graph) -> Tuple[np.ndarray, np.ndarray]:
+        """ Returns whether each compound of graph's topology is a leaf, and the number of targets reachable through it """
+        topology = graph.topology()
+        n_parents = topology.n_parents()
+
+        # a compound is made in the graph if a reaction with reactants (not a dummy reaction) is its parent
+        nodes, parents = topology.parent_edges()
+        made = np.zeros(topology.n_nodes, dtype=bool)
+        made[nodes[~topology.is_rxn[nodes] & (n_parents[parents] > 0)]] = True
+        is_leaf = ~made
+
+        # the ancestors of a target are the nodes that can lead to it
+        n_targets = np.zeros(topology.n_nodes, dtype=np.int64)
+        A = topology.adjacency_matrix()
+        for ind in self.target_indices(graph):
+            n_targets[breadth_first_order(A, ind, directed=True, return_predecessors=False)] += 1
+
+        return is_leaf, n_targets
+
+    def target_indices(self, graph) -> List[int]:
+        topology = graph.topology()
+        inds = set()
+        for smiles in self.targets:
+            node = graph.compound_nodes.get(smiles, None)
+            if node is None:
+                node = graph.node_from_canonical_smiles(smiles)
+            if node is not None:
+                inds.add(topology.index(node.smiles))
+        return sorted(inds)
+
+    def rank(self, graph, smis: Iterable[str]) -> List[str]:
+        """ Returns smis in the order in which they should be priced, and records their signals in plan """
+        topology = graph.topology()
+        is_leaf, n_targets = self.signals(graph)
+
+        smis = list(smis)
+        inds = [topology.index(smiles) for smiles in smis]
+        keys = [(self.hint_class(smiles), bool(is_leaf[ind]), int(n_targets[ind])) for smiles, ind in zip(smis, inds)]
+        # stable, so ties keep graph order
+        order = sorted(range(len(smis)), key=lambda i: keys[i], reverse=True)
+        ranked = [smis[i] for i in order]
+
+        self.plan = {}
+        for rank, i in enumerate(order):
+            self.plan[smis[i]] = {
+                'Rank': rank + 1,
+                'ASKCOS ppg': self.ppg_hints.get(smis[i], None),
+                'Leaf': keys[i][1],
+                'Targets reachable': keys[i][2],
+                'Status': 'skipped',
+            }
+
+        return ranked
+
+    def search(self, graph, coster: Coster, smis: Iterable[str], callback: Callable = None) -> Dict[str, Tuple[bool, float]]:
+        """
+        Prices smis (compounds of graph) with coster in ranked order until all are priced or a budget
+        runs out, see Coster.buyable_and_costs. Compounds that were not priced are listed in skipped.
+        """
+        ranked = self.rank(graph, smis)
+        start = time.time()
+        self.n_requests = 0
+        results = {}
+
+        i = 0
+        while i < len(ranked):
+            if self.time_limit is not None and time.time() - start >= self.time_limit:
+                print(f'Costing time limit of {self.time_limit} s reached')
+                break
+            n = self.batch_size
+            if self.max_requests is not None:
+                n = min(n, self.max_requests - self.n_requests)
+                if n <= 0:
+                    print(f'Costing budget of {self.max_requests} requests reached')
+                    break
+
+            batch = ranked[i:i + n]
+            i += n
+            misses = coster.cache.stats['misses'] if coster.cache is not None else 0
+            batch_results = coster.buyable_and_costs(batch, callback=callback)
+            self.n_requests += coster.cache.stats['misses'] - misses if coster.cache is not None else len(batch)
+
+            results.update(batch_results)
+            for smiles in batch:
+                self.plan[smiles]['Status'] = 'priced' if smiles in batch_results else 'failed'
+
+        self.skipped = ranked[i:]
+        n_buyable = sum(buyable for buyable, _ in results.values())
+        print(f'Priced {len(results)} of {len(ranked)} compounds in order of likelihood to be starting materials '
+              f'({n_buyable} buyable, {self.n_requests} coster requests, {time.time() - start:0.1f} s), '
+              f'{len(self.skipped)} skipped')
+
+        return results
+
+    def save(self, filename: Union[str, Path]) -> None:
+        """ Saves the rank, signals and status (priced, failed or skipped) of every compound as a csv """
+        print(f'Saving costing plan to {filename}')
+        columns = ['SMILES', 'Rank', 'ASKCOS ppg', 'Leaf', 'Targets reachable', 'Status']
+        df = pd.DataFrame([{'SMILES': smiles, **entry} for smiles, entry in self.plan.items()], columns=columns)
+        df.sort_values('Rank').to_csv(filename, index=False)
+        return
@@ -0,0 +1,362 @@
+""" Array-backed construction of the route selection MILP """
+from typing import Dict, List, Union
+from pathlib import Path
+from scipy.sparse import csr_matrix, coo_matrix, bmat
+from scipy.sparse.csgraph import connected_components
+from pulp import LpVariable, LpProblem, LpMinimize, LpAffineExpression, LpConstraint, LpConstraintEQ, LpConstraintGE, LpConstraintLE
+import numpy as np
+import json
+
+
+class ModelBuilder:
+    """
+    Assembles the problem   min c @ x   s.t.   row_lb <= A @ x <= row_ub,   lb <= x <= ub
+    (with x[j] integer where integrality[j]) as arrays. Variables are added in named blocks
+    (e.g. 'mol', 'rxn') and constraints as sparse (row, col, value) triplets, so building a
+    model never creates one Python object per term. The arrays can be passed directly to
+    matrix-based solvers, or exported to PuLP (to_pulp) and MPS (write_mps).
+    """
+    def __init__(self, name: str = 'Route_Selection') -> None:
+        self.name = name
+
+        self.names = []
+        self.blocks = {}
+        self._lb = []
+        self._ub = []
+        self._integrality = []
+        self._c = []
+
+        self._rows = []
+        self._cols = []
+        self._vals = []
+        self._row_lb = []
+        self._row_ub = []
+        self.n_rows = 0
+
+        # incremented whenever variables or constraints change, but not the objective
+        self._version = 0
+        self._pulp = None
+
+        return
+
+    @property
+    def n_cols(self) -> int:
+        return len(self.names)
+
+    def add_variables(self, block: str, names: List[str], lb=0, ub=1, integer: bool = True) -> np.ndarray:
+        """ Adds one variable per name (lb and ub are scalars or one value per variable) and returns their column indices """
+        start = self.n_cols
+        n = len(names)
+        self.names.extend(names)
+        self.blocks[block] = np.arange(start, start + n)
+        self._lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (n,)).copy())
+        self._ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (n,)).copy())
+        self._integrality.append(np.full(n, integer, dtype=bool))
+        self._c.append(np.zeros(n))
+        self._version += 1
+
+        return self.blocks[block]
+
+    def add_constraints(self, rows: np.ndarray, cols: np.ndarray, vals: np.ndarray, lb, ub) -> np.ndarray:
+        """
+        Adds constraints lb <= sum(vals * x[cols]) <= ub, where entries with the same value in rows
+        (numbered from 0) belong to the same constraint. lb and ub may be scalars or one value per
+        constraint (use np.inf for one-sided constraints). Returns the new row indices.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        n = int(rows.max()) + 1 if len(rows) > 0 else 0
+        self._rows.append(rows + self.n_rows)
+        self._cols.append(np.asarray(cols, dtype=np.int64))
+        self._vals.append(np.broadcast_to(np.asarray(vals, dtype=float), rows.shape).copy())
+        self._row_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (n,)).copy())
+        self._row_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (n,)).copy())
+
+        new_rows = np.arange(self.n_rows, self.n_rows + n)
+        self.n_rows += n
+        self._version += 1
+
+        return new_rows
+
+    def set_row_bounds(self, rows: np.ndarray, lb, ub) -> None:
+        """ Changes the bounds of existing constraints """
+        row_lb, row_ub = self.row_lb, self.row_ub
+        row_lb[rows] = lb
+        row_ub[rows] = ub
+        self._row_lb, self._row_ub = [row_lb], [row_ub]
+        self._version += 1
+        return
+
+    def set_bounds(self, cols: np.ndarray, lb, ub) -> None:
+        """ Changes the bounds of existing variables (also of the variables of the last to_pulp problem) """
+        cols = np.asarray(cols, dtype=np.int64)
+        var_lb, var_ub = self.lb, self.ub
+        var_lb[cols] = lb
+        var_ub[cols] = ub
+        self._lb, self._ub = [var_lb], [var_ub]
+        if self._pulp is not None:
+            variables = self._pulp[2]
+            for j in cols:
+                variables[j].lowBound = None if np.isinf(var_lb[j]) else var_lb[j]
+                variables[j].upBound = None if np.isinf(var_ub[j]) else var_ub[j]
+        return
+
+    def add_objective(self, cols: np.ndarray, vals: np.ndarray) -> None:
+        """ Adds vals to the objective coefficients of cols (repeated columns are summed) """
+        c = self.c
+        np.add.at(c, np.asarray(cols, dtype=np.int64), vals)
+        self._c = [c]
+        return
+
+    def reset_objective(self) -> None:
+        """ Sets all objective coefficients to zero """
+        self._c = [np.zeros(self.n_cols)]
+        return
+
+    @property
+    def c(self) -> np.ndarray:
+        return np.concatenate(self._c) if self._c else np.zeros(0)
+
+    @property
+    def lb(self) -> np.ndarray:
+        return np.concatenate(self._lb) if self._lb else np.zeros(0)
+
+    @property
+    def ub(self) -> np.ndarray:
+        return np.concatenate(self._ub) if self._ub else np.zeros(0)
+
+    @property
+    def integrality(self) -> np.ndarray:
+        return np.concatenate(self._integrality) if self._integrality else np.zeros(0, dtype=bool)
+
+    @property
+    def row_lb(self) -> np.ndarray:
+        return np.concatenate(self._row_lb) if self._row_lb else np.zeros(0)
+
+    @property
+    def row_ub(self) -> np.ndarray:
+        return np.concatenate(self._row_ub) if self._row_ub else np.zeros(0)
+
+    def matrix(self) -> csr_matrix:
+        """ Returns the constraint matrix A in CSR form """
+        if not self._rows:
+            return csr_matrix((0, self.n_cols))
+        data = (np.concatenate(self._vals), (np.concatenate(self._rows), np.concatenate(self._cols)))
+        return coo_matrix(data, shape=(self.n_rows, self.n_cols)).tocsr()
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """ Returns c, lb, ub, integrality, A, row_lb and row_ub, e.g. for a matrix-based solver """
+        return {
+            'c': self.c,
+            'lb': self.lb,
+            'ub': self.ub,
+            'integrality': self.integrality,
+            'A': self.matrix(),
+            'row_lb': self.row_lb,
+            'row_ub': self.row_ub,
+        }
+
+    def split(self) -> List[tuple]:
+        """
+        Splits the model into independent subproblems: variables are in the same subproblem if
+        they are linked by a chain of constraints. Returns a list of (columns, submodel) with
+        the columns of the full model that each submodel's variables correspond to.
+        """
+        A = self.matrix()
+        B = bmat([[None, A.T], [A, None]], format='csr')
+        n_comps, labels = connected_components(B, directed=False)
+        col_labels = labels[:self.n_cols]
+        row_labels = labels[self.n_cols:]
+
+        col_order = np.argsort(col_labels, kind='stable')
+        row_order = np.argsort(row_labels, kind='stable')
+        col_ptr = np.concatenate([[0], np.cumsum(np.bincount(col_labels, minlength=n_comps))])
+        row_ptr = np.concatenate([[0], np.cumsum(np.bincount(row_labels, minlength=n_comps))])
+        P = A[row_order][:, col_order]
+
+        c, lb, ub, integrality = self.c, self.lb, self.ub, self.integrality
+        row_lb, row_ub = self.row_lb, self.row_ub
+        parts = []
+        for k in range(n_comps):
+            if col_ptr[k] == col_ptr[k+1]:
+                # a constraint without variables
+                continue
+            cols = col_order[col_ptr[k]:col_ptr[k+1]]
+            rows = row_order[row_ptr[k]:row_ptr[k+1]]
+            sub = ModelBuilder(name=f'{self.name}_{k}')
+            sub.names = [self.names[j] for j in cols]
+            sub._lb, sub._ub, sub._c = [lb[cols]], [ub[cols]], [c[cols]]
+            sub._integrality = [integrality[cols]]
+            sub_A = P[row_ptr[k]:row_ptr[k+1], col_ptr[k]:col_ptr[k+1]].tocoo()
+            sub._rows, sub._cols, sub._vals = [sub_A.row.astype(np.int64)], [sub_A.col.astype(np.int64)], [sub_A.data]
+            sub._row_lb, sub._row_ub = [row_lb[rows]], [row_ub[rows]]
+            sub.n_rows = len(rows)
+            parts.append((cols, sub))
+
+        return parts
+
+    def zero_is_optimal(self) -> bool:
+        """ True if x = 0 is feasible and no objective coefficient is negative, so that x = 0 is optimal """
+        return bool(
+            np.all(self.c >= 0) and np.all(self.lb <= 0) and np.all(self.ub >= 0)
+            and np.all(self.row_lb <= 0) and np.all(self.row_ub >= 0)
+        )
+
+    def copy(self) -> 'ModelBuilder':
+        """ Returns a copy that can be changed without changing this model """
+        model = ModelBuilder(name=self.name)
+        model.names = list(self.names)
+        model.blocks = dict(self.blocks)
+        model._lb, model._ub, model._c = [self.lb], [self.ub], [self.c]
+        model._integrality = [self.integrality]
+        model._rows, model._cols, model._vals = list(self._rows), list(self._cols), list(self._vals)
+        model._row_lb, model._row_ub = [self.row_lb], [self.row_ub]
+        model.n_rows = self.n_rows
+        return model
+
+    def relaxation(self) -> 'ModelBuilder':
+        """ Returns a copy in which every variable is continuous (the LP relaxation) """
+        model = self.copy()
+        model.name = f'{self.name}_relaxation'
+        model._integrality = [np.zeros(self.n_cols, dtype=bool)]
+        return model
+
+    def is_feasible(self, x: np.ndarray, tol: float = 1e-6) -> bool:
+        """ True if x satisfies all bounds, constraints and integrality requirements (within tol) """
+        integrality = self.integrality
+        Ax = self.matrix() @ x
+        return bool(
+            np.all(x >= self.lb - tol) and np.all(x <= self.ub + tol)
+            and np.all(np.abs(x[integrality] - np.round(x[integrality])) <= tol)
+            and np.all(Ax >= self.row_lb - tol) and np.all(Ax <= self.row_ub + tol)
+        )
+
+    def objective_value(self, x: np.ndarray) -> float:
+        return float(self.c @ x)
+
+    def to_pulp(self):
+        """ 
+        Returns an equivalent LpProblem and its variables, in column order. If only the objective 
+        changed since the last call, the previous LpProblem is returned with the new objective. 
+        """
+        if self._pulp is not None and self._pulp[0] == self._version:
+            _, problem, variables = self._pulp
+            problem.setObjective(self._pulp_objective(variables))
+            return problem, variables
+
+        problem = LpProblem(self.name, LpMinimize)
+        lb, ub, integrality = self.lb, self.ub, self.integrality
+        variables = [
+            LpVariable(
+                name,
+                lowBound=None if np.isinf(lb[j]) else lb[j],
+                upBound=None if np.isinf(ub[j]) else ub[j],
+                cat='Integer' if integrality[j] else 'Continuous',
+            )
+            for j, name in enumerate(self.names)
+        ]
+        problem.addVariables(variables)
+
+        problem += self._pulp_objective(variables)
+
+        A = self.matrix()
+        row_lb, row_ub = self.row_lb, self.row_ub
+        for i in range(self.n_rows):
+            cols = A.indices[A.indptr[i]:A.indptr[i+1]]
+            vals = A.data[A.indptr[i]:A.indptr[i+1]]
+            expr = LpAffineExpression([(variables[j], v) for j, v in zip(cols, vals)])
+            if row_lb[i] == row_ub[i]:
+                problem.addConstraint(LpConstraint(expr, LpConstraintEQ, rhs=row_lb[i]))
+                continue
+            if not np.isinf(row_lb[i]):
+                problem.addConstraint(LpConstraint(expr, LpConstraintGE, rhs=row_lb[i]))
+            if not np.isinf(row_ub[i]):
+                problem.addConstraint(LpConstraint(expr, LpConstraintLE, rhs=row_ub[i]))
+
+        self._pulp = (self._version, problem, variables)
+
+        return problem, variables
+
+    def _pulp_objective(self, variables: List[LpVariable]) -> LpAffineExpression:
+        c = self.c
+        return LpAffineExpression([(variables[j], c[j]) for j in np.flatnonzero(c)])
+
+    def write_mps(self, filename: Union[str, Path]) -> None:
+        """ Writes the model, with the current objective, as an MPS file for external solvers """
+        problem, _ = self.to_pulp()
+        problem.writeMPS(str(filename), rename=0)
+        return
+
+    def save(self, filename: Union[str, Path], meta: Dict = None) -> None:
+        """ Saves variables, constraints and objective (and json-serializable meta data) as a compressed npz file """
+        A = self.matrix()
+        np.savez_compressed(
+            filename,
+            header=np.array(json.dumps({
+                'name': self.name,
+                'blocks': {block: [int(cols[0]), len(cols)] if len(cols) > 0 else [self.n_cols, 0] for block, cols in self.blocks.items()},
+                'meta': meta if meta is not None else {},
+            })),
+            names=np.array(self.names, dtype=str),
+            lb=self.lb, ub=self.ub, integrality=self.integrality, c=self.c,
+            indptr=A.indptr, indices=A.indices, data=A.data,
+            row_lb=self.row_lb, row_ub=self.row_ub,
+        )
+        return
+
+    @classmethod
+    def load(cls, filename: Union[str, Path]):
+        """ Loads a model saved with save, returns the model and its meta data """
+        with np.load(filename) as f:
+            header = json.loads(str(f['header']))
+            model = cls(name=header['name'])
+            model.names = f['names'].tolist()
+            model.blocks = {block: np.arange(start, start + n) for block, (start, n) in header['blocks'].items()}
+            model._lb, model._ub, model._c = [f['lb']], [f['ub']], [f['c']]
+            model._integrality = [f['integrality']]
+
+            A = csr_matrix((f['data'], f['indices'], f['indptr']), shape=(len(f['row_lb']), len(model.names))).tocoo()
+            model._rows, model._cols, model._vals = [A.row.astype(np.int64)], [A.col.astype(np.int64)], [A.data]
+            model._row_lb, model._row_ub = [f['row_lb']], [f['row_ub']]
+            model.n_rows = len(f['row_lb'])
+
+        return model, header['meta']
+
+    def read_solution(self, filename: Union[str, Path]) -> np.ndarray:
+        """
+        Reads a solution written by an external solver for this model (e.g. from write_mps). Accepts
+        a json file {name: value} or a text solution file with one variable per line, in which the
+        value follows the variable name (e.g. Gurobi/HiGHS 'name value' or CBC 'index name value ...').
+        Only the primal values are read: HiGHS files are read up to their dual values or basis
+        section. Lines without a variable name are skipped and missing variables are 0. A json
+        solution with variables that are not in the model raises a ValueError.
+        """
+        col = {name: j for j, name in enumerate(self.names)}
+        x = np.zeros(self.n_cols)
+        if Path(filename).suffix == '.json':
+            with open(filename, 'r') as f:
+                values = json.load(f)
+            unknown = [name for name in values if name not in col]
+            if unknown:
+                raise ValueError(f'Solution {filename} has {len(unknown)} variables that are not in the model, e.g. {", ".join(unknown[:5])}')
+            for name, value in values.items():
+                x[col[name]] = value
+            return x
+
+        with open(filename, 'r') as f:
+            for line in f:
+                if line.startswith(('# Dual', '# Basis')):
+                    break
+                tokens = line.replace('**', ' ').split()
+                for i, token in enumerate(tokens[:-1]):
+                    if token in col:
+                        try:
+                            x[col[token]] = float(tokens[i+1])
+                        except ValueError:
+                            continue
+                        break
+
+        return x
+
+    def decode(self, x: np.ndarray, block: str, threshold: float = 0.5) -> np.ndarray:
+        """ Returns the positions (within block) of the variables in block with x above threshold """
+        return np.flatnonzero(x[self.blocks[block]] > threshold)
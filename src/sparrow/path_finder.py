@@ -8,7 +8,8 @@ import json
 import urllib3
 from pathlib import Path
 from typing import List, Union
-from sparrow.utils.json_utils import storage_from_api_response, save_storage_dict
+from sparrow.utils.json_utils import combine_tree_files, save_storage_dict
+from sparrow.utils.api_utils import post_and_get
 
 urllib3.disable_warnings()
 
@@ -36,6 +37,8 @@ class AskcosAPIPlanner(PathFinder):
                  max_ppg: int = 10000,
                  max_branching: int = 20,
                  timeout: int = 600,
+                 n_jobs: int = 1,
+                 files_per_job: int = 100,
                  ):
         
         self.host = host
@@ -44,6 +47,8 @@ class AskcosAPIPlanner(PathFinder):
         self.max_branching = max_branching
         self.output_dir = output_dir
         self.timeout = timeout
+        self.n_jobs = n_jobs
+        self.files_per_job = files_per_job
 
         self.params = {
             'buyable_logic': 'or',
@@ -68,30 +73,16 @@ class AskcosAPIPlanner(PathFinder):
         return tree_path
     
     def combine_trees(self, path_ls: List[Path]):
-
-        storage = None
-        for p in tqdm(path_ls, desc='Combining ASKCOS outputs'): 
-            with open(p,'r') as f: 
-                entry = json.load(f)
-            for smi, path in entry.items(): 
-                if 'output' in path and len(path['output'])>0: 
-                    storage = storage_from_api_response({"result": path}, storage)
-
-        return storage 
+        return combine_tree_files(path_ls, n_jobs=self.n_jobs, files_per_job=self.files_per_job)
     
     def post_and_get(self, params, sleep_time = 10, timeout = 650):
-        req = requests.post(self.host+'/api/v2/tree-builder/', data=params, verify=False)
-        try:
-            task_id = req.json()['task_id']
-        except KeyError:
-            return {} , {}
-        results = requests.get(self.host + '/api/v2/celery/task/{}'.format(task_id), verify = False)
-        clock = 0
-        while (not results.json()['complete'] and not results.json().pop('failed', False) and clock <= timeout):
-            time.sleep(sleep_time)
-            results = requests.get(self.host + '/api/v2/celery/task/{}'.format(task_id), verify = False)
-            clock += sleep_time
-        return req.json(), results.json()
+        return post_and_get(
+            host_post=self.host+'/api/v2/tree-builder/', 
+            host_results=self.host+'/api/v2/celery/', 
+            params=params, 
+            sleep_time=sleep_time, 
+            timeout=timeout, 
+        )
 
     def get_trees(self, smiles_ls: list, store_dir: Path) -> List[Path]: 
 
@@ -103,35 +94,36 @@ class AskcosAPIPlanner(PathFinder):
             try:
                 request, result = self.post_and_get(params=self.params, timeout=self.timeout)
                 results[smiles] = result
-            except ConnectionError:
+            except (ConnectionError, requests.RequestException):
                 print ("Connection Error from " + self.host)
         
             with open(store_dir/f'tree_{i}.json','w') as f: 
                 json.dump(results, f, indent='\t')
 
-        return list(store_dir.glob('tree*.json')) 
+        return sorted(store_dir.glob('tree*.json')) 
     
 
 class LookupPlanner(PathFinder):
     """ Loads in a json file that is in a retrosynthesis tree structure """
-    def __init__(self, output_dir: Union[str, Path] = None, file_list: list = [], json_dir: Union[str, Path] = None) -> None:
-        self.file_list = [Path(file_list) for file in file_list] 
+    def __init__(self, 
+                 output_dir: Union[str, Path] = None, 
+                 file_list: list = [], 
+                 json_dir: Union[str, Path] = None, 
+                 n_jobs: int = 1, 
+                 files_per_job: int = 100,
+                 ) -> None:
+        self.file_list = [Path(file) for file in file_list] 
         
         if json_dir is not None: 
-            [self.file_list.append(p) for p in json_dir.glob('*.json')]
+            # sorted so that the combined tree does not depend on directory listing order 
+            [self.file_list.append(p) for p in sorted(Path(json_dir).glob('*.json'))]
         
         self.tree_path = output_dir/'combined_tree.json'
+        self.n_jobs = n_jobs 
+        self.files_per_job = files_per_job
 
     def combine_trees(self):
-        storage = None
-        for p in tqdm(self.file_list, desc='Combining ASKCOS outputs'): 
-            with open(p,'r') as f: 
-                entry = json.load(f)
-            for smi, path in entry.items(): 
-                if 'output' in path and len(path['output'])>0: 
-                    storage = storage_from_api_response({"result": path}, storage)
-
-        return storage 
+        return combine_tree_files(self.file_list, n_jobs=self.n_jobs, files_per_job=self.files_per_job)
         
     def get_save_trees(self, targets=None) -> Path:
         storage = self.combine_trees()        
@@ -1,10 +1,17 @@
 from sparrow import ReactionNode, CompoundNode, Node
 from sparrow.coster import Coster
+from sparrow.topology import Topology
+from sparrow.utils.json_utils import iter_node_records
+from sparrow.utils.profile_utils import peak_memory_mb
+from sparrow.utils.journal import EnrichmentJournal
+from sparrow.utils.smiles_utils import canonical_smiles
+from sparrow.utils.graph_file import GraphFile, write_graph_file, is_graph_file, FLAGS, NUMERIC_COLUMNS
 from typing import Iterable, Dict, Union, Optional, List
 from pathlib import Path
 from tqdm import tqdm
-from datetime import datetime
 from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from types import MappingProxyType
 import json 
 import numpy as np 
 import pickle
@@ -27,19 +34,57 @@ class RouteGraph:
                  node_filename: str = None, 
                 ) -> None:
         """
-        node_filename: filename of a json with information about reaction and compound nodes 
+        node_filename: filename of a json or binary graph file (see to_binary) with information 
+            about reaction and compound nodes 
         """
         
         self.compound_nodes = {}
         self.reaction_nodes = {}
+        self._topology = None
+
+        # node registry, kept up to date by add_* and remove_* methods 
+        self._nodes = {}            # smiles -> Node 
+        self.ids = {}               # id -> Node 
+        self._canonical = None      # canonical smiles -> smiles of compounds with it, built on first use 
+        self._canonical_of = {}     # smiles -> canonical smiles, for compounds in _canonical 
+        self._next_id = {'R': 0, 'C': 0}
         
-        if node_filename:
+        if node_filename and is_graph_file(node_filename): 
+            self.add_from_binary(node_filename)
+        elif node_filename:
 
             self.add_from_json(node_filename)
-
-        self.ids = {}
         
         return
+
+    def _register(self, node: Node, prefix: str) -> None: 
+        """ Adds a newly created node to the registry and assigns it the next free ID """
+        node.id = f"{prefix}{self._next_id[prefix]}"
+        self._next_id[prefix] += 1
+        self._nodes[node.smiles] = node
+        self.ids[node.id] = node 
+        if self._canonical is not None and prefix == 'C': 
+            self._add_canonical(node.smiles)
+        return 
+
+    def _unregister(self, node: Node) -> None: 
+        self._nodes.pop(node.smiles, None)
+        self.ids.pop(node.id, None)
+        can_smi = self._canonical_of.pop(node.smiles, None)
+        if can_smi is not None: 
+            # another compound with the same canonical smiles (if any) takes its place 
+            same = self._canonical[can_smi]
+            same.remove(node.smiles)
+            if not same: 
+                self._canonical.pop(can_smi)
+        return 
+
+    def _add_canonical(self, smiles: str) -> None: 
+        can_smi = canonical_smiles(smiles)
+        if can_smi is not None: 
+            self._canonical.setdefault(can_smi, []).append(smiles)
+            self._canonical_of[smiles] = can_smi
+        return 
     
     def add_reaction_node(self, 
                           smiles: str, 
@@ -50,6 +95,9 @@ class RouteGraph:
         """ Adds reaction node to graph from reaction smiles. If parents/chidlren provided, first add them as 
         compound nodes  """ 
 
+        self._topology = None
+        kwargs.pop('id', None) # IDs are assigned by the graph 
+
         par_smis, child_smis = smiles.split('>>')
         child_smis = list(filter(None, child_smis.split('.')))
         par_smis = list(filter(None, par_smis.split('.')))
@@ -70,6 +118,7 @@ class RouteGraph:
                 children=child_nodes, 
                 dummy=dummy,
                 **kwargs)
+            self._register(self.reaction_nodes[smiles], 'R')
         
         # go back to parent nodes and add this new node as a child 
         for node in parent_nodes: 
@@ -89,6 +138,9 @@ class RouteGraph:
         """ Adds compound node to the graph from smiles. If parents/children are provided, first 
         adds those as reaction nodes. """
         
+        self._topology = None
+        kwargs.pop('id', None) # IDs are assigned by the graph 
+
         if parents: 
             parent_nodes = [self.add_reaction_node(parent) for parent in parents]
         else: 
@@ -113,6 +165,7 @@ class RouteGraph:
                 children=child_nodes, 
                 **kwargs
             )
+            self._register(self.compound_nodes[smiles], 'C')
         
         # go back to parent nodes and add this new node as a child 
         if parents: 
@@ -127,42 +180,110 @@ class RouteGraph:
         return self.compound_nodes[smiles]
     
     def nodes(self) -> Dict[str, Node]:
-        """ Returns a dictionary [smi, ReactionNode] of all nodes in the graph """
-        return {**self.compound_nodes, **self.reaction_nodes}
+        """ Returns a read-only dictionary [smi, Node] of all nodes in the graph """
+        return MappingProxyType(self._nodes)
     
     def remove_dummy_rxns(self) -> None: 
-        for node in self.reaction_nodes_only(): 
-            if node.smiles.startswith('>>'): 
-                self.remove_rxn_node(node.smiles)
+        self.remove_nodes([smi for smi in self.reaction_nodes if smi.startswith('>>')])
         return 
     
     def prune_dummy_rxns(self) -> None: 
-        for node in self.dummy_nodes_only(): 
-            child = list(node.children.values())[0]
-            if not child.buyable: 
-                self.remove_rxn_node(node.smiles)
+        topology = self.topology()
+        compounds = self.compound_nodes_only()
+        to_remove = [
+            topology.smiles[ind] for ind in topology.reaction_indices()
+            if self.reaction_nodes[topology.smiles[ind]].dummy
+            and not compounds[topology.children(ind)[0]].buyable
+        ]
+        self.remove_nodes(to_remove)
         return         
     
-    def remove_rxn_node(self, smi) -> None: 
-        self.reaction_nodes.pop(smi)
+    def remove_nodes(self, nodes: Iterable[str]) -> int: 
+        """ Removes nodes, given as smiles or IDs, and all of their edges. Only the neighbors 
+        of removed nodes are visited. Returns the number of nodes removed. """
+        to_remove = {}
+        for key in nodes: 
+            node = self._nodes.get(key, None) or self.ids.get(key, None)
+            if node is None: 
+                warnings.warn(f'Node {key} is not in the graph and cannot be removed')
+                continue 
+            to_remove[node.smiles] = node 
 
-        for node in self.compound_nodes_only(): 
-            if smi in node.parents: 
-                node.parents.pop(smi)
-            if smi in node.children: 
-                node.parents.pop(smi)
+        for smi, node in to_remove.items(): 
+            for parent in node.parents.values(): 
+                parent.children.pop(smi, None)
+            for child in node.children.values(): 
+                child.parents.pop(smi, None)
 
-        return 
+            if smi in self.reaction_nodes: 
+                self.reaction_nodes.pop(smi)
+            else: 
+                self.compound_nodes.pop(smi)
+            self._unregister(node)
+
+        self._topology = None
+
+        return len(to_remove)
     
-    def remove_compound_node(self, smi) -> None: 
-        self.compound_nodes.pop(smi)
+    def prune_dead_ends(self, targets: Iterable[str]) -> Dict[str, int]: 
+        """ 
+        Removes nodes that cannot be part of a feasible route to any target (given as smiles or IDs). 
+        A forward sweep from the starting material (dummy) reactions finds the reactions whose 
+        reactants can all be made or bought, and the compounds made by at least one of them. 
+        A backward sweep from the targets over those reactions finds the nodes that lead to a 
+        target. Everything else is removed, except the targets themselves. Returns the number 
+        of removed reactions and compounds. 
+        """
+        topology = self.topology()
+        target_inds = [topology.index(self.node_from_id(t).smiles if t in self.ids else t) for t in targets]
+
+        # forward AND/OR sweep: a reaction is feasible once all of its parents are feasible 
+        missing = topology.n_parents().copy()
+        feasible = np.zeros(topology.n_nodes, dtype=bool)
+        queue = [ind for ind in topology.reaction_indices() if missing[ind] == 0]
+        feasible[queue] = True 
+        while queue: 
+            ind = queue.pop()
+            for child in topology.children(ind): 
+                if topology.is_rxn[child]: 
+                    missing[child] -= 1
+                    if missing[child] == 0: 
+                        feasible[child] = True 
+                        queue.append(child)
+                elif not feasible[child]: 
+                    feasible[child] = True 
+                    queue.append(child)
+
+        # backward sweep from feasible targets over feasible reactions 
+        useful = np.zeros(topology.n_nodes, dtype=bool)
+        queue = [ind for ind in target_inds if feasible[ind]]
+        useful[queue] = True 
+        while queue: 
+            ind = queue.pop()
+            for par in topology.parents(ind): 
+                if feasible[par] and not useful[par]: 
+                    useful[par] = True 
+                    queue.append(par)
+        
+        useful[target_inds] = True 
+        to_remove = np.flatnonzero(~useful)
+        n_rxns = int(topology.is_rxn[to_remove].sum())
+        n_cpds = len(to_remove) - n_rxns 
 
-        for node in self.reaction_nodes_only(): 
-            if smi in node.parents: 
-                node.parents.pop(smi)
-            if smi in node.children: 
-                node.parents.pop(smi)
+        self.remove_nodes([topology.smiles[ind] for ind in to_remove])
+        print(
+            f'Pruned {n_rxns} of {topology.n_reactions} reactions and {n_cpds} of {topology.n_compounds} compounds '
+            'that cannot be part of a feasible route to a target'
+        )
+
+        return {'reactions': n_rxns, 'compounds': n_cpds}
 
+    def remove_rxn_node(self, smi) -> None: 
+        self.remove_nodes([smi])
+        return 
+    
+    def remove_compound_node(self, smi) -> None: 
+        self.remove_nodes([smi])
         return         
     
     def save(self, filename: Union[str, Path] = None) -> None: 
@@ -209,8 +330,11 @@ class RouteGraph:
         
         return 
     
-    def set_buyable_compounds_and_costs(self, coster: Coster = None, save_json_dir: str = None):
-        """ sets CompoundNode.buyable and CompoundNode.cost_per_g for starting materials in ChemSpace """
+    def set_buyable_compounds_and_costs(self, coster: Coster = None, save_json_dir: str = None, journal: EnrichmentJournal = None, planner = None):
+        """ sets CompoundNode.buyable and CompoundNode.cost_per_g for starting materials in ChemSpace. 
+        If a journal is provided, every result is recorded in it and compounds it already holds are skipped. 
+        If the coster has a price cache, compounds found in it are not searched again. If a CostingPlanner 
+        is provided, compounds are searched in its order, and those it skips are set to not buyable """
 
         if coster is None: 
             return 
@@ -218,28 +342,44 @@ class RouteGraph:
         coster.build_status_log()
         
         prog_bar = tqdm(total=len(self.compound_nodes_only()), desc= 'Searching for price/buyability', position=0)
-        c = 0
+        to_search = []
         for node in self.compound_nodes_only(): 
-            if node.cost_set and node.cost_per_g != 1: 
+            if (node.cost_set and node.cost_per_g != 1) or (journal is not None and journal.is_done('cost', node.smiles)): 
                 prog_bar.update(1)
-                continue 
-
-            coster.status_log.set_description_str(f'Searching for {node.smiles}')
+            else: 
+                to_search.append(node.smiles)
 
-            buyable, cost = coster.get_buyable_and_cost(node.smiles)
-            node.update(
+        def update_node(smiles, buyable, cost): 
+            self.compound_nodes[smiles].update(
                 buyable=buyable, 
                 cost_per_g=cost,
             )
-            c += 1
+            if journal is not None: 
+                journal.record('cost', smiles, buyable=buyable, cost_per_g=cost)
             prog_bar.update(1)
+        
+        # costers that search concurrently call update_node as results arrive 
+        if planner is None: 
+            results = coster.buyable_and_costs(to_search, callback=update_node)
+            skipped = []
+        else: 
+            results = planner.search(self, coster, to_search, callback=update_node)
+            skipped = planner.skipped 
+            for smiles in skipped: 
+                self.compound_nodes[smiles].update(buyable=False)
+                prog_bar.update(1)
+        
+        if len(results) + len(skipped) < len(to_search): 
+            warnings.warn(f'{len(to_search) - len(results) - len(skipped)} compounds could not be searched, their buyability and cost are unknown')
+        if coster.cache is not None: 
+            print(coster.cache.summary())
+        
+        if journal is not None: 
+            journal.flush()
 
-            if c % 500 == 0 and save_json_dir is not None: 
-                time = datetime.now().strftime("%H-%M-%S")
-                self.to_json(Path(save_json_dir) / f'trees_w_costs_{time}.json')
-            
-        coster.status_log.set_description_str('Saving retrosynthetic graph with costs')
-        self.to_json(Path(save_json_dir) / f'trees_w_costs.json')
+        if save_json_dir is not None: 
+            coster.status_log.set_description_str('Saving retrosynthetic graph with costs')
+            self.to_json(Path(save_json_dir) / f'trees_w_costs.json')
         coster.status_log.set_description_str('Done searching for buyability and costs')
 
         return 
@@ -274,7 +414,7 @@ class RouteGraph:
         return buyable_nodes
     
     def id_nodes(self):
-        """ Sets IDs for all nodes """
+        """ Renumbers IDs of all nodes so they are contiguous (R0..Rn, C0..Cm) """
         
         self.rxn_ids = {}
         for i, node in enumerate(self.reaction_nodes_only()):
@@ -287,6 +427,8 @@ class RouteGraph:
             node.id = f"C{i}"
         
         self.ids = {**self.rxn_ids, **self.compound_ids}
+        self._next_id = {'R': len(self.rxn_ids), 'C': len(self.compound_ids)}
+        self._topology = None
 
         return self.ids
 
@@ -314,10 +456,25 @@ class RouteGraph:
         return self.ids[id]
     
     def node_from_smiles(self, smiles) -> Node: 
-        return self.nodes()[smiles]
+        return self._nodes[smiles]
     
     def id_from_smiles(self, smiles) -> str: 
-        return self.nodes()[smiles].id
+        return self._nodes[smiles].id
+
+    def node_from_canonical_smiles(self, smiles) -> Optional[CompoundNode]: 
+        """ Returns the compound node whose smiles canonicalizes to the same smiles 
+        as the input, or None if there is no such node """
+        if self._canonical is None: 
+            self._canonical = {}
+            for smi in self.compound_nodes: 
+                self._add_canonical(smi)
+        
+        can_smi = canonical_smiles(smiles)
+        if can_smi is None: 
+            return None 
+        
+        same = self._canonical.get(can_smi)
+        return self.compound_nodes[same[0]] if same else None
     
     def molid_from_smiles(self, smiles) -> str: 
         return self.compound_nodes[smiles].id
@@ -330,29 +487,44 @@ class RouteGraph:
         reagents = set([i for cond in conditions for i in cond])
         return reagents    
 
-    def compute_adjacency_matrix(self) -> csr_matrix: 
-        id_to_ind = {node.id: ind for ind, node in enumerate(self.nodes().values())}
-
-        rows = []
-        cols = []
+    def topology(self) -> Topology: 
+        """ Returns the array-backed Topology of this graph, compiling it if the graph 
+        has changed since it was last compiled """
+        if self._topology is None: 
+            self._topology = Topology.from_nodes(
+                self.compound_nodes.values(), 
+                self.reaction_nodes.values(),
+            )
+        return self._topology
 
-        for idd, ind in id_to_ind.items():
-            child_ids = [child.id for child in self.node_from_id(idd).children.values()]
-            for id in child_ids: 
-                rows.append(id_to_ind[id])
-                cols.append(ind)
+    def compute_adjacency_matrix(self) -> csr_matrix: 
+        topology = self.topology()
+        return topology.adjacency_matrix(), topology.id_to_ind()
+
+    def cyclic_components(self, nodes: np.ndarray = None) -> List[np.ndarray]: 
+        """ Returns the topology() indices of the nodes in each strongly connected 
+        component that contains a cycle. Nodes outside these components are on no cycle. 
+        If nodes (topology() indices) are given, only the subgraph of those nodes is considered. """
+        topology = self.topology()
+        A = topology.adjacency_matrix()
+        nodes = np.arange(topology.n_nodes) if nodes is None else np.asarray(nodes, dtype=np.int64)
+        if len(nodes) == 0: 
+            return []
         
-        data = (np.ones(len(rows)), (np.array(rows), np.array(cols)) )
-         
-        A = csr_matrix( data, shape=(len(id_to_ind), len(id_to_ind)) )        
-
-        return A, id_to_ind
-
-    def dfs_find_cycles_nx(self) -> list: 
-        A, id_to_ind = self.compute_adjacency_matrix()
-        cycles = find_cycles_nx(A)
-        ind_to_id = {ind: idd for idd, ind in id_to_ind.items()}
-        cycless = [[ind_to_id[ind] for ind in cyc if ind_to_id[ind].startswith('R') ] for cyc in cycles]
+        n_comps, labels = connected_components(A[nodes][:, nodes], directed=True, connection='strong')
+        order = np.argsort(labels, kind='stable')
+        components = np.split(order, np.cumsum(np.bincount(labels, minlength=n_comps))[:-1])
+        return [nodes[comp] for comp in components if len(comp) > 1]
+
+    def dfs_find_cycles_nx(self, nodes: np.ndarray = None) -> list: 
+        """ Enumerates all simple cycles, returned as lists of reaction IDs. Only the 
+        cyclic strongly connected components (of the subgraph of nodes, if given) are searched. """
+        topology = self.topology()
+        A = topology.adjacency_matrix()
+        cycless = []
+        for comp in self.cyclic_components(nodes): 
+            cycles = find_cycles_nx(A[comp][:, comp])
+            cycless.extend([[topology.ids[comp[ind]] for ind in cyc if topology.is_rxn[comp[ind]]] for cyc in cycles])
         return cycless 
 
     def to_json(self, filename) -> None: 
@@ -368,34 +540,187 @@ class RouteGraph:
         return 
 
     def add_from_json(self, filename) -> None:
+        """ 
+        Adds node information from a json file. Node records are streamed from the file 
+        twice: the first pass creates every node that has a record and sets its attributes, 
+        the second pass wires the edges listed in each record. Finally, every reaction node 
+        is connected to the reactants and products in its reaction smiles. 
+        """
+        n_compounds, n_reactions = len(self.compound_nodes), len(self.reaction_nodes)
+
+        for section, node_info in iter_node_records(filename, desc='Building graph (nodes)'): 
+            smiles = node_info.pop('smiles')
+            for key in ['parents', 'children', 'id', 'cost_set']: 
+                node_info.pop(key, None)
+            selected = node_info.pop('selected', None)
+
+            if section == 'Compound Nodes': 
+                node = self._get_or_create_compound(smiles)
+            elif section == 'Reaction Nodes': 
+                node = self._get_or_create_reaction(smiles)
+            else: 
+                continue 
+            
+            node.update(**node_info)
+            if selected is not None: 
+                node.selected = selected 
+
+        for section, node_info in iter_node_records(filename, desc='Building graph (edges)'): 
+            if section == 'Compound Nodes': 
+                node = self.compound_nodes[node_info['smiles']]
+                get_neighbor = self._get_or_create_reaction
+            elif section == 'Reaction Nodes': 
+                node = self.reaction_nodes[node_info['smiles']]
+                get_neighbor = self._get_or_create_compound
+            else: 
+                continue 
 
-        """ Adds node information from a json file """
-        with open(filename, 'r') as f: 
-            storage = json.load(f)
+            for smi in node_info.get('parents', None) or []: 
+                self._add_edge(get_neighbor(smi), node)
+            for smi in node_info.get('children', None) or []: 
+                self._add_edge(node, get_neighbor(smi))
         
-        if 'Compound Nodes' in storage.keys(): 
-            for node_info in tqdm(storage['Compound Nodes'], desc='Building graph (compound nodes)'): 
-                self.add_compound_node(
-                    smiles=node_info.pop('smiles'),
-                    parents=node_info.pop('parents') if 'parents' in node_info else [],
-                    children=node_info.pop('children') if 'children' in node_info else [],
-                    **node_info,
-                )
+        for node in self.reaction_nodes_only(): 
+            par_smis, child_smis = node.smiles.split('>>')
+            for smi in filter(None, par_smis.split('.')): 
+                self._add_edge(self._get_or_create_compound(smi), node)
+            for smi in filter(None, child_smis.split('.')): 
+                self._add_edge(node, self._get_or_create_compound(smi))
+
+        self._topology = None
         
-        if 'Reaction Nodes' in storage.keys(): 
-            for node_info in tqdm(storage['Reaction Nodes'], desc='Building graph (reaction nodes)'): 
-                self.add_reaction_node(
-                    smiles=node_info.pop('smiles'),
-                    parents=node_info.pop('parents') if 'parents' in node_info else [],
-                    children=node_info.pop('children') if 'children' in node_info else [], 
-                    **node_info,
-                )
+        peak = peak_memory_mb()
+        print(
+            f'Added {len(self.compound_nodes) - n_compounds} compound nodes and '
+            f'{len(self.reaction_nodes) - n_reactions} reaction nodes from {filename}'
+            + (f' (peak memory {peak:0.0f} MB)' if peak is not None else '')
+        )
         
         return
 
+    def to_binary(self, filename) -> None: 
+        """ Saves the graph in the compact binary format of sparrow.utils.graph_file, which can 
+        be memory-mapped with GraphFile or loaded with RouteGraph(node_filename=filename) """
+        topology = self.topology()
+        nodes = [*self.compound_nodes_only(), *self.reaction_nodes_only()]
+
+        flags = np.zeros(len(nodes), dtype=np.uint16)
+        columns = {col: np.full(len(nodes), np.nan) for col in NUMERIC_COLUMNS}
+        conditions = []
+        for ind, node in enumerate(nodes): 
+            flag = FLAGS['selected'] if node.selected else 0
+            for col in NUMERIC_COLUMNS: 
+                value = getattr(node, col, None)
+                if value is not None: 
+                    columns[col][ind] = value 
+            
+            if isinstance(node, CompoundNode): 
+                for attr in ['buyable', 'is_target', 'is_intermediate']: 
+                    value = getattr(node, attr)
+                    if value is not None: 
+                        flag |= FLAGS[f'{attr}_known'] | (FLAGS[attr] if value else 0)
+                flag |= FLAGS['cost_set'] if node.cost_set else 0
+                conditions.append('null')
+            else: 
+                flag |= FLAGS['dummy'] if node.dummy else 0
+                flag |= FLAGS['score_set'] if node.score_set else 0
+                flag |= FLAGS['condition_set'] if node.condition_set else 0
+                conditions.append(json.dumps(node.condition))
+            
+            flags[ind] = flag 
+
+        write_graph_file(
+            filename, 
+            n_compounds=len(self.compound_nodes), 
+            arrays={
+                'parent_ptr': topology.parent_ptr, 
+                'parent_ind': topology.parent_ind, 
+                'child_ptr': topology.child_ptr, 
+                'child_ind': topology.child_ind, 
+                'flags': flags, 
+                **columns,
+            }, 
+            strings={
+                'smiles': topology.smiles, 
+                'ids': [str(idd) for idd in topology.ids], 
+                'conditions': conditions,
+            },
+        )
+        
+        return 
+
+    def add_from_binary(self, filename) -> None: 
+        """ Adds nodes and edges from a binary graph file written by to_binary """
+        graph_file = GraphFile(filename)
+        smiles = graph_file.strings('smiles')
+        flags = graph_file['flags']
+        columns = {col: graph_file[col].tolist() for col in NUMERIC_COLUMNS}
+        nan_to_none = lambda value: None if value != value else value 
+
+        nodes = []
+        for ind, smi in enumerate(tqdm(smiles, desc='Building graph (nodes)')): 
+            flag = int(flags[ind])
+            if ind < graph_file.n_compounds: 
+                node = self._get_or_create_compound(smi)
+                for attr in ['buyable', 'is_target', 'is_intermediate']: 
+                    if flag & FLAGS[f'{attr}_known']: 
+                        setattr(node, attr, bool(flag & FLAGS[attr]))
+                node.cost_per_g = nan_to_none(columns['cost_per_g'][ind])
+                node.reward = nan_to_none(columns['reward'][ind])
+                node.cost_set = bool(flag & FLAGS['cost_set'])
+            else: 
+                node = self._get_or_create_reaction(smi)
+                node.dummy = bool(flag & FLAGS['dummy'])
+                node.score_set = bool(flag & FLAGS['score_set'])
+                node.condition_set = bool(flag & FLAGS['condition_set'])
+                node.condition = graph_file.condition(ind)
+                for col in ['score', 'penalty', 'max_penalty']: 
+                    setattr(node, col, nan_to_none(columns[col][ind]))
+            node.selected = int(bool(flag & FLAGS['selected']))
+            nodes.append(node)
+        
+        parent_ptr, parent_ind = graph_file['parent_ptr'], graph_file['parent_ind']
+        for ind, node in enumerate(tqdm(nodes, desc='Building graph (edges)')): 
+            for par in parent_ind[parent_ptr[ind]:parent_ptr[ind+1]]: 
+                self._add_edge(nodes[par], node)
 
+        self._topology = None
+
+        return 
+
+    def _get_or_create_compound(self, smiles: str) -> CompoundNode: 
+        """ Returns the compound node for smiles, creating it without any edges if needed """
+        node = self.compound_nodes.get(smiles, None)
+        if node is None: 
+            node = self.compound_nodes[smiles] = CompoundNode(smiles)
+            self._register(node, 'C')
+        return node 
+    
+    def _get_or_create_reaction(self, smiles: str) -> ReactionNode: 
+        """ Returns the reaction node for smiles, creating it without any edges if needed """
+        node = self.reaction_nodes.get(smiles, None)
+        if node is None: 
+            node = self.reaction_nodes[smiles] = ReactionNode(smiles)
+            self._register(node, 'R')
+        return node 
+    
+    @staticmethod
+    def _add_edge(parent: Node, child: Node) -> None: 
+        parent.children[child.smiles] = child 
+        child.parents[parent.smiles] = parent 
+        return 
 
     
+def json_to_binary(json_file: Union[str, Path], binary_file: Union[str, Path]) -> None: 
+    """ Converts a RouteGraph json file into the binary graph format """
+    RouteGraph(node_filename=json_file).to_binary(binary_file)
+    return 
+
+def binary_to_json(binary_file: Union[str, Path], json_file: Union[str, Path]) -> None: 
+    """ Converts a binary graph file into the RouteGraph json layout """
+    RouteGraph(node_filename=binary_file).to_json(json_file)
+    return 
+
 def load_route_graph(filename: Union[str, Path]) -> RouteGraph:
     """ Loads route graph from pickle file """
     with open(filename, 'rb') as file:
@@ -2,27 +2,40 @@ from sparrow.scorer import Scorer
 from sparrow.condition_recommender import Recommender
 from sparrow.route_graph import RouteGraph
 from sparrow.coster import Coster
+from sparrow.costing_planner import CostingPlanner
 from sparrow.nodes import ReactionNode
 from sparrow.utils.cluster_utils import cluster_smiles
+from sparrow.utils.journal import EnrichmentJournal, graph_hash
+from sparrow.utils.profile_utils import Profiler
+from sparrow.model_builder import ModelBuilder
+from sparrow.solvers import solve_pulp, solve_highs, solve_decomposed, solve_model
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order
 from typing import Dict, Union, List
-from pulp import LpVariable, LpProblem, LpMinimize, lpSum, GUROBI
-from pulp.apis import PULP_CBC_CMD
-from rdkit import Chem
 from tqdm import tqdm
 from pathlib import Path
-from datetime import datetime
 import time
 import warnings
 import csv 
 import json 
+import hashlib 
+import numpy as np 
 
 reward_type = Union[int, float]
 
+
+def dominates(a: Dict, b: Dict, objective: str, tol: float = 1e-6) -> bool: 
+    """ Whether Pareto point a has at least the reward and at most the objective of b, and is better in one of them """
+    no_worse = a['reward'] >= b['reward'] - tol and a[objective] <= b[objective] + tol
+    better = a['reward'] > b['reward'] + tol or a[objective] < b[objective] - tol
+    return no_worse and better
+
+
 class RouteSelector: 
     """ 
     RouteSelector performs the selection of molecules and their synthetic routes. 
-    The selection is performed on a RouteGraph using PuLP to set up the 
-    optimization problem and Gurobi to solve it. 
+    The selection is performed on a RouteGraph: the optimization problem is 
+    assembled as sparse arrays by a ModelBuilder and exported to PuLP to solve it. 
     """
     def __init__(self, 
                  route_graph: RouteGraph, 
@@ -35,18 +48,35 @@ class RouteSelector:
                  output_dir: str = 'debug',
                  remove_dummy_rxns_first: bool = False,
                  cluster_cutoff: float = 0.7, 
+                 cycle_method: str = 'simple',
+                 profiler: Profiler = None, 
+                 costing_planner: CostingPlanner = None, 
                  ) -> None:
 
         self.dir = Path(output_dir)
+        # records the time and memory of each stage, saved by the CLI as profile.json 
+        self.profiler = Profiler() if profiler is None else profiler 
 
         self.graph = route_graph  
+
+        Path(self.dir/'chkpts').mkdir(parents=True, exist_ok=True)
+        self.journal = EnrichmentJournal(
+            self.dir/'chkpts'/'journal.jsonl', 
+            header={'graph': graph_hash(self.graph), 'coster': coster.cache_key() if coster is not None else None}, 
+        )
+        n_replayed = self.journal.replay(self.graph)
+        if n_replayed > 0: 
+            print(f'Resuming from {self.journal.filename}: restored {n_replayed} costs, conditions, and scores')
+
         if remove_dummy_rxns_first: 
             self.graph.remove_dummy_rxns()
         else: 
             self.graph.prune_dummy_rxns()
 
-        Path(self.dir/'chkpts').mkdir(parents=True, exist_ok=True)
-        self.graph.set_buyable_compounds_and_costs(coster, save_json_dir=self.dir/'chkpts')
+        with self.profiler.stage('costing'): 
+            self.graph.set_buyable_compounds_and_costs(coster, journal=self.journal, planner=costing_planner)
+        if coster is not None and costing_planner is not None: 
+            costing_planner.save(self.dir/'costing_plan.csv')
         self.add_dummy_starting_rxn_nodes()
 
         self.graph.id_nodes()
@@ -62,15 +92,24 @@ class RouteSelector:
         self.constrain_all_targets = constrain_all_targets
         self.weights = weights
         self.cluster_cutoff = cluster_cutoff
+        self.cycle_method = cycle_method
         
 
         if self.condition_recommender is not None: 
-            self.get_recommendations()
+            with self.profiler.stage('condition recommendation'): 
+                self.get_recommendations()
 
         if self.rxn_scorer is not None: 
-            self.get_rxn_scores()
+            with self.profiler.stage('scoring'): 
+                self.get_rxn_scores()
 
-        self.problem = LpProblem("Route_Selection", LpMinimize)
+        if self.journal.n_records > 0: 
+            p = self.dir / 'chkpts' / 'trees_w_info.json'
+            print(f'Saving route graph with all costs, conditions, and scores to {p}')
+            self.journal.compact(self.graph, p)
+
+        self.model = None 
+        self.problem = None 
 
     def clean_target_dict(self, target_dict: Dict[str, float]) -> Dict[str, float]:
         """ Converts target dict from Dict[smiles, reward] to Dict[id, reward] """
@@ -87,16 +126,14 @@ class RouteSelector:
                 continue     
             
             node = self.graph.compound_nodes.get(old_smi, None)
+            if node is None: 
+                node = self.graph.node_from_canonical_smiles(old_smi)
+
             if node:
                 self.target_dict[node.id] = reward
-            else: 
-                clean_smi = Chem.MolToSmiles(Chem.MolFromSmiles(old_smi))
-                node = self.graph.compound_nodes.get(clean_smi, None)
-                if node: 
-                    self.target_dict[node.id] = reward          
-                else:       
-                    warnings.warn(f'Target {old_smi} is not in routes and is being removed from target set')
-                    c+=1
+            else:       
+                warnings.warn(f'Target {old_smi} is not in routes and is being removed from target set')
+                c+=1
 
         if len(self.target_dict) < len(target_dict):
             p = self.dir / 'cleaned_tar_dict.csv'
@@ -116,26 +153,20 @@ class RouteSelector:
 
     def get_recommendations(self): 
         """ Completes condition recommendation for any reaction node that does not have conditions """
-        count = 0
         for node in tqdm(self.graph.non_dummy_nodes(), 'Recommending Conditions'):
-            if node.condition_set: 
+            if node.condition_set or self.journal.is_done('condition', node.smiles): 
                 continue
             
             condition = self.condition_recommender(node.smiles)
             node.update_condition(condition)
-            count += 1
-
-            if count % 100 == 0: 
-                time = datetime.now().strftime("%H-%M-%S")
-                self.graph.to_json(self.dir / 'chkpts' / f'trees_w_conditions_{time}.json')
-            
-        self.graph.to_json(self.dir / 'chkpts' / f'trees_w_conditions.json')
+            self.journal.record('condition', node.smiles, condition=condition)
+        
+        self.journal.flush()
     
     def get_rxn_scores(self): 
         """ Scores all reactions in the graph that are not already scored """
-        count = 0
         for node in tqdm(self.graph.reaction_nodes_only(), 'Scoring reactions'): 
-            if (node.score_set and node.score > 0) or node.dummy: 
+            if (node.score_set and node.score > 0) or node.dummy or self.journal.is_done('score', node.smiles): 
                 continue 
 
             try:    
@@ -145,33 +176,109 @@ class RouteSelector:
                 score = 0 
 
             node.update(score=score)
-            count += 1
-            if count % 100 == 0: 
-                time = datetime.now().strftime("%H-%M-%S")
-                self.graph.to_json(self.dir / 'chkpts' / f'trees_w_scores_{time}.json')
+            self.journal.record('score', node.smiles, score=score)
         
-        self.graph.to_json(self.dir / 'chkpts' / f'trees_w_scores.json')
+        self.journal.flush()
+
+    def prune_dead_ends(self): 
+        """ Removes reactions and compounds that cannot contribute to a feasible route to a target, 
+        so that they do not become variables and constraints """
+        with self.profiler.stage('pruning'): 
+            return self.graph.prune_dead_ends(self.targets)
+
+    def build_model(self, set_cycle_constraints: bool = True, cache_dir: Union[str, Path] = None): 
+        """ 
+        Defines variables, objective and constraints. If cache_dir is given, the built model is saved 
+        there under a hash of the graph, targets and formulation (see model_key), and later calls with 
+        the same hash load it instead of rebuilding it. The objective is always set from the current 
+        weights, so a cached model can be reused with other weights. 
+        """
+        if cache_dir is None: 
+            with self.profiler.stage('model build'): 
+                self.define_variables()
+                self.set_objective()
+            self.set_constraints(set_cycle_constraints=set_cycle_constraints)
+            return 
+        
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        p = Path(cache_dir) / f'model_{self.model_key(set_cycle_constraints)}.npz'
+        if p.exists(): 
+            print(f'Loading cached model from {p}')
+            with self.profiler.stage('model build'): 
+                self.load_model(p)
+                self.lazy_cycles = set_cycle_constraints and self.cycle_method == 'lazy' 
+                self.set_objective()
+            return 
+        
+        with self.profiler.stage('model build'): 
+            self.define_variables()
+            self.set_objective()
+        self.set_constraints(set_cycle_constraints=set_cycle_constraints)
+        print(f'Saving model to {p}')
+        with self.profiler.stage('model build'): 
+            self.save_model(p)
+
+        return 
+
+    def model_key(self, set_cycle_constraints: bool = True) -> str: 
+        """ 
+        Returns a hash of everything the variables and constraints depend on: the nodes, IDs and 
+        edges of the graph, the targets, and the formulation options. Costs, rewards, penalties and 
+        weights only enter the objective, so they are not part of the hash (except whether the 
+        diversity objective, and with it the cluster constraints, is used). 
+        """
+        topology = self.graph.topology()
+        h = hashlib.sha256()
+        h.update(json.dumps({
+            'version': 1, 
+            'smiles': topology.smiles, 
+            'ids': topology.ids, 
+            'targets': self.targets, 
+            'cycles': self.cycle_method if set_cycle_constraints else None, 
+            'clusters': self.cluster_cutoff if self.weights[3] > 0 else None, 
+        }).encode('utf-8'))
+        for arr in [topology.is_rxn, topology.parent_ptr, topology.parent_ind]: 
+            h.update(np.ascontiguousarray(arr).tobytes())
+        
+        return h.hexdigest()[:16]
+
+    def save_model(self, filename: Union[str, Path]): 
+        meta = {}
+        if 'cluster' in self.model.blocks: 
+            with open(self.dir / 'clusters.json', 'r') as f: 
+                meta['clusters'] = json.load(f)
+        self.model.save(filename, meta=meta)
+        return 
+
+    def load_model(self, filename: Union[str, Path]): 
+        self.topology = self.graph.topology()
+        self.model, meta = ModelBuilder.load(filename)
+        self.problem = None 
+        self.lazy_cycles = False 
+        self.presolve_fixed = None 
+        if 'clusters' in meta: 
+            with open(self.dir / 'clusters.json', 'w') as f: 
+                json.dump(meta['clusters'], f, indent='\t')
+        return 
 
     def define_variables(self): 
         """ 
         TODO: explain in readme what variables mean, refer to that here 
         (currently in my thesis proposal)
         TODO: include conditions 
+        Defines one binary variable per compound (mol_{id}) and per reaction (rxn_{id}). 
+        Compounds are added before reactions, so the column of every node variable is 
+        its index in the graph topology. 
         """
-
-        rxn_ids = [node.id for node in self.graph.reaction_nodes_only()]
-        self.r = LpVariable.dicts(
-            "rxn", 
-            indices=rxn_ids, 
-            cat="Binary",
-        )
-
-        mol_ids = [node.id for node in self.graph.compound_nodes_only()]
-        self.m = LpVariable.dicts(
-            "mol", 
-            mol_ids, 
-            cat="Binary",
-        )
+        self.topology = self.graph.topology()
+        self.model = ModelBuilder()
+        self.problem = None 
+        self.lazy_cycles = False 
+        self.presolve_fixed = None 
+
+        topology = self.topology
+        self.model.add_variables('mol', [f'mol_{topology.ids[ind]}' for ind in topology.compound_indices()])
+        self.model.add_variables('rxn', [f'rxn_{topology.ids[ind]}' for ind in topology.reaction_indices()])
         
         return 
 
@@ -180,45 +287,128 @@ class RouteSelector:
         print('Setting constraints ...')
         # implement constrain_all_targets later
 
-        self.set_rxn_constraints()
-        self.set_mol_constraints()
+        with self.profiler.stage('model build'): 
+            self.set_rxn_constraints()
+            self.set_mol_constraints()
 
         if set_cycle_constraints: 
-            self.set_cycle_constraints()
+            with self.profiler.stage('cycle detection'): 
+                self.set_cycle_constraints()
 
         return 
     
     def set_rxn_constraints(self): 
-
-        for node in tqdm(self.graph.reaction_nodes_only(), desc='Reaction constraints'): 
-            if node.dummy: 
-                continue 
-            par_ids = [par.id for par in node.parents.values()]
-            for par_id in par_ids: 
-                self.problem += (
-                    self.m[par_id] >= self.r[node.id]
-                )
+        """ A reaction can only be selected if all of its reactants are selected: m_par - r >= 0 """
+        topology = self.topology
+        rxn_inds, par_inds = topology.parent_edges()
+        is_rxn_edge = topology.is_rxn[rxn_inds]
+        # dummy reactions have no parents, so every remaining edge belongs to a real reaction
+        rxn_inds, par_inds = rxn_inds[is_rxn_edge], par_inds[is_rxn_edge]
+        rows = np.arange(len(rxn_inds))
+        self.model.add_constraints(
+            rows=np.concatenate([rows, rows]), 
+            cols=np.concatenate([par_inds, rxn_inds]), 
+            vals=np.concatenate([np.ones(len(rows)), -np.ones(len(rows))]), 
+            lb=0, ub=np.inf,
+        )
         
         return 
     
     def set_mol_constraints(self): 
-
-        for node in tqdm(self.graph.compound_nodes_only(), 'Compound constraints'): 
-            parent_ids = [par.id for par in node.parents.values()]
-            self.problem += (
-                self.m[node.id] <= lpSum(self.r[par_id] for par_id in parent_ids)
-            )
+        """ A compound can only be selected if a reaction producing it is selected: m - sum(r_par) <= 0 """
+        topology = self.topology
+        cpd_inds = topology.compound_indices()
+        nodes, par_inds = topology.parent_edges()
+        is_cpd_edge = ~topology.is_rxn[nodes]
+        # compounds come first in the topology, so compound index == row 
+        self.model.add_constraints(
+            rows=np.concatenate([cpd_inds, nodes[is_cpd_edge]]), 
+            cols=np.concatenate([cpd_inds, par_inds[is_cpd_edge]]), 
+            vals=np.concatenate([np.ones(len(cpd_inds)), -np.ones(is_cpd_edge.sum())]), 
+            lb=-np.inf, ub=0,
+        )
         
         return 
 
     def set_cycle_constraints(self): 
+        """ Forbids selecting every reaction of any cycle, using the formulation set by cycle_method """
+        self.lazy_cycles = False 
+        if self.cycle_method == 'simple': 
+            self.set_simple_cycle_constraints()
+        elif self.cycle_method == 'lazy': 
+            # cycle constraints are added in optimize for cycles of the selected routes 
+            self.lazy_cycles = True 
+        elif self.cycle_method == 'ordering': 
+            self.set_ordering_cycle_constraints()
+        else: 
+            raise NotImplementedError(f'Cycle method {self.cycle_method} not implemented')
+        
+        return 
 
-        cycles = self.graph.dfs_find_cycles_nx()
-        for cyc in tqdm(cycles, desc='Cycle constraints'): 
-            self.problem += (
-                lpSum(self.r[rid] for rid in cyc) <= (len(cyc) - 1)
-            )
+    def set_simple_cycle_constraints(self): 
+        """ Adds one constraint per simple cycle. The number of simple cycles can grow 
+        exponentially with the size of the cyclic components. """
+        self.add_cycle_constraints(self.graph.dfs_find_cycles_nx())
+        return 
 
+    def add_cycle_constraints(self, cycles: List[List[str]]): 
+        """ For every cycle (list of reaction IDs), forbids selecting all of its reactions """
+        if len(cycles) == 0: 
+            return 
+        
+        rows = np.repeat(np.arange(len(cycles)), [len(cyc) for cyc in cycles])
+        cols = [self.topology.index_from_id(rid) for cyc in tqdm(cycles, desc='Cycle constraints') for rid in cyc]
+        self.model.add_constraints(
+            rows=rows, cols=cols, vals=1, 
+            lb=-np.inf, ub=np.array([len(cyc) - 1 for cyc in cycles]),
+        )
+
+        return 
+
+    def set_ordering_cycle_constraints(self): 
+        """ 
+        Adds a continuous order variable o_v for every node v in a cyclic strongly connected 
+        component of size n and, for every edge u->v inside that component that belongs to 
+        reaction r, the constraint o_v >= o_u + 1 - n*(1 - r). The selected reactions then 
+        admit a topological order, i.e. no cycle has all of its reactions selected. This 
+        needs one constraint per edge in cyclic components instead of one per simple cycle. 
+        """
+        topology = self.topology
+        components = self.graph.cyclic_components()
+        print(f'Setting ordering constraints for {len(components)} cyclic components ({sum(len(c) for c in components)} nodes)')
+        if len(components) == 0: 
+            return 
+        
+        comp_inds = np.concatenate(components)
+        comp_sizes = np.repeat([len(comp) for comp in components], [len(comp) for comp in components])
+        order_cols = self.model.add_variables(
+            'order', 
+            [f'order_{topology.ids[ind]}' for ind in comp_inds], 
+            lb=0, ub=comp_sizes - 1, integer=False,
+        )
+        
+        comp_of = np.full(topology.n_nodes, -1)
+        order_col = np.full(topology.n_nodes, -1)
+        for c, comp in enumerate(components): 
+            comp_of[comp] = c 
+        order_col[comp_inds] = order_cols
+        
+        # edges u->v (u is a parent of v) inside one component
+        nodes, children = topology.child_edges()
+        in_comp = (comp_of[nodes] >= 0) & (comp_of[nodes] == comp_of[children])
+        nodes, children = nodes[in_comp], children[in_comp]
+        rxn_inds = np.where(topology.is_rxn[nodes], nodes, children)
+        n = np.array([len(comp) for comp in components])[comp_of[nodes]]
+
+        # o_v - o_u - n*r >= 1 - n 
+        rows = np.arange(len(nodes))
+        self.model.add_constraints(
+            rows=np.concatenate([rows, rows, rows]), 
+            cols=np.concatenate([order_col[children], order_col[nodes], rxn_inds]), 
+            vals=np.concatenate([np.ones(len(rows)), -np.ones(len(rows)), -n]), 
+            lb=1 - n, ub=np.inf,
+        )
+        
         return 
     
     def get_child_and_parent_ids(self, smi: str = None, id: str = None): 
@@ -250,26 +440,144 @@ class RouteSelector:
                 score = 10**6,
             )
     
-    def set_objective(self): 
+    def objective_terms(self) -> Dict[str, tuple]: 
+        """ 
+        Returns the unweighted objective terms as (columns, coefficients): 'reward' (summed 
+        reward of selected targets), 'cost' (summed cost of selected starting materials) and 
+        'penalty' (summed penalty of selected reactions) 
+        """
+        topology = self.topology
+        dummies = self.graph.dummy_nodes_only()
+        non_dummies = self.graph.non_dummy_nodes()
+        return {
+            'reward': (
+                np.array([topology.index_from_id(target) for target in self.targets], dtype=np.int64), 
+                np.array([float(self.target_dict[target]) for target in self.targets]), 
+            ),
+            'cost': (
+                np.array([topology.index(dummy.smiles) for dummy in dummies], dtype=np.int64), 
+                np.array([self.cost_of_dummy(dummy) for dummy in dummies], dtype=float), 
+            ),
+            'penalty': (
+                np.array([topology.index(node.smiles) for node in non_dummies], dtype=np.int64), 
+                np.array([float(node.penalty) for node in non_dummies]), 
+            ),
+        }
+
+    def objective_values(self, x: np.ndarray = None) -> Dict[str, float]: 
+        """ Returns the value of every objective term for solution x (default: the last solution) """
+        x = self.solution if x is None else x 
+        return {name: float(vals @ x[cols]) for name, (cols, vals) in self.objective_terms().items()}
+
+    def set_objective(self, weights: List = None): 
+        """ Sets the objective for weights (default: self.weights), replacing any previous objective """
         # TODO: Add consideration of conditions 
         print('Setting objective function ...')
+        self.model.reset_objective()
+        weights = self.weights if weights is None else weights 
 
-        reward_mult = self.weights[0] # / ( len(self.target_dict)) # *max(self.target_dict.values()) )
-        cost_mult = self.weights[1] # / (len(self.graph.dummy_nodes_only())) # * max([node.cost_per_g for node in self.graph.buyable_nodes()]) ) 
-        pen_mult = self.weights[2] # / (len(self.graph.non_dummy_nodes())) # * max([node.penalty for node in self.graph.non_dummy_nodes()]) )
+        reward_mult = weights[0] # / ( len(self.target_dict)) # *max(self.target_dict.values()) )
+        cost_mult = weights[1] # / (len(self.graph.dummy_nodes_only())) # * max([node.cost_per_g for node in self.graph.buyable_nodes()]) ) 
+        pen_mult = weights[2] # / (len(self.graph.non_dummy_nodes())) # * max([node.penalty for node in self.graph.non_dummy_nodes()]) )
 
-        self.problem += -1*reward_mult*lpSum([float(self.target_dict[target])*self.m[target] for target in self.targets]) \
-        + cost_mult*lpSum([self.cost_of_dummy(dummy)*self.r[dummy.id] for dummy in self.graph.dummy_nodes_only()]) \
-        + pen_mult*lpSum([self.r[node.id]*float(node.penalty) for node in self.graph.non_dummy_nodes()])
+        terms = self.objective_terms()
+        self.model.add_objective(terms['reward'][0], -1*reward_mult*terms['reward'][1])
+        self.model.add_objective(terms['cost'][0], cost_mult*terms['cost'][1])
+        self.model.add_objective(terms['penalty'][0], pen_mult*terms['penalty'][1])
             # reaction penalties, implement CSR later 
         
-        if self.weights[3]>0: 
-            self.add_diversity_objective()
+        if weights[3]>0: 
+            self.add_diversity_objective(weights[3])
+
+        return 
 
+    def set_epsilon_constraint(self, objective: str, epsilon: float): 
+        """ Constrains objective term ('cost' or 'penalty') to at most epsilon. The constraint 
+        is added once, later calls only change its bound. """
+        if not hasattr(self, 'eps_rows'): 
+            self.eps_rows = {}
+        
+        if objective not in self.eps_rows: 
+            cols, vals = self.objective_terms()[objective]
+            self.eps_rows[objective] = self.model.add_constraints(
+                rows=np.zeros(len(cols)), cols=cols, vals=vals, lb=-np.inf, ub=epsilon, 
+            )
+        else: 
+            self.model.set_row_bounds(self.eps_rows[objective], lb=-np.inf, ub=epsilon)
+        
         return 
 
-    def add_diversity_objective(self): 
-        """ Adds scalarization objective to increase the number of clusters represented, requires defining new variable """
+    def pareto_front(self, objective: str = 'cost', n_points: int = 10, tie_break: float = 1e-3, **solve_kwargs) -> List[Dict]: 
+        """ 
+        Enumerates the trade-off between reward and objective ('cost' or 'penalty') with the 
+        epsilon-constraint method. The first point maximizes reward without a bound on objective, 
+        the remaining points bound objective by n_points - 1 evenly spaced values from that 
+        solution's value down to 0. If the previous solution already satisfies a bound, it is 
+        still optimal and the solve is skipped. Otherwise the solve is warm-started from the 
+        previous solution. The other weighted terms stay in the objective with their weights, and 
+        objective itself gets a small weight (selecting the node with its largest coefficient costs 
+        tie_break times the smallest target reward) so that ties are broken in its favor. 
+        solve_kwargs are passed to optimize. The other terms can still trade objective for 
+        themselves, so points that another point dominates (at least as much reward for at most as 
+        much objective) are removed. Returns one dictionary per remaining point with the epsilon, 
+        the objective term values, whether it was solved, and the solution. 
+        """
+        ind = {'cost': 1, 'penalty': 2}[objective]
+        cols, vals = self.objective_terms()[objective]
+        rewards = [float(reward) for reward in self.target_dict.values() if float(reward) > 0]
+        max_value = max(vals.max(initial=0), 1e-9)
+        weights = list(self.weights)
+        weights[ind] = tie_break*self.weights[0]*min(rewards, default=1)/max_value
+        self.set_objective(weights=weights)
+
+        if hasattr(self, 'eps_rows') and objective in self.eps_rows: 
+            self.set_epsilon_constraint(objective, np.inf)
+        
+        points = []
+        warm_start = solve_kwargs.pop('warm_start', None)
+        epsilons = [np.inf]
+        for epsilon in epsilons: 
+            if points and self.objective_values(points[-1]['solution'])[objective] <= epsilon + 1e-9: 
+                print(f'Skipping {objective} <= {epsilon:0.4g}, previous solution is still optimal')
+                points.append({**points[-1], 'epsilon': epsilon, 'solved': False})
+                continue 
+
+            print(f'Pareto point with {objective} <= {epsilon:0.4g}')
+            self.set_epsilon_constraint(objective, epsilon)
+            self.optimize(warm_start=warm_start, **solve_kwargs)
+            warm_start = self.solution 
+            points.append({
+                'epsilon': epsilon, 
+                **self.objective_values(), 
+                'solved': True, 
+                'status': self.solver_info['status'], 
+                'solution': self.solution, 
+            })
+
+            if len(points) == 1: 
+                epsilons.extend(np.linspace(points[0][objective], 0, n_points)[1:])
+        
+        front = [point for point in points if not any(dominates(other, point, objective) for other in points)]
+        if len(front) < len(points): 
+            print(f'Removed {len(points) - len(front)} dominated points from the Pareto front')
+        
+        return front 
+
+    def add_diversity_objective(self, weight: float = None): 
+        """ Adds scalarization objective to increase the number of clusters represented, requires defining new variable 
+        (clusters, their variables and constraints are only added the first time) """
+        if 'cluster' not in self.model.blocks: 
+            self.add_cluster_variables()
+        
+        # add objective 
+        weight = self.weights[3] if weight is None else weight 
+        print(f'adding objective with {weight}')
+        d_cols = self.model.blocks['cluster']
+        self.model.add_objective(d_cols, -weight*np.ones(len(d_cols)))
+
+        return 
+
+    def add_cluster_variables(self): 
         print('Clustering molecules for diversity objective')
         cs_ind = cluster_smiles([self.graph.smiles_from_id(id) for id in self.targets], cutoff=self.cluster_cutoff)
         cs = [[self.targets[ind] for ind in cluster] for cluster in cs_ind]
@@ -281,21 +589,16 @@ class RouteSelector:
             json.dump(cs, f, indent='\t')
 
         # d_i : whether cluster i is represented by the selected set 
-        self.d = LpVariable.dicts(
-            "cluster", 
-            indices=range(len(cs)), 
-            cat="Binary",
-        )
+        d_cols = self.model.add_variables('cluster', [f'cluster_{i}' for i in range(len(cs))])
 
         # constraint: d_i <= sum(c_j) for j in cluster i
-        for i, ids_in_cluster in enumerate(cs): 
-            self.problem += (
-                self.d[i] <= lpSum(self.m[cpd_id] for cpd_id in ids_in_cluster)
-            )
-        
-        # add objective 
-        print(f'adding objective with {self.weights[3]}')
-        self.problem += self.problem.objective - self.weights[3]*lpSum(self.d)
+        rows = np.repeat(np.arange(len(cs)), [len(cluster) for cluster in cs])
+        self.model.add_constraints(
+            rows=np.concatenate([np.arange(len(cs)), rows]), 
+            cols=np.concatenate([d_cols, [self.topology.index_from_id(cpd_id) for cluster in cs for cpd_id in cluster]]), 
+            vals=np.concatenate([np.ones(len(cs)), -np.ones(len(rows))]), 
+            lb=-np.inf, ub=0, 
+        )
 
         return 
 
@@ -305,29 +608,389 @@ class RouteSelector:
             dummy_node = self.graph.node_from_id(dummy_id)
 
         start_node = list(dummy_node.children.values())[0]
-        return start_node.cost_per_g 
+        return start_node.cost_per_g
 
-    def optimize(self, solver=None):
+    def bonus_links(self):
+        """ 
+        Returns the columns of variables other than nodes with a negative objective coefficient (e.g. 
+        clusters), and a sparse matrix with entry [node, k] = 1 if node shares a constraint with the 
+        k-th of them, i.e. the bonus of the variable can depend on whether node is selected 
+        """
+        n = self.topology.n_nodes
+        extra = np.flatnonzero(self.model.c[n:] < 0) + n
+        A = (abs(self.model.matrix()) > 0).astype(float)
+        links = csr_matrix((A[:, :n].T @ A[:, extra]) > 0, dtype=float)
+        return extra, links
 
+    def presolve(self) -> Dict[str, int]:
+        """
+        Fixes reactions and starting materials (dummy reactions) to zero if they cannot be part of
+        an optimal solution for the current objective. Deselecting a node and everything downstream
+        of it keeps a solution feasible (every constraint only requires parents or targets to be
+        selected, or bounds a sum of nonnegative terms). It saves at least the node's weighted cost
+        or penalty and loses at most the weighted rewards (and diversity bonuses) of the targets
+        downstream of it, so a node whose cost exceeds that reachable reward is zero in every optimal
+        solution. Compounds whose reactions are all fixed and reactions with a fixed reactant are
+        fixed as well, and the bounds are recomputed until nothing changes. Fixes from a previous
+        call are undone first, because they depend on the weights. Returns the number of fixed
+        reactions, starting materials and compounds.
+        """
+        topology = self.topology
+        n = topology.n_nodes
+        if self.presolve_fixed is not None:
+            self.model.set_bounds(self.presolve_fixed, lb=0, ub=1)
+
+        c = self.model.c
+        gain = np.maximum(-c[:n], 0)
+        extra, links = self.bonus_links()
+        gain += links @ -c[extra]
+
+        adjacency = topology.adjacency_matrix()
+        is_dummy = topology.is_rxn & (topology.n_parents() == 0)
+        fixed = np.zeros(n, dtype=bool)
+        while True:
+            # reward that can be lost by deselecting each node: gains of targets downstream of it
+            keep = (~fixed).astype(float)
+            sub = csr_matrix(adjacency.multiply(keep[:, None]).multiply(keep[None, :]))
+            reachable = np.zeros(n)
+            for ind in np.flatnonzero((gain > 0) & ~fixed):
+                reachable[breadth_first_order(sub, ind, directed=True, return_predecessors=False)] += gain[ind]
+
+            new = ~fixed & topology.is_rxn & (c[:n] > reachable + 1e-9)
+            if not new.any():
+                break
+
+            # propagate through the constraints
+            fixed |= new
+            queue = list(np.flatnonzero(new))
+            while queue:
+                ind = queue.pop()
+                for child in topology.children(ind):
+                    if fixed[child]:
+                        continue
+                    if topology.is_rxn[child] or fixed[topology.parents(child)].all():
+                        fixed[child] = True
+                        queue.append(child)
+
+        self.presolve_fixed = np.flatnonzero(fixed)
+        self.model.set_bounds(self.presolve_fixed, lb=0, ub=0)
+        counts = {
+            'reactions': int((fixed & topology.is_rxn & ~is_dummy).sum()),
+            'starting materials': int((fixed & is_dummy).sum()),
+            'compounds': int((fixed & ~topology.is_rxn).sum()),
+        }
+        print(
+            f"Presolve fixed {counts['reactions']} of {int((topology.is_rxn & ~is_dummy).sum())} reactions, "
+            f"{counts['starting materials']} of {int(is_dummy.sum())} starting materials and "
+            f"{counts['compounds']} of {topology.n_compounds} compounds to zero"
+        )
+
+        return counts
+
+    def apply_presolve(self, presolve: bool = True): 
+        """ Runs presolve if presolve is True, and otherwise undoes the fixes of an earlier presolve """
+        if presolve: 
+            with self.profiler.stage('presolve'): 
+                return self.presolve()
+        
+        if self.presolve_fixed is not None: 
+            self.model.set_bounds(self.presolve_fixed, lb=0, ub=1)
+            self.presolve_fixed = None 
+        
+        return None 
+
+    def optimize(self, 
+                 solver: str = None, 
+                 threads: int = None, 
+                 time_limit: float = None, 
+                 gap_rel: float = 1e-7, 
+                 gap_abs: float = None, 
+                 warm_start: np.ndarray = None,
+                 decompose: bool = False, 
+                 n_jobs: int = 1, 
+                 presolve: bool = False, 
+                 ):
+        """ 
+        Solves the problem with CBC (solver=None), Gurobi (solver='GUROBI') or HiGHS (solver='HIGHS'). 
+        warm_start is a solution used as a MIP start, e.g. the solution for other weights. Variables 
+        added after it was found (e.g. clusters) start at zero. 
+
+        With decompose=True and no diversity objective, the problem is split into independent 
+        subproblems (targets that share no compounds or reactions, through any chain of constraints), 
+        which are solved in n_jobs processes. The diversity objective couples all targets, so with 
+        weights[3] > 0 the problem is solved as a whole. 
+
+        With cycle_method='lazy', the problem is solved without cycle constraints, and constraints 
+        for the cycles among the selected nodes are added and the problem re-solved (warm-started 
+        from the previous solution) until the selection is acyclic. The number of rounds and cycle 
+        constraints are stored in solver_info. 
+
+        With presolve=True, reactions and starting materials that cannot be part of an optimal 
+        solution are fixed to zero first (see presolve), and the counts are stored in solver_info. 
+        """
         # self.problem.writeLP("RouteSelector.lp", max_length=300)
         print("Solving optimization problem...")
         opt_start = time.time()
-        if solver == 'GUROBI': 
-            self.problem.solve(GUROBI(timeLimit=86400))
-        else: 
-            self.problem.solve(PULP_CBC_CMD(gapRel=1e-7, gapAbs=1e-9, msg=False))
+        solver_kwargs = {'solver': solver, 'threads': threads, 'time_limit': time_limit, 'gap_rel': gap_rel, 'gap_abs': gap_abs}
+        if decompose and self.weights[3] == 0: 
+            solver_kwargs.update({'decompose': True, 'n_jobs': n_jobs})
+        elif decompose: 
+            print('The diversity objective couples all targets, solving the problem as a whole')
+
+        presolve_counts = self.apply_presolve(presolve)
+        if presolve and warm_start is not None: 
+            warm_start = np.array(warm_start, dtype=float)
+            warm_start[self.presolve_fixed[self.presolve_fixed < len(warm_start)]] = 0
+
+        solve_start = time.time()
+        with self.profiler.stage('solve'): 
+            self.solve(warm_start=warm_start, **solver_kwargs)
+
+        if self.lazy_cycles: 
+            rounds, n_cuts = 0, 0
+            while True: 
+                with self.profiler.stage('cycle detection'): 
+                    selected = np.flatnonzero(self.solution[:self.topology.n_nodes] > 0.5)
+                    cycles = self.graph.dfs_find_cycles_nx(nodes=selected)
+                if len(cycles) == 0: 
+                    break 
+                
+                rounds += 1
+                n_cuts += len(cycles)
+                print(f'Round {rounds}: the selection contains {len(cycles)} cycles, adding cycle constraints and re-solving')
+                with self.profiler.stage('cycle detection'): 
+                    self.add_cycle_constraints(cycles)
+                with self.profiler.stage('solve'): 
+                    self.solve(warm_start=self.solution, **solver_kwargs)
+
+            print(f'Selection is acyclic after {rounds} rounds ({n_cuts} cycle constraints added)')
+            self.solver_info.update({'cycle_rounds': rounds, 'cycle_constraints': n_cuts})
+
+        if presolve_counts is not None: 
+            self.solver_info['presolve'] = presolve_counts
+
+        self.profiler.record_solve(self.model, self.solver_info, time.time() - solve_start)
+        print(f"Optimization problem completed ({self.solver_info['status']}). Took {time.time()-opt_start:0.2f} seconds to solve")
+        
+        return 
 
-        print(f"Optimization problem completed. Took {time.time()-opt_start:0.2f} seconds to solve")
+    def solve(self, solver: str = None, warm_start: np.ndarray = None, decompose: bool = False, n_jobs: int = 1, **kwargs): 
+        """ Solves the current model once, see optimize for the arguments """
+        if warm_start is not None and len(warm_start) < self.model.n_cols: 
+            warm_start = np.concatenate([warm_start, np.zeros(self.model.n_cols - len(warm_start))])
+        
+        if decompose: 
+            self.solution, self.solver_info = solve_decomposed(self.model, solver=solver, n_jobs=n_jobs, warm_start=warm_start, **kwargs)
+            self.problem = None 
+        elif solver == 'HIGHS': 
+            self.solution, self.solver_info = solve_highs(self.model, warm_start=warm_start, **kwargs)
+        else: 
+            self.solution, self.solver_info, self.problem = solve_pulp(self.model, solver=solver, warm_start=warm_start, **kwargs)
         
         return 
     
+    def optimize_heuristic(self, solver: str = None, threads: int = None, time_limit: float = None, presolve: bool = False, **kwargs):
+        """
+        Finds a good selection quickly, without proving that it is optimal. The LP relaxation of the
+        problem is solved, and its solution is rounded and repaired into a feasible selection (see
+        round_and_repair). The LP objective is a lower bound on the optimum, so the relative
+        difference to it (gap in solver_info) bounds how far from optimal the selection can be. The
+        solution can be used as warm_start for optimize. Other keyword arguments of optimize are ignored.
+        """
+        presolve_counts = self.apply_presolve(presolve)
+        print('Solving LP relaxation for heuristic selection ...')
+        start = time.time()
+        with self.profiler.stage('solve'):
+            x_lp, lp_info = solve_model(self.model.relaxation(), solver=solver, threads=threads, time_limit=time_limit)
+
+        bound = lp_info['objective'] if lp_info['status'] == 'Optimal' else None
+        with self.profiler.stage('rounding'):
+            self.solution = self.round_and_repair(x_lp, solver=solver)
+
+        objective = self.model.objective_value(self.solution)
+        feasible = self.model.is_feasible(self.solution)
+        self.solver_info = {
+            'solver': f'heuristic ({lp_info["solver"]})',
+            'status': 'Feasible' if feasible else 'Infeasible',
+            'objective': objective,
+            'bound': bound,
+            'gap': abs(objective - bound) / max(abs(objective), abs(bound), 1e-10) if bound is not None else None,
+        }
+        if presolve_counts is not None:
+            self.solver_info['presolve'] = presolve_counts
+        if not feasible:
+            warnings.warn('The heuristic selection violates a constraint of the problem')
+
+        gap = f"{self.solver_info['gap']:0.2%}" if bound is not None else f'unknown, LP status {lp_info["status"]}'
+        print(f'Heuristic selection completed (objective {objective:0.4g}, LP bound {bound}, gap {gap}). Took {time.time()-start:0.2f} seconds')
+        self.profiler.record_solve(self.model, self.solver_info, time.time() - start)
+
+        return
+
+    def route_cost_estimates(self) -> np.ndarray:
+        """
+        Estimates for every node the objective cost (weighted costs and penalties of reactions, ignoring
+        rewards) of the cheapest route that makes it: the cost of a reaction is its own cost plus that
+        of its reactants, the cost of a compound is that of its cheapest producing reaction. Shared
+        intermediates are counted once per use, and nodes without any route have infinite cost.
+        """
+        topology = self.topology
+        n = topology.n_nodes
+        c, ub = self.model.c[:n], self.model.ub[:n]
+        nodes, parents = topology.parent_edges()
+        is_rxn_edge = topology.is_rxn[nodes]
+        open_rxns = topology.is_rxn & (ub > 0.5)
+
+        cost = np.full(n, np.inf)
+        for _ in range(n):
+            rxn_cost = np.where(open_rxns, np.maximum(c, 0), np.inf)
+            np.add.at(rxn_cost, nodes[is_rxn_edge], cost[parents[is_rxn_edge]])
+            cpd_cost = np.full(n, np.inf)
+            np.minimum.at(cpd_cost, nodes[~is_rxn_edge], rxn_cost[parents[~is_rxn_edge]])
+            new_cost = np.where(topology.is_rxn, rxn_cost, np.where(ub > 0.5, cpd_cost, np.inf))
+            if np.array_equal(new_cost, cost):
+                break
+            cost = new_cost
+
+        return cost
+
+    def round_and_repair(self, x_lp: np.ndarray, solver: str = None) -> np.ndarray:
+        """
+        Builds a feasible selection from a fractional solution x_lp. Targets are considered in order
+        of decreasing x_lp. For each, a route is built backwards from the target, preferring the
+        producing reactions with the highest x_lp (then the lowest cost) and reusing the compounds
+        that are already selected, so that every selected compound has a selected producing reaction
+        and every selected reaction has its reactants. Routes that would close a cycle are skipped. The
+        target is kept if its route (only the newly selected nodes, plus bonuses like newly represented
+        clusters) improves the objective and closes no cycle with the selected nodes (only possible
+        through reactions with several products). Compounds without a route are not searched again,
+        unless the search was cut short by cycle avoidance, which depends on the path to the compound. Variables other than nodes (e.g. clusters, order variables)
+        are then set by solving the problem with all node variables fixed.
+        """
+        topology = self.topology
+        n = topology.n_nodes
+        c, ub = self.model.c, self.model.ub
+        extra, links = self.bonus_links()
+        covered = np.zeros(len(extra), dtype=bool)
+        selected = np.zeros(n, dtype=bool)
+        failed = set()
+        n_blocked = 0
+        route_cost = self.route_cost_estimates()
+
+        def add_route(cpd, on_path, new):
+            nonlocal n_blocked
+            if selected[cpd]:
+                return True
+            if ub[cpd] < 0.5 or cpd in failed:
+                return False
+
+            on_path.add(cpd)
+            blocked_before = n_blocked
+            rxns = sorted([r for r in topology.parents(cpd) if ub[r] > 0.5], key=lambda r: (-round(x_lp[r]), route_cost[r], -x_lp[r]))
+            for rxn in rxns:
+                reactants = topology.parents(rxn)
+                if any(par in on_path for par in reactants):
+                    n_blocked += 1
+                    continue
+                mark = len(new)
+                if all(add_route(par, on_path, new) for par in reactants):
+                    selected[[rxn, cpd]] = True
+                    new.extend([rxn, cpd])
+                    on_path.remove(cpd)
+                    return True
+
+                selected[new[mark:]] = False
+                del new[mark:]
+
+            on_path.remove(cpd)
+            if n_blocked == blocked_before:
+                failed.add(cpd)
+            return False
+
+        def closes_cycle(new):
+            # the selection was acyclic before, so a new cycle passes through a new node and only
+            # contains nodes reachable from the new nodes
+            reached, stack = set(new), list(new)
+            while stack:
+                for child in topology.children(stack.pop()):
+                    if selected[child] and child not in reached:
+                        reached.add(child)
+                        stack.append(child)
+            return len(self.graph.cyclic_components(np.array(sorted(reached)))) > 0
+
+        target_inds = [topology.index_from_id(target) for target in self.targets]
+        candidates = sorted([ind for ind in target_inds if x_lp[ind] > 1e-6], key=lambda ind: -x_lp[ind])
+        while True:
+            # rejected targets are retried, as routes selected later may be shared with them
+            n_selected = selected.sum()
+            for ind in candidates:
+                if selected[ind]:
+                    continue
+
+                new = []
+                if not add_route(ind, set(), new):
+                    continue
+
+                bonus = links[new].sum(axis=0).A1 > 0
+                delta = c[new].sum() + c[extra][bonus & ~covered].sum()
+                if delta < -1e-9 and not closes_cycle(new):
+                    covered |= bonus
+                else:
+                    selected[new] = False
+
+            if selected.sum() == n_selected:
+                break
+
+        x = np.zeros(self.model.n_cols)
+        x[:n] = selected
+        if self.model.n_cols > n:
+            model = self.model.copy()
+            model.set_bounds(np.arange(n), lb=x[:n], ub=x[:n])
+            x, _ = solve_model(model, solver=solver)
+
+        return x
+
+    def set_solution(self, x: np.ndarray, status: str = 'Imported'): 
+        """ Uses a solution found elsewhere (e.g. by an external solver) as the solution of the problem """
+        self.solution = np.asarray(x, dtype=float)
+        self.solver_info = {'solver': 'external', 'status': status, 'objective': self.model.objective_value(self.solution)}
+        return 
+
+    def solution_from_selection(self, rxn_smiles: List[str]) -> np.ndarray: 
+        """ 
+        Builds a solution (e.g. for warm_start) that selects the reactions in rxn_smiles, the 
+        compounds they produce and the clusters of selected targets. Reactions that are not in 
+        the graph are ignored. 
+        """
+        topology = self.topology
+        x = np.zeros(self.model.n_cols)
+        rxn_inds = [topology.index(smi) for smi in rxn_smiles if smi in self.graph.reaction_nodes]
+        x[rxn_inds] = 1
+        for ind in rxn_inds: 
+            x[topology.children(ind)] = 1
+        
+        if 'cluster' in self.model.blocks: 
+            with open(self.dir / 'clusters.json', 'r') as f: 
+                clusters = json.load(f)
+            for col, cluster in zip(self.model.blocks['cluster'], clusters): 
+                x[col] = max(x[topology.index_from_id(cpd_id)] for cpd_id in cluster)
+        
+        return x 
+
+    def objective_value(self) -> float: 
+        return self.model.objective_value(self.solution)
+
+    def selected_ids(self): 
+        """ Returns the IDs of the selected reactions and compounds, decoded from the solution by index """
+        topology = self.topology
+        rxn_ids = [topology.ids[ind] for ind in topology.reaction_indices()[self.model.decode(self.solution, 'rxn')]]
+        mol_ids = [topology.ids[ind] for ind in topology.compound_indices()[self.model.decode(self.solution, 'mol')]]
+        return rxn_ids, mol_ids
+
     def optimal_variables(self):
-        """ Returns nonzero variables """
+        """ Returns nonzero variables (requires solving with a PuLP solver) """
         nonzero_vars = [
             var for var in self.problem.variables() if var.varValue > 0.01
         ]
 
         return nonzero_vars
-
-     
-    
\ No newline at end of file
@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 from typing import Union, List
 from pathlib import Path 
 from rdkit import Chem
+import requests
 
 from sparrow.utils.api_utils import post_and_get
 
@@ -83,10 +84,11 @@ class AskcosAPIScorer(Scorer):
                 sleep_time=0.1,
                 timeout=60,
             )
-        except ConnectionError:
+        except (ConnectionError, requests.RequestException):
             print ("Connection Error from " + self.host)
+            result = {}
         
-        if result['complete'] == True: 
+        if result.get('complete', False) == True: 
             outcomes = {
                 prod['smiles']: prod['prob']
                 for prod in result['output']
@@ -0,0 +1,262 @@
+""" Solves a ModelBuilder model with PuLP (CBC, Gurobi) or HiGHS """
+from typing import Dict, Tuple
+from pulp import GUROBI, LpStatus
+from pulp.apis import PULP_CBC_CMD
+from joblib import Parallel, delayed
+import numpy as np
+import warnings
+import tempfile
+import os
+import re
+
+from sparrow.model_builder import ModelBuilder
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+
+def solve_pulp(model: ModelBuilder,
+               solver: str = None,
+               threads: int = None,
+               time_limit: float = None,
+               gap_rel: float = 1e-7,
+               gap_abs: float = None,
+               warm_start: np.ndarray = None,
+               ) -> Tuple[np.ndarray, Dict, object]:
+    """ Solves model with CBC (solver=None) or Gurobi (solver='GUROBI') through PuLP. Returns the
+    solution, a dictionary with solver information and the LpProblem """
+    problem, variables = model.to_pulp()
+    if warm_start is not None:
+        for var, value in zip(variables, warm_start):
+            var.setInitialValue(value)
+
+    if solver == 'GUROBI':
+        solver_params = {}
+        if threads is not None:
+            solver_params['Threads'] = threads
+        if gap_abs is not None:
+            solver_params['MIPGapAbs'] = gap_abs
+        cmd = GUROBI(
+            timeLimit=time_limit if time_limit is not None else 86400,
+            gapRel=gap_rel,
+            warmStart=warm_start is not None,
+            **solver_params,
+        )
+    else:
+        log_fd, log_path = tempfile.mkstemp(suffix='.log')
+        os.close(log_fd)
+        cmd = PULP_CBC_CMD(
+            gapRel=gap_rel,
+            gapAbs=gap_abs if gap_abs is not None else 1e-9,
+            timeLimit=time_limit,
+            threads=threads,
+            warmStart=warm_start is not None,
+            msg=False,
+            logPath=log_path,
+        )
+
+    problem.solve(cmd)
+    x = np.array([var.varValue or 0 for var in variables])
+    info = {
+        'solver': 'gurobi' if solver == 'GUROBI' else 'cbc',
+        'status': LpStatus[problem.status],
+        'objective': model.objective_value(x),
+    }
+    if solver == 'GUROBI':
+        info.update(_gurobi_stats(problem))
+    else:
+        info.update(_cbc_stats(log_path))
+        os.remove(log_path)
+
+    return x, info, problem
+
+
+def _gurobi_stats(problem) -> Dict:
+    """ Reads the final gap and node count from the gurobipy model PuLP keeps after solving """
+    try:
+        return {'gap': problem.solverModel.MIPGap, 'node_count': int(problem.solverModel.NodeCount)}
+    except Exception:
+        return {'gap': None, 'node_count': None}
+
+
+def _cbc_stats(log_path: str) -> Dict:
+    """ Reads the final gap and node count from the summary at the end of a CBC log """
+    stats = {'gap': None, 'node_count': None}
+    try:
+        with open(log_path, 'r') as f:
+            log = f.read()
+    except OSError:
+        return stats
+
+    nodes = re.search(r'Enumerated nodes:\s+(\d+)', log)
+    if nodes:
+        stats['node_count'] = int(nodes.group(1))
+    gap = re.search(r'Gap:\s+([-\d.eE+]+)', log)
+    if gap:
+        stats['gap'] = float(gap.group(1))
+    elif 'Result - Optimal solution found' in log:
+        # CBC only prints the gap if it stopped before proving optimality
+        stats['gap'] = 0.0
+
+    return stats
+
+
+def solve_highs(model: ModelBuilder,
+                threads: int = None,
+                time_limit: float = None,
+                gap_rel: float = 1e-7,
+                gap_abs: float = None,
+                warm_start: np.ndarray = None,
+                ) -> Tuple[np.ndarray, Dict]:
+    """ Solves model with HiGHS, through highspy if it is installed and scipy.optimize.milp otherwise.
+    Returns the solution (zeros if no feasible solution was found) and a dictionary with solver information """
+    if highspy is not None:
+        return _solve_highspy(model, threads, time_limit, gap_rel, gap_abs, warm_start)
+
+    unsupported = [
+        name for name, value in [('threads', threads), ('absolute gap', gap_abs), ('warm start', warm_start)]
+        if value is not None
+    ]
+    if unsupported:
+        warnings.warn(f'highspy is not installed, so HiGHS is run through scipy, which does not support: {", ".join(unsupported)}')
+
+    return _solve_scipy(model, time_limit, gap_rel)
+
+
+def _solve_highspy(model, threads, time_limit, gap_rel, gap_abs, warm_start):
+    arrays = model.arrays()
+    A = arrays['A']
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = model.n_cols
+    lp.num_row_ = model.n_rows
+    lp.col_cost_ = arrays['c']
+    lp.col_lower_ = arrays['lb']
+    lp.col_upper_ = arrays['ub']
+    lp.row_lower_ = arrays['row_lb']
+    lp.row_upper_ = arrays['row_ub']
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    lp.a_matrix_.start_ = A.indptr
+    lp.a_matrix_.index_ = A.indices
+    lp.a_matrix_.value_ = A.data
+    lp.integrality_ = [
+        highspy.HighsVarType.kInteger if integer else highspy.HighsVarType.kContinuous
+        for integer in arrays['integrality']
+    ]
+
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    if threads is not None:
+        h.setOptionValue('threads', threads)
+    if time_limit is not None:
+        h.setOptionValue('time_limit', float(time_limit))
+    if gap_rel is not None:
+        h.setOptionValue('mip_rel_gap', gap_rel)
+    if gap_abs is not None:
+        h.setOptionValue('mip_abs_gap', gap_abs)
+    h.passModel(lp)
+
+    if warm_start is not None:
+        start = highspy.HighsSolution()
+        start.col_value = list(warm_start)
+        h.setSolution(start)
+
+    h.run()
+    info = h.getInfo()
+    status = h.modelStatusToString(h.getModelStatus())
+    if info.primal_solution_status > 0:
+        x = np.array(h.getSolution().col_value)
+    else:
+        x = np.zeros(model.n_cols)
+
+    return x, {
+        'solver': 'highs',
+        'status': status,
+        'objective': model.objective_value(x),
+        'gap': info.mip_gap,
+        'node_count': info.mip_node_count,
+    }
+
+
+def _solve_scipy(model, time_limit, gap_rel):
+    from scipy.optimize import milp, Bounds, LinearConstraint
+
+    arrays = model.arrays()
+    options = {'disp': False}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    if gap_rel is not None:
+        options['mip_rel_gap'] = gap_rel
+
+    constraints = LinearConstraint(arrays['A'], arrays['row_lb'], arrays['row_ub']) if model.n_rows > 0 else None
+    res = milp(
+        arrays['c'],
+        integrality=arrays['integrality'].astype(int),
+        bounds=Bounds(arrays['lb'], arrays['ub']),
+        constraints=constraints,
+        options=options,
+    )
+    x = res.x if res.x is not None else np.zeros(model.n_cols)
+    status = {0: 'Optimal', 1: 'Time or iteration limit reached', 2: 'Infeasible', 3: 'Unbounded'}.get(res.status, 'Other')
+
+    return x, {
+        'solver': 'highs',
+        'status': status,
+        'objective': model.objective_value(x),
+        'gap': getattr(res, 'mip_gap', None),
+        'node_count': getattr(res, 'mip_node_count', None),
+    }
+
+
+def solve_model(model: ModelBuilder, solver: str = None, **kwargs) -> Tuple[np.ndarray, Dict]:
+    """ Solves model with HiGHS (solver='HIGHS') or a PuLP solver, returns the solution and solver information """
+    if solver == 'HIGHS':
+        return solve_highs(model, **kwargs)
+
+    x, info, _ = solve_pulp(model, solver=solver, **kwargs)
+    return x, info
+
+
+def solve_decomposed(model: ModelBuilder,
+                     solver: str = None,
+                     n_jobs: int = 1,
+                     warm_start: np.ndarray = None,
+                     **kwargs,
+                     ) -> Tuple[np.ndarray, Dict]:
+    """
+    Splits model into independent subproblems (ModelBuilder.split) and solves them in n_jobs
+    processes. Subproblems for which x = 0 is optimal (e.g. without any target) are not solved.
+    Returns the merged solution and solver information (the status is 'Optimal' only if every
+    subproblem was solved to optimality).
+    """
+    parts = model.split()
+    to_solve = [(cols, sub) for cols, sub in parts if not sub.zero_is_optimal()]
+    print(f'Solving {len(to_solve)} of {len(parts)} independent subproblems (largest has {max([len(cols) for cols, _ in parts], default=0)} variables)')
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(solve_model)(sub, solver=solver, warm_start=warm_start[cols] if warm_start is not None else None, **kwargs)
+        for cols, sub in to_solve
+    )
+
+    x = np.zeros(model.n_cols)
+    statuses = set()
+    info = {
+        'solver': 'highs' if solver == 'HIGHS' else ('gurobi' if solver == 'GUROBI' else 'cbc'),
+        'subproblems': len(parts),
+        'subproblems_solved': len(to_solve),
+    }
+    for (cols, _), (sub_x, sub_info) in zip(to_solve, results):
+        x[cols] = sub_x
+        statuses.add(sub_info['status'])
+        if sub_info.get('gap') is not None:
+            info['gap'] = max(info.get('gap', 0), sub_info['gap'])
+        if sub_info.get('node_count') is not None:
+            info['node_count'] = info.get('node_count', 0) + sub_info['node_count']
+
+    info['status'] = statuses.pop() if len(statuses) == 1 else (', '.join(sorted(statuses)) if statuses else 'Optimal')
+    info['objective'] = model.objective_value(x)
+
+    return x, info
+
@@ -0,0 +1,135 @@
+""" Array-backed connectivity of a RouteGraph """
+from typing import Dict, List, Tuple, Iterable
+from scipy.sparse import csr_matrix
+import numpy as np
+
+
+class Topology:
+    """
+    A Topology is an integer-indexed, read-only snapshot of the connectivity of a RouteGraph.
+    Compound nodes occupy indices [0, n_compounds) and reaction nodes occupy
+    [n_compounds, n_nodes), each in RouteGraph insertion order. Parent and child
+    edges are stored in CSR form: the parents of node i are
+    parent_ind[parent_ptr[i]:parent_ptr[i+1]] (and likewise for children).
+    """
+    def __init__(self,
+                 smiles: List[str],
+                 is_rxn: np.ndarray,
+                 parent_ptr: np.ndarray,
+                 parent_ind: np.ndarray,
+                 child_ptr: np.ndarray,
+                 child_ind: np.ndarray,
+                 ids: List[str] = None,
+                 ) -> None:
+
+        self.smiles = smiles
+        self.is_rxn = np.asarray(is_rxn, dtype=bool)
+        self.parent_ptr = np.asarray(parent_ptr, dtype=np.int64)
+        self.parent_ind = np.asarray(parent_ind, dtype=np.int64)
+        self.child_ptr = np.asarray(child_ptr, dtype=np.int64)
+        self.child_ind = np.asarray(child_ind, dtype=np.int64)
+        self.ids = ids if ids is not None else [None]*len(smiles)
+
+        self._index = None
+        self._id_index = None
+
+        return
+
+    @classmethod
+    def from_nodes(cls, compound_nodes: Iterable, reaction_nodes: Iterable) -> 'Topology':
+        """ Compiles a Topology from CompoundNodes and ReactionNodes (e.g. RouteGraph.compound_nodes.values()) """
+        compound_nodes = list(compound_nodes)
+        nodes = [*compound_nodes, *reaction_nodes]
+        index = {node.smiles: ind for ind, node in enumerate(nodes)}
+        is_rxn = np.arange(len(nodes)) >= len(compound_nodes)
+
+        parent_counts = np.zeros(len(nodes), dtype=np.int64)
+        child_counts = np.zeros(len(nodes), dtype=np.int64)
+        parent_ind = []
+        child_ind = []
+        for ind, node in enumerate(nodes):
+            parents = [index[smi] for smi in node.parents if smi in index]
+            children = [index[smi] for smi in node.children if smi in index]
+            parent_counts[ind] = len(parents)
+            child_counts[ind] = len(children)
+            parent_ind.extend(parents)
+            child_ind.extend(children)
+
+        topology = cls(
+            smiles=[node.smiles for node in nodes],
+            is_rxn=is_rxn,
+            parent_ptr=np.concatenate([[0], np.cumsum(parent_counts)]),
+            parent_ind=np.array(parent_ind, dtype=np.int64),
+            child_ptr=np.concatenate([[0], np.cumsum(child_counts)]),
+            child_ind=np.array(child_ind, dtype=np.int64),
+            ids=[node.id for node in nodes],
+        )
+        topology._index = index
+
+        return topology
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.is_rxn)
+
+    @property
+    def n_compounds(self) -> int:
+        return int(np.count_nonzero(~self.is_rxn))
+
+    @property
+    def n_reactions(self) -> int:
+        return int(np.count_nonzero(self.is_rxn))
+
+    @property
+    def n_edges(self) -> int:
+        """ Number of reactant/product edges (each edge is stored once as a parent and once as a child) """
+        return len(self.child_ind)
+
+    def compound_indices(self) -> np.ndarray:
+        return np.flatnonzero(~self.is_rxn)
+
+    def reaction_indices(self) -> np.ndarray:
+        return np.flatnonzero(self.is_rxn)
+
+    def index(self, smiles: str) -> int:
+        """ Returns the integer index of the node with the given smiles """
+        if self._index is None:
+            self._index = {smi: ind for ind, smi in enumerate(self.smiles)}
+        return self._index[smiles]
+
+    def parents(self, ind: int) -> np.ndarray:
+        return self.parent_ind[self.parent_ptr[ind]:self.parent_ptr[ind+1]]
+
+    def children(self, ind: int) -> np.ndarray:
+        return self.child_ind[self.child_ptr[ind]:self.child_ptr[ind+1]]
+
+    def n_parents(self) -> np.ndarray:
+        return np.diff(self.parent_ptr)
+
+    def n_children(self) -> np.ndarray:
+        return np.diff(self.child_ptr)
+
+    def parent_edges(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Returns arrays (node, parent) with one entry per parent edge """
+        nodes = np.repeat(np.arange(self.n_nodes), self.n_parents())
+        return nodes, self.parent_ind
+
+    def child_edges(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Returns arrays (node, child) with one entry per child edge """
+        nodes = np.repeat(np.arange(self.n_nodes), self.n_children())
+        return nodes, self.child_ind
+
+    def adjacency_matrix(self) -> csr_matrix:
+        """ Returns A with A[child, node] = 1 for every child of every node """
+        nodes, children = self.child_edges()
+        data = (np.ones(len(nodes)), (children, nodes))
+        return csr_matrix(data, shape=(self.n_nodes, self.n_nodes))
+
+    def id_to_ind(self) -> Dict[str, int]:
+        return {idd: ind for ind, idd in enumerate(self.ids)}
+
+    def index_from_id(self, id: str) -> int:
+        """ Returns the integer index of the node with the given ID (e.g. 'R12') """
+        if self._id_index is None:
+            self._id_index = self.id_to_ind()
+        return self._id_index[id]
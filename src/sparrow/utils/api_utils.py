@@ -12,20 +12,34 @@ import urllib3
 from joblib import Parallel, delayed
 from tqdm import tqdm
 from pathlib import Path
+from sparrow.utils.http_client import get_client, ASKCOS_TIMEOUT
 
 urllib3.disable_warnings()
 
-def post_and_get(host_post, host_results, params, sleep_time = 10, timeout = 650):
-    req = requests.post(host_post, data=params, verify=False)
+def json_or_empty(response):
+    """ Parsed json body of a successful response, or {} if the request failed or the body is not a json object """
+    if response.status_code != 200:
+        return {}
     try:
-        task_id = req.json()['task_id']
-    except KeyError:
-        return {} , {}
-    results = requests.get(host_results + 'task/{}'.format(task_id), verify = False)
+        body = response.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+def post_and_get(host_post, host_results, params, sleep_time = 10, timeout = 650):
+    """ Submits an ASKCOS celery task and polls its result until it is complete, failed or timeout 
+    seconds have passed. Requests go through the shared HTTP client, which retries transient errors 
+    (but only resends the task if ASKCOS never received it). If the task could not be submitted or 
+    a poll fails, the result is {} """
+    client = get_client()
+    request = json_or_empty(client.post(host_post, data=params, timeout=ASKCOS_TIMEOUT, verify=False))
+    if 'task_id' not in request:
+        return request, {}
+    url = host_results + 'task/{}'.format(request['task_id'])
+    result = json_or_empty(client.get(url, timeout=ASKCOS_TIMEOUT, verify=False))
     clock = 0
-    while (not results.json()['complete'] and not results.json().pop('failed', False) and clock <= timeout):
+    while (result and not result.get('complete', False) and not result.get('failed', False) and clock <= timeout):
         time.sleep(sleep_time)
-        results = requests.get(host_results + 'task/{}'.format(task_id), verify = False)
+        result = json_or_empty(client.get(url, timeout=ASKCOS_TIMEOUT, verify=False))
         clock += sleep_time
-    return req.json(), results.json()
-
+    return request, result
@@ -0,0 +1,162 @@
+"""
+Compact binary, memory-mappable storage of a RouteGraph.
+
+Layout (little endian):
+    8 bytes     magic (b'SPRWGRPH')
+    uint32      format version
+    uint64      header length in bytes
+    header      utf-8 json with counts and the offset, dtype and length of every section
+    sections    raw arrays, each starting at a multiple of ALIGNMENT bytes
+
+Node i is a compound for i < n_compounds and a reaction otherwise. Edges are stored in
+CSR form (see sparrow.topology.Topology), numeric attributes as float64 columns with NaN
+for missing values, boolean attributes as bits of a uint16 flags column, and strings
+(smiles, IDs and json-encoded conditions) as string tables of utf-8 bytes plus offsets.
+"""
+from typing import Dict, List, Union, Optional
+from pathlib import Path
+import numpy as np
+import json
+import mmap
+import struct
+
+from sparrow.topology import Topology
+
+MAGIC = b'SPRWGRPH'
+VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sIQ')
+
+# bits of the flags column
+FLAGS = {
+    'buyable': 1 << 0,
+    'buyable_known': 1 << 1,
+    'is_target': 1 << 2,
+    'is_target_known': 1 << 3,
+    'is_intermediate': 1 << 4,
+    'is_intermediate_known': 1 << 5,
+    'cost_set': 1 << 6,
+    'dummy': 1 << 7,
+    'score_set': 1 << 8,
+    'condition_set': 1 << 9,
+    'selected': 1 << 10,
+}
+
+NUMERIC_COLUMNS = ['cost_per_g', 'reward', 'score', 'penalty', 'max_penalty']
+STRING_TABLES = ['smiles', 'ids', 'conditions']
+
+
+def is_graph_file(filename: Union[str, Path]) -> bool:
+    """ Returns True if the file starts with the magic bytes of the binary graph format """
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def encode_strings(strings: List[str]):
+    """ Encodes a list of strings as (offsets, utf-8 data) """
+    encoded = [s.encode('utf-8') for s in strings]
+    lengths = np.fromiter((len(s) for s in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+def write_graph_file(filename: Union[str, Path],
+                     n_compounds: int,
+                     arrays: Dict[str, np.ndarray],
+                     strings: Dict[str, List[str]],
+                     ) -> None:
+    """
+    Writes a graph file. arrays must include parent_ptr, parent_ind, child_ptr, child_ind,
+    flags and the NUMERIC_COLUMNS; strings must include the STRING_TABLES.
+    """
+    sections = {}
+    for name, arr in arrays.items():
+        sections[name] = np.ascontiguousarray(arr)
+    for name, values in strings.items():
+        sections[f'{name}_offsets'], sections[f'{name}_data'] = encode_strings(values)
+
+    n_nodes = len(sections['flags'])
+    header = {'n_nodes': n_nodes, 'n_compounds': n_compounds, 'sections': {}}
+
+    # offsets depend on the header length, so lay out sections relative to the data start
+    offset = 0
+    for name, arr in sections.items():
+        header['sections'][name] = {'offset': offset, 'dtype': arr.dtype.str, 'count': int(arr.size)}
+        offset += -(-arr.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(_PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    with open(filename, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, arr in sections.items():
+            f.seek(data_start + header['sections'][name]['offset'])
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+
+    return
+
+
+class GraphFile:
+    """
+    Read-only, memory-mapped view of a graph file. Arrays are views into the mapped
+    file, so opening a graph costs almost nothing and the pages are shared between
+    processes that open the same file.
+    """
+    def __init__(self, filename: Union[str, Path]) -> None:
+        self.filename = Path(filename)
+
+        with open(self.filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a SPARROW graph file')
+        if version > VERSION:
+            raise ValueError(f'{filename} has graph file version {version}, but only versions <= {VERSION} can be read')
+
+        self.version = version
+        self.header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_len].decode('utf-8'))
+        self.n_nodes = self.header['n_nodes']
+        self.n_compounds = self.header['n_compounds']
+
+        data_start = -(-(_PREAMBLE.size + header_len) // ALIGNMENT) * ALIGNMENT
+        self.arrays = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(sec['dtype']), count=sec['count'], offset=data_start + sec['offset'])
+            for name, sec in self.header['sections'].items()
+        }
+
+        return
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def flag(self, name: str) -> np.ndarray:
+        """ Returns a boolean array with the value of one flag for every node """
+        return (self.arrays['flags'] & FLAGS[name]) > 0
+
+    def string(self, table: str, ind: int) -> str:
+        offsets = self.arrays[f'{table}_offsets']
+        return self.arrays[f'{table}_data'][offsets[ind]:offsets[ind+1]].tobytes().decode('utf-8')
+
+    def strings(self, table: str) -> List[str]:
+        offsets = self.arrays[f'{table}_offsets']
+        data = self.arrays[f'{table}_data'].tobytes()
+        return [data[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def condition(self, ind: int) -> Optional[List]:
+        return json.loads(self.string('conditions', ind))
+
+    def topology(self) -> Topology:
+        """ Returns a Topology whose edge arrays are views into the mapped file """
+        return Topology(
+            smiles=self.strings('smiles'),
+            is_rxn=np.arange(self.n_nodes) >= self.n_compounds,
+            parent_ptr=self.arrays['parent_ptr'],
+            parent_ind=self.arrays['parent_ind'],
+            child_ptr=self.arrays['child_ptr'],
+            child_ind=self.arrays['child_ind'],
+            ids=self.strings('ids'),
+        )
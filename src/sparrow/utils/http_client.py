@@ -0,0 +1,170 @@
+""" Shared HTTP client for the ASKCOS and ChemSpace APIs, with pooled keep-alive connections, retries and per-endpoint counters """
+from typing import Dict, Iterable, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import requests
+import threading
+import random
+import time
+import re
+import urllib3
+
+urllib3.disable_warnings()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# methods that can be sent twice without changing the result on the server 
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# ASKCOS celery endpoints and ChemSpace: (connect, read) timeouts in seconds 
+ASKCOS_TIMEOUT = (10, 120)
+CHEMSPACE_TIMEOUT = (10, 60)
+
+# path segments that identify a resource (task ids, uuids, numbers) are not part of the endpoint name
+_ID_SEGMENT = re.compile(r'/(?=[^/]*\d)[0-9a-fA-F-]{6,}(?=/|$)|/\d+(?=/|$)')
+
+
+def not_sent(error: Exception) -> bool:
+    """ Whether a request failed before it reached the server (connection refused or not established in time) """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectionRefusedError))
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """ Name under which requests to url are counted, e.g. 'GET host/api/v2/celery/task/{id}' """
+    url = url.split('?')[0].split('://')[-1]
+    return f'{method.upper()} {_ID_SEGMENT.sub("/{id}", url)}'
+
+
+class HTTPClient:
+    """
+    requests.Session with a pool of up to pool_size keep-alive connections per host, shared by all
+    threads. Requests with an idempotent method (e.g. GET) that fail with a connection error, a
+    timeout or one of retry_statuses are retried up to max_retries times, after
+    min(backoff*2**attempt, max_backoff) seconds with full jitter (or the Retry-After time of a 429 or 503,
+    if longer). A POST may have been processed even if it failed (e.g. it timed out after the server
+    accepted it), so it is only retried if it never reached the server (connection refused) or the
+    server asked for it with a 429 or 503 with a Retry-After header, unless the call passes
+    retry_post=True. After the last retry, the last response is returned (callers check its status
+    code) or the last exception is raised. There is no default timeout and TLS certificates are
+    verified: call sites pass (connect, read) timeouts and verify=False where needed. The number of
+    requests, retries and errors and the latency of every endpoint are counted in stats.
+    """
+    def __init__(self,
+                 pool_size: int = 16,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30,
+                 retry_statuses: Iterable[int] = RETRY_STATUSES,
+                 ) -> None:
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = set(retry_statuses)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.stats = {}
+        self._lock = threading.Lock()
+
+        return
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url: str, max_retries: Optional[int] = None, retry_post: bool = False, **kwargs) -> requests.Response:
+        """ Sends a request with retries, see HTTPClient. kwargs (e.g. timeout, verify) are passed on to requests """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        idempotent = method.upper() in IDEMPOTENT_METHODS or retry_post
+        endpoint = endpoint_name(method, url)
+
+        for attempt in range(max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.count(endpoint, time.perf_counter() - start, status=type(e).__name__, retried=attempt > 0)
+                if attempt == max_retries or not (idempotent or not_sent(e)):
+                    raise
+                time.sleep(self.backoff_time(attempt))
+                continue
+
+            self.count(endpoint, time.perf_counter() - start, status=response.status_code, retried=attempt > 0)
+            if attempt == max_retries or not self.should_retry(response, idempotent):
+                return response
+
+            wait = self.backoff_time(attempt)
+            if response.status_code in (429, 503):
+                wait = max(wait, retry_after(response))
+            time.sleep(wait)
+
+        return response
+
+    def should_retry(self, response: requests.Response, idempotent: bool) -> bool:
+        if response.status_code not in self.retry_statuses:
+            return False
+        if idempotent:
+            return True
+        # the server did not process the request and said when to send it again
+        return response.status_code in (429, 503) and 'Retry-After' in response.headers
+
+    def backoff_time(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff*2**attempt, self.max_backoff))
+
+    def count(self, endpoint: str, latency: float, status, retried: bool = False) -> None:
+        """ Records one request to endpoint """
+        with self._lock:
+            entry = self.stats.setdefault(endpoint, {
+                'requests': 0, 'retries': 0, 'errors': 0, 'total_latency_s': 0, 'max_latency_s': 0, 'status': {},
+            })
+            entry['requests'] += 1
+            entry['retries'] += int(retried)
+            entry['total_latency_s'] += latency
+            entry['max_latency_s'] = max(entry['max_latency_s'], latency)
+            entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+            if not (isinstance(status, int) and status < 400):
+                entry['errors'] += 1
+        return
+
+    def summary(self) -> Dict[str, Dict]:
+        """ Returns the counters of every endpoint with its mean latency """
+        with self._lock:
+            return {
+                endpoint: {**entry, 'status': dict(entry['status']), 'mean_latency_s': entry['total_latency_s']/entry['requests']}
+                for endpoint, entry in self.stats.items()
+            }
+
+    def print_summary(self) -> None:
+        for endpoint, entry in self.summary().items():
+            print(f'{endpoint}: {entry["requests"]} requests ({entry["retries"]} retries, {entry["errors"]} errors), '
+                  f'mean latency {1000*entry["mean_latency_s"]:0.0f} ms, max {1000*entry["max_latency_s"]:0.0f} ms')
+        return
+
+
+def retry_after(response: requests.Response) -> float:
+    """ Seconds to wait according to the Retry-After header of response (0 if missing or a date) """
+    try:
+        return max(float(response.headers.get('Retry-After', 0) or 0), 0)
+    except ValueError:
+        return 0
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HTTPClient:
+    """ Returns the HTTPClient shared by all API calls of this process """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+    return _client
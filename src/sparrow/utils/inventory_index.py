@@ -0,0 +1,171 @@
+""" Persistent index of a compound inventory (csv or parquet) for fast lookups of buyability and cost """
+from typing import Dict, Iterable, Iterator, Union
+from pathlib import Path
+import sqlite3
+import time
+import os
+import numpy as np
+import pandas as pd
+
+from sparrow.utils.smiles_utils import canonicalize_all
+
+INDEX_SUFFIXES = ['.sqlite', '.db']
+
+
+def inventory_stamp(filename: Union[str, Path]) -> str:
+    """ Identifies the version of an inventory file by its size and modification time """
+    stat = os.stat(filename)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def iter_inventory(filename: Union[str, Path], chunk_size: int) -> Iterator[pd.DataFrame]:
+    """ Yields the rows of a csv or parquet inventory in data frames of at most chunk_size rows """
+    filename = Path(filename)
+    if filename.suffix in ['.parquet', '.pq']:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Reading a parquet inventory requires pyarrow (pip install pyarrow)')
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        sep = '\t' if filename.suffix in ['.tsv', '.txt'] else ','
+        yield from pd.read_csv(filename, sep=sep, chunksize=chunk_size)
+
+
+def costs_from_chunk(df: pd.DataFrame, default_cost: float) -> np.ndarray:
+    """
+    Returns the cost in USD/g of every row of an inventory chunk. Column names are case-insensitive:
+    a cost_per_g column is used as is, otherwise price (USD) is divided by the pack size, pack_mg or
+    pack_g. Rows without price information (or inventories without these columns) cost default_cost.
+    """
+    columns = {col.lower(): col for col in df.columns}
+    if 'cost_per_g' in columns:
+        costs = pd.to_numeric(df[columns['cost_per_g']], errors='coerce').to_numpy(dtype=float)
+    elif 'price' in columns and ('pack_mg' in columns or 'pack_g' in columns):
+        price = pd.to_numeric(df[columns['price']], errors='coerce').to_numpy(dtype=float)
+        if 'pack_mg' in columns:
+            pack_g = pd.to_numeric(df[columns['pack_mg']], errors='coerce').to_numpy(dtype=float)/1000
+        else:
+            pack_g = pd.to_numeric(df[columns['pack_g']], errors='coerce').to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            costs = price/pack_g
+    else:
+        return np.full(len(df), default_cost, dtype=float)
+
+    costs[~np.isfinite(costs)] = default_cost
+    return costs
+
+
+class InventoryIndex:
+    """
+    SQLite table that maps the canonical smiles of every compound in an inventory to its lowest
+    cost (USD/g). The index is built once from the inventory file (see build), after which opening
+    it takes milliseconds and lookups only read the queried rows. The size and modification time
+    of the inventory are stored with the index, so that is_current can tell if it must be rebuilt.
+    """
+    CHUNK_SIZE = 500 # smiles per query, below the SQLite limit on query parameters
+
+    def __init__(self, filename: Union[str, Path]) -> None:
+        self.filename = Path(filename)
+        if not self.filename.exists():
+            raise FileNotFoundError(f'Inventory index {self.filename} does not exist')
+
+        self._conn = sqlite3.connect(f'file:{self.filename}?mode=ro', uri=True, check_same_thread=False)
+        self.meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+
+        return
+
+    def __len__(self) -> int:
+        return int(self.meta['n_compounds'])
+
+    def is_current(self, inventory_file: Union[str, Path]) -> bool:
+        return self.meta.get('stamp') == inventory_stamp(inventory_file)
+
+    def lookup(self, canonical_smis: Iterable[str]) -> Dict[str, float]:
+        """ Returns a dictionary that maps the canonical smiles found in the inventory to their cost """
+        keys = list(set(canonical_smis))
+        found = {}
+        for i in range(0, len(keys), self.CHUNK_SIZE):
+            chunk = keys[i:i + self.CHUNK_SIZE]
+            rows = self._conn.execute(
+                f'SELECT smiles, cost_per_g FROM inventory WHERE smiles IN ({",".join("?"*len(chunk))})',
+                chunk,
+            ).fetchall()
+            found.update(rows)
+
+        return found
+
+    def close(self) -> None:
+        self._conn.close()
+        return
+
+    @classmethod
+    def build(cls,
+              inventory_file: Union[str, Path],
+              filename: Union[str, Path],
+              n_jobs: int = 1,
+              chunk_size: int = 500000,
+              smiles_col: str = 'SMILES',
+              default_cost: float = 0,
+              ) -> 'InventoryIndex':
+        """
+        Builds the index of inventory_file (csv, tsv or parquet with a smiles column, see
+        costs_from_chunk for the cost columns) at filename. The inventory is read in chunks of
+        chunk_size rows whose smiles are canonicalized in n_jobs processes. The index is written
+        to a temporary file first, so an interrupted build never leaves a partial index behind.
+        """
+        inventory_file, filename = Path(inventory_file), Path(filename)
+        tmp_file = filename.with_name(filename.name + '.tmp')
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+        start = time.time()
+        conn = sqlite3.connect(str(tmp_file))
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE staging (smiles TEXT NOT NULL, cost_per_g REAL NOT NULL)')
+
+        n_rows, n_invalid = 0, 0
+        stamp = inventory_stamp(inventory_file)
+        for df in iter_inventory(inventory_file, chunk_size):
+            columns = {col.lower(): col for col in df.columns}
+            if smiles_col.lower() not in columns:
+                conn.close()
+                tmp_file.unlink()
+                raise KeyError(f'Inventory {inventory_file} has no {smiles_col} column (columns: {", ".join(df.columns)})')
+
+            smis = df[columns[smiles_col.lower()]].fillna('').astype(str)
+            canonical = canonicalize_all(smis, n_jobs=n_jobs)
+            costs = costs_from_chunk(df, default_cost)
+            rows = [(smiles, cost) for smiles, cost in zip(canonical, costs.tolist()) if smiles]
+            conn.executemany('INSERT INTO staging VALUES (?, ?)', rows)
+
+            n_rows += len(df)
+            n_invalid += len(df) - len(rows)
+            print(f'Indexed {n_rows} rows of {inventory_file} ({time.time() - start:0.1f} s)')
+
+        # one row per compound, with the cheapest offer
+        conn.execute('CREATE TABLE inventory (smiles TEXT PRIMARY KEY, cost_per_g REAL NOT NULL) WITHOUT ROWID')
+        conn.execute('INSERT INTO inventory SELECT smiles, MIN(cost_per_g) FROM staging GROUP BY smiles')
+        conn.execute('DROP TABLE staging')
+        n_compounds = conn.execute('SELECT COUNT(*) FROM inventory').fetchone()[0]
+
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('inventory', str(inventory_file.resolve())),
+            ('stamp', stamp),
+            ('built', str(time.time())),
+            ('n_rows', str(n_rows)),
+            ('n_compounds', str(n_compounds)),
+        ])
+        conn.commit()
+        conn.execute('VACUUM')
+        conn.close()
+        os.replace(tmp_file, filename)
+
+        if n_invalid > 0:
+            print(f'Skipped {n_invalid} inventory rows whose smiles could not be parsed')
+        print(f'Built index of {n_compounds} compounds from {n_rows} rows at {filename} in {time.time() - start:0.1f} s')
+
+        return cls(filename)
@@ -0,0 +1,146 @@
+""" Append-only journal of the updates made to a RouteGraph while it is enriched with costs, conditions and scores """
+from typing import Dict, Union
+from pathlib import Path
+import hashlib
+import warnings
+import json
+import os
+
+
+def graph_hash(graph) -> str:
+    """ Hash of the nodes of graph (reaction smiles include their edges), identifies the graph a journal was recorded on """
+    h = hashlib.sha256()
+    for smiles in sorted(graph.nodes()):
+        h.update(smiles.encode('utf-8') + b'\n')
+    return h.hexdigest()[:16]
+
+
+class EnrichmentJournal:
+    """
+    Records per-node updates (kind 'cost', 'condition' or 'score') as json lines. Records are
+    fsynced every batch_size records, so an interrupted run loses at most one batch. Replaying
+    the journal onto the same graph restores every recorded update, and is_done() tells the
+    enrichment loops which nodes can be skipped. The first line of the file is a header (e.g. the
+    graph hash and the coster's cache key) that identifies what the records were computed for. A
+    journal whose header differs from the current one is not replayed but moved aside.
+    """
+    KINDS = ['cost', 'condition', 'score']
+
+    def __init__(self, filename: Union[str, Path], header: Dict = None, batch_size: int = 20) -> None:
+        self.filename = Path(filename)
+        self.header = {'kind': 'header', **(header or {})}
+        self.batch_size = batch_size
+        self.completed = {kind: set() for kind in self.KINDS}
+        self.n_records = 0
+
+        self._file = None
+        self._unsynced = 0
+
+        return
+
+    def record(self, kind: str, smiles: str, **values) -> None:
+        """ Appends one update to the journal """
+        if self._file is None:
+            new = not self.filename.exists() or self.filename.stat().st_size == 0
+            self._file = open(self.filename, 'a')
+            if new:
+                self._file.write(json.dumps(self.header) + '\n')
+
+        self._file.write(json.dumps({'kind': kind, 'smiles': smiles, **values}) + '\n')
+        self.completed[kind].add(smiles)
+        self.n_records += 1
+        self._unsynced += 1
+
+        if self._unsynced >= self.batch_size:
+            self.flush()
+
+        return
+
+    def flush(self) -> None:
+        """ Forces all recorded updates to disk """
+        if self._file is not None and self._unsynced > 0:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        return
+
+    def is_done(self, kind: str, smiles: str) -> bool:
+        return smiles in self.completed[kind]
+
+    def read_header(self) -> Dict:
+        """ Returns the header of the journal file, or None if it has none """
+        with open(self.filename, 'rb') as f:
+            try:
+                header = json.loads(f.readline())
+            except json.JSONDecodeError:
+                return None
+        return header if isinstance(header, dict) and header.get('kind') == 'header' else None
+
+    def replay(self, graph) -> int:
+        """ Applies all updates in the journal file to the nodes of graph, returns the number applied """
+        if not self.filename.exists() or self.filename.stat().st_size == 0:
+            return 0
+
+        if self.read_header() != self.header:
+            stale = self.filename.with_name(self.filename.name + '.stale')
+            warnings.warn(f'{self.filename} was recorded for another graph or coster, moved it to {stale} instead of replaying it')
+            os.replace(self.filename, stale)
+            return 0
+
+        n_applied = 0
+        with open(self.filename, 'rb') as f:
+            valid_bytes = len(f.readline())
+            for line in f:
+                # the last line may be partially written if the run was interrupted
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                valid_bytes += len(line)
+
+                node = graph.nodes().get(entry['smiles'], None)
+                if node is None:
+                    continue
+
+                if entry['kind'] == 'cost':
+                    node.update(buyable=entry['buyable'], cost_per_g=entry['cost_per_g'])
+                elif entry['kind'] == 'condition':
+                    node.update_condition(entry['condition'])
+                elif entry['kind'] == 'score':
+                    node.update(score=entry['score'])
+
+                self.completed[entry['kind']].add(entry['smiles'])
+                n_applied += 1
+
+        if valid_bytes < self.filename.stat().st_size:
+            # drop the partial record so that new records start on a fresh line
+            with open(self.filename, 'r+b') as f:
+                f.truncate(valid_bytes)
+
+        self.n_records += n_applied
+
+        return n_applied
+
+    def compact(self, graph, filename: Union[str, Path]) -> None:
+        """ Writes graph, including all journaled updates, to filename and empties the journal """
+        self.close()
+
+        tmp_file = Path(filename).with_suffix('.tmp')
+        graph.to_json(tmp_file)
+        os.replace(tmp_file, filename)
+
+        if self.filename.exists():
+            self.filename.unlink()
+        self.completed = {kind: set() for kind in self.KINDS}
+        self.n_records = 0
+
+        return
+
+    def close(self) -> None:
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return
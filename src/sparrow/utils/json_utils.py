@@ -3,12 +3,14 @@ os.environ['KERAS_BACKEND'] = 'theano'
 
 from rdkit import Chem
 
-from typing import List, Dict, Union
-import requests 
+from typing import List, Dict, Union, Iterable
+from sparrow.utils.http_client import get_client, ASKCOS_TIMEOUT
 import json
+import codecs
 import numpy as np 
 from pathlib import Path
-from tqdm import tqdm 
+from tqdm import tqdm
+from joblib import Parallel, delayed
 
 
 def build_retro_graph_local(
@@ -38,6 +40,7 @@ def build_retro_graph_local(
     mols = [Chem.MolFromSmiles(smi) for smi in target_smis]
     
     is_first_target = True
+    builder = StorageBuilder(storage)
     
     Tree = MCTS(nproc=n_cpus)
 
@@ -61,9 +64,10 @@ def build_retro_graph_local(
 
         print('done for target {}'.format(smiles))
 
-        storage = storage_from_paths(paths, storage)
+        builder.add_paths(paths)
 
     Tree.stop()
+    storage = builder.storage()
 
     with open(filename, 'w') as f:
         json.dump(make_dict_jsonable(storage), f, indent="\t")
@@ -83,7 +87,7 @@ def build_retro_graph_api(
         time_per_target: int = 15,
     ) -> Dict: 
     
-    storage = {} 
+    builder = StorageBuilder()
     mols = [Chem.MolFromSmiles(smi) for smi in target_smis]
 
     for mol in tqdm(mols): 
@@ -97,62 +101,139 @@ def build_retro_graph_api(
             'return_first': 'false'
         }
         
-        resp = requests.get(host+'/api/treebuilder/', params=params, verify=False)
+        # the tree search runs synchronously within this request, so the read timeout allows for the whole search 
+        resp = get_client().get(
+            host+'/api/treebuilder/', params=params, verify=False, max_retries=1,
+            timeout=(ASKCOS_TIMEOUT[0], float(time_per_target) + ASKCOS_TIMEOUT[1]),
+        )
         trees = resp.json()['trees']
-        storage = storage_from_paths(trees, storage)
+        builder.add_paths(trees)
+        storage = builder.storage()
         
         with open(filename, 'w') as f:
             json.dump(make_dict_jsonable(storage), f, indent="\t")
     
     return storage
 
-def storage_from_api_response(response, storage=None) -> Dict: 
-    tree = response['result']['output']
-    storage = storage_from_paths(tree, storage)
-    return storage 
+class StorageBuilder: 
+    """ 
+    Builds a storage dictionary ({'Compound Nodes': [...], 'Reaction Nodes': [...]}) from 
+    ASKCOS trees. Entries are indexed by smiles and trees are traversed iteratively, so adding 
+    a tree costs time linear in its size regardless of how large the storage already is. 
+    Entries are kept in order of first appearance (children before parents, as in a 
+    depth-first traversal) and parents in order of first appearance. 
+    """
+    def __init__(self, storage: Dict = None) -> None: 
+        self.compounds = {}
+        self.reactions = {}
 
-def storage_from_paths(paths, storage=None) -> Dict:
-    for path in paths: 
-        storage=update_storage_from_path(path, storage)
-    return storage 
+        if storage is not None: 
+            self.add_storage(storage)
 
-def update_storage_from_path(path, storage=None) -> Dict:
-    if storage is None: 
-        storage = {'Compound Nodes': [],
-                   'Reaction Nodes': []}
-        stored_rsmis = []
-        stored_smis = []
-    else: 
-        stored_rsmis = [r['smiles'] for r in storage['Reaction Nodes']]
-        stored_smis = [c['smiles'] for c in storage['Compound Nodes']]
+        return 
 
-    if len(path['children']) > 0: 
-        for p in path['children']:
-            update_storage_from_path(p, storage)
+    def add_entry(self, smiles: str, parents: Iterable[str]) -> None: 
+        index = self.reactions if '>>' in smiles else self.compounds 
+        entry = index.get(smiles, None)
+        if entry is None: 
+            index[smiles] = dict.fromkeys(parents)
+        else: 
+            entry.update(dict.fromkeys(parents))
+        return 
 
-    if ">>" in path['smiles']: 
-        update_storage_element(storage['Reaction Nodes'], stored_rsmis, path)
-    else:
-        update_storage_element(storage['Compound Nodes'], stored_smis, path) 
+    def add_path(self, path: Dict) -> None: 
+        """ Adds all nodes of one ASKCOS tree """
+        stack = [(path, False)]
+        while stack: 
+            node, children_added = stack.pop()
+            if children_added: 
+                # ^ confusing because ASKCOS take products of reaction to be parents
+                self.add_entry(node['smiles'], [child['smiles'] for child in node['children']])
+            else: 
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node['children']))
+        return 
 
+    def add_paths(self, paths: Iterable[Dict]) -> None: 
+        for path in paths: 
+            self.add_path(path)
+        return 
 
-    return storage 
+    def add_api_response(self, response: Dict) -> None: 
+        self.add_paths(response['result']['output'])
+        return 
 
-def update_storage_element(node_list, stored_smiles, path): 
-    parents = set([p['smiles'] for p in path['children']])
-    # ^ confusing because ASKCOS take products of reaction to be parents
-
-    if path['smiles'] in stored_smiles: 
-        entry = np.where(np.array(stored_smiles)==path['smiles'])[0][0]
-        node_list[entry]['parents'].update(parents)
-    else:
-        entry = {
-            'smiles': path['smiles'], 
-            'parents': parents,
+    def add_storage(self, storage: Dict) -> None: 
+        """ Merges the entries of a storage dictionary into this one """
+        for key in ['Compound Nodes', 'Reaction Nodes']: 
+            for entry in storage.get(key, []): 
+                self.add_entry(entry['smiles'], entry['parents'])
+        return 
+
+    def merge(self, other: 'StorageBuilder') -> 'StorageBuilder': 
+        """ Adds the entries of another builder after the entries of this one """
+        for index, other_index in [(self.compounds, other.compounds), (self.reactions, other.reactions)]: 
+            for smiles, parents in other_index.items(): 
+                if smiles in index: 
+                    index[smiles].update(parents)
+                else: 
+                    index[smiles] = dict(parents)
+        return self 
+
+    def storage(self) -> Dict: 
+        return {
+            'Compound Nodes': [{'smiles': smi, 'parents': list(parents)} for smi, parents in self.compounds.items()],
+            'Reaction Nodes': [{'smiles': smi, 'parents': list(parents)} for smi, parents in self.reactions.items()],
         }
-        node_list.append(entry)
-    
-    return node_list 
+
+def builder_from_tree_files(filenames: Iterable[Union[str, Path]]) -> StorageBuilder: 
+    """ Combines the ASKCOS outputs saved in tree files ({target: result}) into one StorageBuilder """
+    builder = StorageBuilder()
+    for filename in filenames: 
+        with open(filename, 'r') as f: 
+            entry = json.load(f)
+        for smi, path in entry.items(): 
+            if 'output' in path and len(path['output'])>0: 
+                builder.add_api_response({"result": path})
+    return builder 
+
+def combine_tree_files(filenames: List[Union[str, Path]], n_jobs: int = 1, files_per_job: int = 100) -> Dict: 
+    """ 
+    Combines the ASKCOS outputs saved in tree files into one storage dictionary. With n_jobs > 1, 
+    each worker combines a group of at most files_per_job consecutive files into a partial storage, 
+    which is merged into the combined storage as soon as it is returned (in group order), so only 
+    the partials that finish ahead of an earlier group are held in memory at once. Merging keeps 
+    the first-appearance order of entries and parents, so the output is identical to combining the 
+    files serially. 
+    """
+    filenames = list(filenames)
+    if n_jobs == 1 or len(filenames) <= files_per_job: 
+        return builder_from_tree_files(tqdm(filenames, desc='Combining ASKCOS outputs')).storage()
+
+    groups = [filenames[i:i+files_per_job] for i in range(0, len(filenames), files_per_job)]
+    builder = StorageBuilder()
+    partials = Parallel(n_jobs=n_jobs, return_as='generator')(
+        delayed(builder_from_tree_files)(group) for group in groups
+    )
+    for partial in tqdm(partials, total=len(groups), desc='Combining ASKCOS outputs'): 
+        builder.merge(partial)
+
+    return builder.storage()
+
+def storage_from_api_response(response, storage=None) -> Dict: 
+    tree = response['result']['output']
+    storage = storage_from_paths(tree, storage)
+    return storage 
+
+def storage_from_paths(paths, storage=None) -> Dict:
+    builder = StorageBuilder(storage)
+    builder.add_paths(paths)
+    return builder.storage()
+
+def update_storage_from_path(path, storage=None) -> Dict:
+    builder = StorageBuilder(storage)
+    builder.add_path(path)
+    return builder.storage()
 
 def make_dict_jsonable(storage): 
     """ Convert sets in storage dict to lists """
@@ -168,3 +249,89 @@ def save_storage_dict(storage, filename):
         json.dump(make_dict_jsonable(storage), f, indent="\t")
     return 
 
+
+def iter_node_records(filename: Union[str, Path], chunk_size: int = 2**20, desc: str = None): 
+    """ 
+    Yields (section, record) pairs, e.g. ('Compound Nodes', {'smiles': ...}), from a json 
+    file with the layout written by RouteGraph.to_json or save_storage_dict. Records are 
+    parsed one at a time from a buffered reader, so the whole file is never held in memory. 
+    If desc is given, progress is reported in bytes read. 
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    total = Path(filename).stat().st_size
+    prog_bar = tqdm(total=total, desc=desc, unit='B', unit_scale=True) if desc else None 
+
+    with open(filename, 'rb') as f: 
+        buffer = ''
+        pos = 0
+        eof = False 
+
+        def fill(): 
+            """ Reads the next chunk, dropping the consumed part of the buffer """
+            nonlocal buffer, pos, eof 
+            chunk = f.read(chunk_size)
+            if prog_bar is not None: 
+                prog_bar.update(len(chunk))
+            eof = len(chunk) == 0
+            buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+
+        def next_char(): 
+            """ Skips whitespace and returns the next character without consuming it """
+            nonlocal pos 
+            while True: 
+                while pos < len(buffer) and buffer[pos].isspace(): 
+                    pos += 1
+                if pos < len(buffer): 
+                    return buffer[pos]
+                if eof: 
+                    raise ValueError(f'Unexpected end of file in {filename}')
+                fill()
+
+        def expect(chars): 
+            nonlocal pos 
+            char = next_char()
+            if char not in chars: 
+                raise ValueError(f'Expected one of {chars} at "{buffer[pos:pos+50]}" in {filename}')
+            pos += 1
+            return char 
+
+        def decode_value(): 
+            """ Decodes one complete json value, reading more of the file if it is incomplete """
+            nonlocal pos 
+            next_char()
+            while True: 
+                try: 
+                    value, pos = decoder.raw_decode(buffer, pos)
+                    return value 
+                except json.JSONDecodeError: 
+                    if eof: 
+                        raise 
+                    fill()
+
+        expect('{')
+        if next_char() == '}': 
+            return 
+        while True: 
+            section = decode_value()
+            expect(':')
+            if next_char() == '[': 
+                pos += 1
+                if next_char() == ']': 
+                    pos += 1
+                else: 
+                    while True: 
+                        yield section, decode_value()
+                        if expect(',]') == ']': 
+                            break 
+            else: 
+                decode_value()
+
+            if expect(',}') == '}': 
+                break 
+
+    if prog_bar is not None: 
+        prog_bar.close()
+
+    return 
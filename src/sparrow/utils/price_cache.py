@@ -0,0 +1,101 @@
+""" Persistent cache of compound buyability and prices, shared by all runs that use the same file """
+from typing import Dict, Iterable, Optional, Tuple, Union
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+from sparrow.utils.smiles_utils import canonical_smiles
+
+DEFAULT_PRICE_CACHE = Path.home()/'.cache'/'sparrow'/'prices.sqlite'
+
+
+class PriceCache:
+    """
+    SQLite table of (buyable, cost_per_g) results keyed by canonical smiles and a source, a string
+    that identifies the coster and its settings (e.g. ChemSpace filters), so results found with
+    other filters are never reused. Entries older than ttl_days are treated as missing and are
+    overwritten when the compound is searched again (ttl_days=None keeps entries forever). Unbuyable
+    compounds are cached too. Lookups and inserts are done in bulk, and the database is opened in
+    WAL mode so that concurrent runs can share one file. hits, misses and expired entries are counted
+    in stats.
+    """
+    CHUNK_SIZE = 500 # smiles per query, below the SQLite limit on query parameters
+
+    def __init__(self, filename: Union[str, Path] = DEFAULT_PRICE_CACHE, ttl_days: Optional[float] = 30) -> None:
+        self.filename = Path(filename)
+        self.ttl_days = ttl_days
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'inserted': 0}
+
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._canonical = {}
+        self._conn = sqlite3.connect(str(self.filename), timeout=60, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS prices ('
+            'smiles TEXT NOT NULL, source TEXT NOT NULL, buyable INTEGER NOT NULL, '
+            'cost_per_g REAL, updated REAL NOT NULL, PRIMARY KEY (smiles, source)) WITHOUT ROWID'
+        )
+        self._conn.commit()
+
+        return
+
+    def key(self, smiles: str) -> str:
+        """ Canonical smiles under which smiles is cached (smiles itself if RDKit cannot parse it) """
+        if smiles not in self._canonical:
+            self._canonical[smiles] = canonical_smiles(smiles) or smiles
+        return self._canonical[smiles]
+
+    def lookup(self, smis: Iterable[str], source: str) -> Dict[str, Tuple[bool, Optional[float]]]:
+        """ Returns a dictionary that maps the smiles in smis with an unexpired entry for source to (buyable, cost) """
+        smis = list(dict.fromkeys(smis))
+        keys = {smiles: self.key(smiles) for smiles in smis}
+        unique_keys = list(set(keys.values()))
+        min_updated = -1 if not self.ttl_days else time.time() - self.ttl_days*86400
+
+        found = {}
+        n_expired = 0
+        with self._lock:
+            for i in range(0, len(unique_keys), self.CHUNK_SIZE):
+                chunk = unique_keys[i:i + self.CHUNK_SIZE]
+                rows = self._conn.execute(
+                    f'SELECT smiles, buyable, cost_per_g, updated FROM prices '
+                    f'WHERE source = ? AND smiles IN ({",".join("?"*len(chunk))})',
+                    [source, *chunk],
+                ).fetchall()
+                for key, buyable, cost, updated in rows:
+                    if updated < min_updated:
+                        n_expired += 1
+                    else:
+                        found[key] = (bool(buyable), cost)
+
+        results = {smiles: found[key] for smiles, key in keys.items() if key in found}
+        self.stats['hits'] += len(results)
+        self.stats['misses'] += len(smis) - len(results)
+        self.stats['expired'] += n_expired
+        return results
+
+    def insert(self, results: Dict[str, Tuple[bool, Optional[float]]], source: str) -> None:
+        """ Stores (buyable, cost) results for source, replacing older entries """
+        if len(results) == 0:
+            return
+
+        now = time.time()
+        rows = [(self.key(smiles), source, int(bool(buyable)), cost, now) for smiles, (buyable, cost) in results.items()]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+        self.stats['inserted'] += len(rows)
+        return
+
+    def summary(self) -> str:
+        n_lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits']/n_lookups if n_lookups else 0
+        return (f'Price cache {self.filename}: {self.stats["hits"]} hits, {self.stats["misses"]} misses '
+                f'({self.stats["expired"]} expired), {hit_rate:0.1%} hit rate, {self.stats["inserted"]} results stored')
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        return
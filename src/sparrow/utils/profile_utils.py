@@ -0,0 +1,124 @@
+""" Utilities to measure time and memory use of SPARROW """
+from typing import Dict, Union, Optional
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import sys 
+import time
+
+
+def peak_memory_mb(): 
+    """ Returns the peak resident set size of this process in MB, or None if it 
+    cannot be measured on this platform """
+    try: 
+        import resource 
+    except ImportError: 
+        return None 
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # bytes on macOS, kilobytes elsewhere 
+        return peak / 2**20
+    return peak / 2**10
+
+
+def reset_peak_memory() -> bool:
+    """ Resets the peak resident set size reported by current_peak_memory_mb to the current
+    resident set size. Only possible on Linux, returns whether it succeeded. """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def current_peak_memory_mb() -> Optional[float]:
+    """ Returns the peak resident set size in MB since the last reset_peak_memory (Linux),
+    or since the process started on other platforms """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return peak_memory_mb()
+
+
+class Profiler:
+    """
+    Records the wall time and peak resident set size of named stages of a run (e.g. 'graph load',
+    'solve') and telemetry of every solve, and saves them to a json file. Stages that are entered
+    more than once accumulate their time and keep the highest peak. The peak of a stage can only
+    be isolated from earlier stages on Linux, elsewhere it is the peak of the process so far.
+    Memory of worker processes (e.g. joblib) is not included.
+    """
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.solves = []
+        self.http = {}
+        self.per_stage_peak = reset_peak_memory()
+        self._stack = []
+
+        return
+
+    @contextmanager
+    def stage(self, name: str):
+        """ Context manager that records the wall time and peak memory of the enclosed block as stage name """
+        if self._stack:
+            # the peak so far belongs to the enclosing stage
+            self._stack[-1]['peak'] = max(filter(None, [self._stack[-1]['peak'], current_peak_memory_mb()]), default=None)
+        frame = {'peak': None}
+        self._stack.append(frame)
+        reset_peak_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+            peak = max(filter(None, [frame['peak'], current_peak_memory_mb()]), default=None)
+            self._stack.pop()
+            if self._stack and peak is not None:
+                # a nested stage resets the peak, so pass it on to the enclosing stage
+                self._stack[-1]['peak'] = max(filter(None, [self._stack[-1]['peak'], peak]))
+
+            entry = self.stages.setdefault(name, {'wall_time_s': 0, 'peak_rss_mb': None, 'calls': 0})
+            entry['wall_time_s'] += wall_time
+            entry['calls'] += 1
+            if peak is not None:
+                entry['peak_rss_mb'] = max(filter(None, [entry['peak_rss_mb'], peak]))
+
+    def record_solve(self, model, solver_info: Dict, wall_time: float) -> None:
+        """ Records the size of model (a ModelBuilder) and the solver information of one solve """
+        A = model.matrix()
+        self.solves.append({
+            'rows': model.n_rows,
+            'columns': model.n_cols,
+            'nonzeros': int(A.nnz),
+            'integer_columns': int(model.integrality.sum()),
+            'wall_time_s': wall_time,
+            **solver_info,
+        })
+        return
+
+    def record_http(self, stats: Dict) -> None:
+        """ Records the per-endpoint request counters and latencies of an HTTPClient (see HTTPClient.summary) """
+        self.http = stats
+        return
+
+    def to_dict(self) -> Dict:
+        return {
+            'total_wall_time_s': time.perf_counter() - self.start,
+            'peak_rss_mb': peak_memory_mb(),
+            'per_stage_peak': self.per_stage_peak,
+            'stages': self.stages,
+            'solves': self.solves,
+            'http': self.http,
+        }
+
+    def save(self, filename: Union[str, Path]) -> None:
+        print(f'Saving run profile to {filename}')
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent='\t', default=str)
+        return
@@ -0,0 +1,34 @@
+""" Utilities to canonicalize smiles, shared by the route graph and the costers """
+from typing import List, Optional, Sequence
+from joblib import Parallel, delayed
+from rdkit import Chem, RDLogger
+
+
+def canonical_smiles(smiles: str) -> Optional[str]: 
+    """ Returns the RDKit canonical smiles, or None if the smiles cannot be parsed """
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None: 
+        return None 
+    return Chem.MolToSmiles(mol)
+
+
+def _canonical_batch(smis: List[str]) -> List[Optional[str]]: 
+    # unparsable smiles are counted by the caller, one RDKit error each would flood the log 
+    RDLogger.DisableLog('rdApp.error')
+    try: 
+        return [canonical_smiles(smiles) for smiles in smis]
+    finally: 
+        RDLogger.EnableLog('rdApp.error')
+
+
+def canonicalize_all(smis: Sequence[str], n_jobs: int = 1, batch_size: int = 20000) -> List[Optional[str]]: 
+    """ Returns the canonical smiles of every smiles in smis (None for those RDKit cannot parse), 
+    canonicalizing batches of batch_size smiles in n_jobs processes """
+    smis = list(smis)
+    batches = [smis[i:i + batch_size] for i in range(0, len(smis), batch_size)]
+    if n_jobs == 1 or len(batches) <= 1: 
+        results = [_canonical_batch(batch) for batch in batches]
+    else: 
+        results = Parallel(n_jobs=n_jobs)(delayed(_canonical_batch)(batch) for batch in batches)
+    
+    return [smiles for batch in results for smiles in batch]